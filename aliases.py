@@ -0,0 +1,94 @@
+"""
+Metric name mapping for Type B exports
+Brokers label the same monthly rows differently ('Portfolio value', 'Account value',
+'Net liquidation value', ...). METRIC_ALIASES lists the synonyms for each canonical metric
+name used by the rest of the toolkit; the lookup index is compiled once at import from
+those synonyms after normalisation, so mapping a row label is one dict lookup.
+
+To support a new export, add its labels to the canonical metric they mean.
+"""
+
+import re
+import unicodedata
+
+
+# Canonical metric name -> other labels for the same row (canonical names match themselves)
+METRIC_ALIASES = {
+    # Portfolio values
+    'Portfolio value': ('Account value', 'Total account value', 'Net liquidation value', 'Net asset value',
+                        'Market value', 'Total value', 'Portfolio balance',
+                        'Depotwert', 'Valeur du portefeuille', 'Valor de la cartera', 'Стоимость портфеля'),
+    'At the beginning of the period': ('Beginning of period', 'Beginning value', 'Beginning balance',
+                                       'Opening value', 'Opening balance', 'Start value', 'Starting value',
+                                       'Value at start of period', 'На начало периода'),
+    'At the end of the period': ('End of period', 'Ending value', 'Ending balance', 'Closing value',
+                                 'Closing balance', 'End value', 'Value at end of period', 'На конец периода'),
+    'Change': ('Change in value', 'Value change', 'Net change', 'Изменение'),
+
+    # Profit
+    'Total profit': ('Profit', 'Total P&L', 'Total PnL', 'Net P&L', 'Total gain', 'Total gain/loss',
+                     'Gain/loss', 'Investment gain', 'Gesamtgewinn', 'Profit total', 'Общая прибыль'),
+    'Total profit, %': ('Total profit %', 'Total return %', 'Return %', 'Return, %', 'Total return (%)',
+                        'Profit %', 'Rendite %', 'Общая прибыль, %'),
+    'Profit from price change': ('Price change profit', 'Unrealized P&L', 'Unrealized gain',
+                                 'Unrealized gain/loss', 'Прибыль от изменения цены'),
+    'Net profit from sales': ('Net realized P&L', 'Net realized gain', 'Чистая прибыль от продаж'),
+    'Profit from sales': ('Realized P&L', 'Realized gain', 'Realized gain/loss', 'Прибыль от продаж'),
+    'Dividends': ('Dividend', 'Dividend income', 'Dividends received', 'Dividenden', 'Dividendes',
+                  'Dividendos', 'Дивиденды'),
+    'Taxes': ('Tax', 'Taxes paid', 'Withholding tax', 'Steuern', 'Налоги'),
+    'Commissions': ('Commission', 'Fees', 'Fees and commissions', 'Trading fees', 'Gebühren', 'Комиссии'),
+    'Other': ('Other income', 'Miscellaneous', 'Прочее'),
+
+    # Trading activity
+    'Total Turnover': ('Turnover', 'Trading volume', 'Total volume', 'Umsatz', 'Оборот'),
+    'Total purchases': ('Purchases', 'Buys', 'Total buys', 'Bought', 'Покупки'),
+    'Total sales': ('Sales', 'Sells', 'Total sells', 'Sold', 'Продажи'),
+    'Total trades': ('Trades', 'Number of trades', 'Trade count', 'Transactions', 'Всего сделок'),
+    'Buy trades': ('Buy orders', 'Number of buys', 'Сделки на покупку'),
+    'Sell trades': ('Sell orders', 'Number of sells', 'Сделки на продажу'),
+
+    # Cash flow
+    'Cash funds': ('Cash', 'Cash balance', 'Cash and equivalents', 'Денежные средства'),
+    'Deposited': ('Deposits', 'Contributions', 'Cash in', 'Einzahlungen', 'Внесено'),
+    'Withdrawn': ('Withdrawals', 'Distributions', 'Cash out', 'Auszahlungen', 'Выведено'),
+    'Available funds': ('Available cash', 'Buying power', 'Cash available', 'Свободные средства'),
+
+    # Market comparison
+    'S&P 500 Market Performance': ('S&P 500', 'S&P 500 performance', 'SP500', 'Benchmark'),
+    'S&P 500 Market Performance, %': ('S&P 500 %', 'S&P 500 return %', 'SP500 %', 'Benchmark %'),
+}
+
+# Applied in order to every label (and synonym) before lookup
+NORMALIZATION_RULES = (
+    (re.compile(r'%'), ' pct '),            # 'Total profit, %' == 'Total profit (%)' == 'total profit %'
+    (re.compile(r'&'), ' and '),            # 'P&L' == 'P and L'
+    (re.compile(r'[^\w]+'), ' '),           # punctuation, brackets and repeated spaces
+)
+
+
+def normalize_label(label):
+    """'  Total profit, % ' -> 'total profit pct'"""
+    text = unicodedata.normalize('NFKC', str(label)).casefold()
+    for pattern, replacement in NORMALIZATION_RULES:
+        text = pattern.sub(replacement, text)
+    return text.strip()
+
+
+def compile_aliases(aliases):
+    """{normalised label: canonical metric}; raises ValueError if a label means two metrics"""
+    index = {}
+    for canonical, synonyms in aliases.items():
+        for label in (canonical,) + tuple(synonyms):
+            key = normalize_label(label)
+            if index.setdefault(key, canonical) != canonical:
+                raise ValueError(f"Metric alias '{label}' maps to both '{index[key]}' and '{canonical}'")
+    return index
+
+
+ALIAS_INDEX = compile_aliases(METRIC_ALIASES)
+
+
+def canonical_metric(label):
+    """Canonical metric name for a row label, or None if the label isn't known"""
+    return ALIAS_INDEX.get(normalize_label(label))
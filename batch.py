@@ -0,0 +1,163 @@
+"""
+Batch engine shared by format_all.py and restructure_type_b.py
+Runs a per-file function over many workbooks, serially or across a process pool,
+with per-file error isolation, results printed in input order and a timing summary.
+"""
+
+import io
+import os
+import glob
+import time
+from collections import namedtuple
+from contextlib import redirect_stdout
+from functools import partial
+from itertools import repeat
+
+import instrument
+from output import conflicting_targets
+
+
+FileResult = namedtuple('FileResult', ['filepath', 'ok', 'error', 'output', 'elapsed', 'events', 'skipped'],
+                        defaults=((), False))
+
+# Returned by a file function that deliberately left the file alone (e.g. unchanged since the last run)
+SKIPPED = 'skipped'
+
+
+def add_batch_arguments(parser):
+    """Add the file list, --jobs and output options every batch CLI accepts"""
+    parser.add_argument('files', nargs='+', help='Workbook paths or glob patterns (e.g. *.xlsx)')
+    parser.add_argument('--jobs', '-j', type=int, default=1, metavar='N',
+                        help='Number of worker processes (0 = one per CPU core, default: 1)')
+    parser.add_argument('--profile', nargs='?', const='', default=None, metavar='TRACE',
+                        help='Time each phase and print a summary; optionally write a JSON-lines trace file')
+    parser.add_argument('--out-dir', metavar='DIR',
+                        help='Write results into DIR instead of replacing the input files')
+    parser.add_argument('--resume', action='store_true',
+                        help='Continue an interrupted batch, skipping files it already finished')
+
+
+def expand_file_args(args):
+    """
+    Expand glob patterns (for shells that don't) while keeping explicit paths in order.
+    A file matched more than once (a pattern plus an explicit path) is only listed once.
+    """
+    files_to_process = []
+    seen = set()
+    for arg in args:
+        for filepath in sorted(glob.glob(arg)) if '*' in arg or '?' in arg else [arg]:
+            key = os.path.normcase(os.path.abspath(filepath))
+            if key not in seen:
+                seen.add(key)
+                files_to_process.append(filepath)
+    return files_to_process
+
+
+def resolve_jobs(jobs, file_count):
+    """Turn the --jobs value into a worker count that makes sense for this batch"""
+    if jobs <= 0:
+        jobs = os.cpu_count() or 1
+    return max(1, min(jobs, file_count))
+
+
+def _run_one(func, filepath, profile=False):
+    """Run func on a single file, capturing its output (and phase events) so workers never interleave"""
+    buffer = io.StringIO()
+    events = ()
+    start = time.perf_counter()
+    try:
+        with redirect_stdout(buffer):
+            if profile:
+                with instrument.collect() as events:
+                    result = func(filepath)
+            else:
+                result = func(filepath)
+        skipped = result == SKIPPED
+        ok, error = result is not False and not skipped, None
+    except Exception as e:
+        skipped = False
+        ok, error = False, str(e) or type(e).__name__
+    return FileResult(filepath, ok, error, buffer.getvalue(), time.perf_counter() - start, tuple(events),
+                      skipped)
+
+
+def run_batch(func, files, jobs=1, journal=None, **options):
+    """
+    Apply func(filepath, **options) to every file and return a list of FileResult.
+    func must be a module-level function so it can be sent to worker processes.
+    A file counts as ok unless func raises or returns False; returning SKIPPED marks it
+    skipped instead.
+    Results are printed in the order the files were given, whatever order they finish in.
+    When instrumentation hooks are registered, phase events recorded by the workers are
+    replayed to them here, file by file.
+    With a journal (see output.py), files it already lists as done are left out and each
+    finished file is recorded as its result comes in.
+    Files whose output would overwrite another input's (same name, one --out-dir) are not
+    processed; each fails with an error naming the other.
+    """
+    results = []
+    conflicts = conflicting_targets(files, options.get('out_dir'))
+    for filepath in files:
+        if filepath in conflicts:
+            error = f"same output file as {conflicts[filepath]} in {options['out_dir']} - not processed"
+            results.append(_report(FileResult(filepath, False, error, '', 0.0), journal))
+    files = [f for f in files if f not in conflicts]
+
+    if journal is not None:
+        remaining = [f for f in files if not journal.is_done(f)]
+        if len(remaining) < len(files):
+            print(f"→ Resuming: {len(files) - len(remaining)} file(s) already done, {len(remaining)} to go")
+        files = remaining
+
+    task = partial(func, **options) if options else func
+    workers = resolve_jobs(jobs, len(files))
+    profile = instrument.enabled()
+
+    if workers == 1:
+        for filepath in files:
+            results.append(_report(_run_one(task, filepath, profile), journal))
+    else:
+        # Imported here so single-file runs don't pay for the multiprocessing machinery
+        from concurrent.futures import ProcessPoolExecutor
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            for result in executor.map(_run_one, repeat(task), files, repeat(profile)):
+                results.append(_report(result, journal))
+
+    return results
+
+
+def _report(result, journal=None):
+    """Print one file's captured output followed by its error, if any, and journal it"""
+    if result.output:
+        print(result.output, end='')
+    if result.error is not None:
+        print(f"✗ Error processing {result.filepath}: {result.error}\n")
+    for event in result.events:
+        instrument.emit(event)
+    if journal is not None:
+        journal.record(result)
+    return result
+
+
+def print_timing_summary(results, wall_time):
+    """Print per-file timings plus batch totals"""
+    if not results:
+        return
+
+    print("TIMING SUMMARY")
+    print("-" * 70)
+    for result in results:
+        if result.error is not None:
+            status = '✗'
+        elif result.ok:
+            status = '✓'
+        else:
+            status = '-'
+        print(f"  {status} {result.elapsed:8.2f}s  {os.path.basename(result.filepath)}")
+
+    busy_time = sum(r.elapsed for r in results)
+    slowest = max(results, key=lambda r: r.elapsed)
+    print("-" * 70)
+    print(f"  Files: {len(results)}   Wall time: {wall_time:.2f}s   "
+          f"Worker time: {busy_time:.2f}s   Throughput: {len(results) / wall_time if wall_time else 0:.1f} files/s")
+    print(f"  Slowest: {os.path.basename(slowest.filepath)} ({slowest.elapsed:.2f}s)")
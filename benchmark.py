@@ -0,0 +1,326 @@
+"""
+Benchmark harness for the portfolio toolkit
+Generates synthetic Type A / Type B workbooks at a configurable size, then times each
+stage separately (restructure, format, KPI calculation, save) in a fresh process so peak
+RSS belongs to that stage alone. The startup phase times one `format_all.py --detect-only`
+interpreter per file, plus a bare `import format_all`. Results are written as JSON so runs
+from different versions can be compared with --compare.
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import subprocess
+import argparse
+import platform
+import tempfile
+from contextlib import redirect_stdout
+from datetime import datetime
+from io import StringIO
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+import openpyxl
+from openpyxl import Workbook, load_workbook
+
+from periods import month_label
+
+
+# Rows every Type B export carries, in export order ('' = blank separator row)
+STANDARD_METRICS = [
+    'Portfolio value', 'At the beginning of the period', 'At the end of the period', 'Change', '',
+    'Total profit', 'Total profit, %', 'Net profit from sales', 'Profit from price change',
+    'Profit from sales', 'Dividends', 'Taxes', 'Commissions', 'Other', '',
+    'Turnover', 'Total purchases', 'Total sales', '',
+    'Total trades', 'Buy trades', 'Sell trades', '',
+    'Cash funds', 'Deposited', 'Withdrawn', 'Available funds', '',
+    'S&P 500 Market Performance', 'S&P 500 Market Performance, %',
+]
+
+PHASES = ('restructure', 'format', 'kpis', 'save', 'startup')
+
+STARTUP_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'format_all.py')
+
+
+# ========== SYNTHETIC WORKBOOKS ==========
+
+def _month_labels(months, start=(2025, 3)):
+    year, month = start
+    labels = []
+    for _ in range(months):
+        labels.append(month_label((year, month)))
+        month += 1
+        if month > 12:
+            year, month = year + 1, 1
+    return labels
+
+
+def _synthetic_series(rng, months):
+    """Consistent start/end values, profits and returns for one account"""
+    value = rng.uniform(10000, 500000)
+    starts, ends, profits, percents = [], [], [], []
+    for _ in range(months):
+        pct = rng.gauss(0.8, 4.0)
+        profit = value * pct / 100
+        starts.append(round(value, 4))
+        value += profit + rng.uniform(-500, 2000)
+        ends.append(round(value, 4))
+        profits.append(round(profit, 4))
+        percents.append(round(pct, 2))
+    return starts, ends, profits, percents
+
+
+def generate_type_b(path, months=12, metric_rows=30, seed=0):
+    """Write a Type B (single Data sheet) workbook with `months` columns and about `metric_rows` rows"""
+    rng = random.Random(seed)
+    starts, ends, profits, percents = _synthetic_series(rng, months)
+    known = {
+        'Portfolio value': ends,
+        'At the beginning of the period': starts,
+        'At the end of the period': ends,
+        'Change': [round(e - s, 4) for s, e in zip(starts, ends)],
+        'Total profit': profits,
+        'Total profit, %': percents,
+        'Dividends': [round(rng.uniform(0, 400), 2) for _ in range(months)],
+    }
+
+    names = list(STANDARD_METRICS)
+    while len(names) < metric_rows:
+        names.append(f'Custom metric {len(names) - len(STANDARD_METRICS) + 1}')
+
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet('Data')
+    ws.append([f'         Portfolio report: Synthetic {seed}'])
+    ws.append([])
+    ws.append([])
+    ws.append([None] + _month_labels(months))
+    for name in names[:max(metric_rows, 1)]:
+        if not name:
+            ws.append([])
+        elif name in known:
+            ws.append([name] + known[name])
+        else:
+            ws.append([name] + [rng.choice(['-', round(rng.uniform(-1000, 5000), 2)]) for _ in range(months)])
+    wb.save(path)
+    return path
+
+
+def generate_type_a(path, months=12, metric_rows=30, extra_rows=0, seed=0):
+    """Write a Type A workbook (restructured synthetic export) with extra trailing Monthly Performance rows"""
+    from restructure_type_b import restructure_type_b_to_type_a
+
+    generate_type_b(path, months, metric_rows, seed)
+    with redirect_stdout(StringIO()):
+        restructure_type_b_to_type_a(path)
+
+    if extra_rows:
+        rng = random.Random(seed + 1)
+        wb = load_workbook(path)
+        ws = wb['Monthly Performance']
+        first_row = max(ws.max_row + 1, 34)
+        for row in range(first_row, first_row + extra_rows):
+            ws.cell(row=row, column=1).value = f'Detail row {row}'
+            for col in range(2, months + 2):
+                ws.cell(row=row, column=col).value = round(rng.uniform(-1000, 1000), 2)
+        wb.save(path)
+    return path
+
+
+# ========== PHASES ==========
+
+def _peak_rss_mb(children=False):
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_CHILDREN if children else resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return round(peak / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
+
+
+def _sheet_cells(path, sheet_names=None):
+    """Non-empty cells in a workbook (write-only files carry no dimensions, so count them)"""
+    wb = load_workbook(path, read_only=True)
+    try:
+        return sum(1 for ws in wb.worksheets if sheet_names is None or ws.title in sheet_names
+                   for row in ws.iter_rows(values_only=True) for value in row if value is not None)
+    finally:
+        wb.close()
+
+
+def _run_phase(phase, paths, kpi_repeat):
+    """Runs in a fresh process; returns wall time, cells touched and peak RSS for one phase"""
+    from format_all import format_portfolio_universal
+    from restructure_type_b import restructure_type_b_to_type_a, read_source_rows, extract_metrics, calculate_kpis
+
+    cells = 0
+    elapsed = 0.0
+    sink = StringIO()
+    extra = {}
+
+    if phase == 'restructure':
+        for path in paths:
+            cells += _sheet_cells(path)
+            start = time.perf_counter()
+            with redirect_stdout(sink):
+                restructure_type_b_to_type_a(path)
+            elapsed += time.perf_counter() - start
+
+    elif phase == 'format':
+        for path in paths:
+            cells += _sheet_cells(path, ('Executive Summary', 'Monthly Performance'))
+            start = time.perf_counter()
+            with redirect_stdout(sink):
+                format_portfolio_universal(path)
+            elapsed += time.perf_counter() - start
+
+    elif phase == 'kpis':
+        accounts = [extract_metrics(read_source_rows(path)) for path in paths]
+        start = time.perf_counter()
+        for _ in range(kpi_repeat):
+            for title, months, metrics_data in accounts:
+                calculate_kpis(metrics_data, months, title)
+        elapsed = time.perf_counter() - start
+        cells = kpi_repeat * sum(len(months) * len(metrics) for _, months, metrics in accounts)
+
+    elif phase == 'save':
+        for path in paths:
+            cells += _sheet_cells(path)
+            wb = load_workbook(path)
+            start = time.perf_counter()
+            wb.save(path)
+            elapsed += time.perf_counter() - start
+
+    elif phase == 'startup':
+        # One interpreter per file, the way a scheduler calls the formatter
+        for path in paths:
+            start = time.perf_counter()
+            subprocess.run([sys.executable, STARTUP_SCRIPT, '--detect-only', path],
+                           stdout=subprocess.DEVNULL, check=True)
+            elapsed += time.perf_counter() - start
+        imports = []
+        for _ in range(5):
+            start = time.perf_counter()
+            subprocess.run([sys.executable, '-c', 'import format_all'], cwd=os.path.dirname(STARTUP_SCRIPT), check=True)
+            imports.append(time.perf_counter() - start)
+        extra['import_s'] = round(sorted(imports)[len(imports) // 2], 4)
+
+    result = {
+        'phase': phase,
+        'files': len(paths),
+        'wall_s': round(elapsed, 4),
+        'per_file_s': round(elapsed / len(paths), 4) if paths else 0,
+        'peak_rss_mb': _peak_rss_mb(children=phase == 'startup'),
+        'cells': cells,
+        'cells_per_s': round(cells / elapsed) if elapsed else None,
+    }
+    result.update(extra)
+    return result
+
+
+def _prepare(phase, workdir, args):
+    """Generate the input files a phase needs (not timed)"""
+    paths = []
+    for idx in range(args.files):
+        path = os.path.join(workdir, f'{phase}_{idx:04d}.xlsx')
+        if phase in ('restructure', 'kpis'):
+            generate_type_b(path, args.months, args.metrics, seed=idx)
+        else:
+            generate_type_a(path, args.months, args.metrics, args.extra_rows, seed=idx)
+        paths.append(path)
+    return paths
+
+
+def run_benchmarks(args):
+    """Run every requested phase, each in its own fresh process"""
+    workdir = args.workdir or tempfile.mkdtemp(prefix='portfolio_bench_')
+    os.makedirs(workdir, exist_ok=True)
+    context = multiprocessing.get_context('spawn')
+    results = []
+
+    try:
+        for phase in args.phases:
+            paths = _prepare(phase, workdir, args)
+            with ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+                results.append(executor.submit(_run_phase, phase, paths, args.kpi_repeat).result())
+            print(_format_row(results[-1]))
+    finally:
+        if not args.workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    return {
+        'timestamp': datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'openpyxl': openpyxl.__version__,
+        'platform': platform.platform(),
+        'config': {'months': args.months, 'metrics': args.metrics, 'extra_rows': args.extra_rows,
+                   'files': args.files, 'kpi_repeat': args.kpi_repeat},
+        'results': results,
+    }
+
+
+# ========== REPORTING ==========
+
+def _format_row(result):
+    rss = f"{result['peak_rss_mb']:.1f}" if result['peak_rss_mb'] is not None else 'n/a'
+    rate = f"{result['cells_per_s']:,}" if result['cells_per_s'] else 'n/a'
+    line = f"  {result['phase']:<12} {result['wall_s']:>9.3f}s {result['per_file_s']:>9.4f}s {rss:>10} {rate:>14}"
+    if 'import_s' in result:
+        line += f"   (import {result['import_s']:.3f}s)"
+    return line
+
+
+def compare(previous, current):
+    """Print per-phase wall time and memory ratios between two benchmark runs"""
+    before = {r['phase']: r for r in previous['results']}
+    print("\nCOMPARISON (current / previous)")
+    print("-" * 70)
+    if previous.get('config') != current.get('config'):
+        print("  ⚠ Configurations differ - ratios are only indicative")
+    for result in current['results']:
+        old = before.get(result['phase'])
+        if not old or not old['wall_s']:
+            continue
+        ratio = result['wall_s'] / old['wall_s']
+        marker = '✗ slower' if ratio > 1.10 else ('✓ faster' if ratio < 0.90 else '  same')
+        line = f"  {result['phase']:<12} time x{ratio:.2f}  {marker}"
+        if old.get('peak_rss_mb') and result.get('peak_rss_mb'):
+            line += f"   memory x{result['peak_rss_mb'] / old['peak_rss_mb']:.2f}"
+        print(line)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Portfolio toolkit benchmarks")
+    parser.add_argument('--months', type=int, default=12, help='Month columns per workbook')
+    parser.add_argument('--metrics', type=int, default=30, help='Metric rows on the Data sheet')
+    parser.add_argument('--extra-rows', type=int, default=0, help='Extra trailing rows on Monthly Performance')
+    parser.add_argument('--files', type=int, default=4, help='Workbooks per phase')
+    parser.add_argument('--kpi-repeat', type=int, default=200, help='Times calculate_kpis runs per file')
+    parser.add_argument('--phases', nargs='+', choices=PHASES, default=list(PHASES))
+    parser.add_argument('--output', '-o', default='benchmark_results.json', help='JSON results file')
+    parser.add_argument('--compare', metavar='JSON', help='Previous results file to compare against')
+    parser.add_argument('--workdir', help='Keep generated workbooks in this directory')
+    args = parser.parse_args()
+
+    print("\n" + "=" * 70)
+    print(f"BENCHMARK: {args.files} file(s), {args.months} months, {args.metrics} metric rows, "
+          f"{args.extra_rows} extra rows")
+    print("=" * 70)
+    print(f"  {'phase':<12} {'total':>10} {'per file':>10} {'peak MB':>10} {'cells/s':>14}")
+
+    report = run_benchmarks(args)
+
+    with open(args.output, 'w') as fh:
+        json.dump(report, fh, indent=2)
+    print(f"\n✓ Results written to {args.output}")
+
+    if args.compare:
+        with open(args.compare) as fh:
+            compare(json.load(fh), report)
+    print()
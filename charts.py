@@ -0,0 +1,85 @@
+"""
+Native Excel charts for the Monthly Performance sheet
+Charts reference the month header row and the metric rows already written to the sheet,
+so no data is duplicated into helper sheets; they plot the month columns only (not the
+per-year subtotals) and are placed to the right of the table.
+"""
+
+from openpyxl.chart import LineChart, BarChart, Reference
+from openpyxl.utils import get_column_letter
+
+from periods import is_year_total
+
+
+HEADER_LABEL = 'Period'
+
+# (chart title, y-axis title, row labels in column A)
+VALUE_CHART = ('Portfolio Value', 'Value ($)', ('Portfolio Value (Start)', 'Portfolio Value (End)'))
+PROFIT_CHART = ('Profit and Dividends', 'Amount ($)', ('Total profit', 'Dividends'))
+
+CHART_WIDTH = 20    # cm
+CHART_HEIGHT = 8    # cm
+CHART_ROW_SPAN = 18
+
+
+def label_rows(ws):
+    """{column A label: row} for the labelled rows of the sheet"""
+    rows = {}
+    for row in range(1, ws.max_row + 1):
+        label = ws.cell(row=row, column=1).value
+        if isinstance(label, str):
+            rows.setdefault(label.strip(), row)
+    return rows
+
+
+def _header_columns(ws, header_row):
+    """(last month column, last header column); per-year subtotal columns follow the months"""
+    col = 1
+    # Bounded by max_column: probing past the table would create (and later style) empty cells
+    while col < ws.max_column and ws.cell(row=header_row, column=col + 1).value not in (None, ''):
+        col += 1
+    last_month = col
+    while last_month > 1 and is_year_total(ws.cell(row=header_row, column=last_month).value):
+        last_month -= 1
+    return last_month, col
+
+
+def _build(chart, ws, title, y_title, series_rows, header_row, last_col):
+    chart.title = title
+    chart.y_axis.title = y_title
+    chart.width = CHART_WIDTH
+    chart.height = CHART_HEIGHT
+    for row in series_rows:
+        # Column A holds the series name, B..last_col the monthly values
+        chart.add_data(Reference(ws, min_col=1, max_col=last_col, min_row=row), from_rows=True, titles_from_data=True)
+    chart.set_categories(Reference(ws, min_col=2, max_col=last_col, min_row=header_row))
+    return chart
+
+
+def add_monthly_charts(ws):
+    """
+    Add a portfolio value line chart and a profit/dividends bar chart to a Monthly
+    Performance sheet. Sheets that already carry charts are left alone, so re-formatting
+    a report never stacks duplicates. Returns the number of charts added.
+    """
+    if ws._charts:
+        return 0
+
+    rows = label_rows(ws)
+    header_row = rows.get(HEADER_LABEL)
+    if header_row is None:
+        return 0
+    last_col, last_header = _header_columns(ws, header_row)
+    if last_col < 2:
+        return 0
+
+    anchor_col = get_column_letter(last_header + 2)
+    added = 0
+    for chart_type, (title, y_title, labels) in ((LineChart, VALUE_CHART), (BarChart, PROFIT_CHART)):
+        series_rows = [rows[label] for label in labels if label in rows]
+        if not series_rows:
+            continue
+        chart = _build(chart_type(), ws, title, y_title, series_rows, header_row, last_col)
+        ws.add_chart(chart, f"{anchor_col}{header_row + added * CHART_ROW_SPAN}")
+        added += 1
+    return added
@@ -0,0 +1,101 @@
+"""
+Formula KPI check
+Restructures each report with --formulas into a scratch directory, then compares the
+values the formula evaluator cached in the Executive Summary with calculate_kpis over the
+same months. Type A reports are restructured again from their Data Source sheet.
+Exits with status 1 if any KPI differs.
+"""
+
+import os
+import sys
+import glob
+import math
+import argparse
+import tempfile
+from contextlib import redirect_stdout
+from io import StringIO
+
+from openpyxl import Workbook, load_workbook
+
+from batch import expand_file_args
+from consolidate import read_account
+from formulas import KPI_ROWS
+from kpi_engine import calculate_kpis
+from restructure_type_b import read_source_rows, restructure_type_b_to_type_a
+
+
+def _type_b_copy(filepath, directory):
+    """Write the report's source rows as a Type B Data sheet in directory; returns its path"""
+    try:
+        rows = read_source_rows(filepath, 'Data')
+    except KeyError:
+        rows = read_source_rows(filepath, 'Data Source')[1:]
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet('Data')
+    for row in rows:
+        ws.append(row)
+    path = os.path.join(directory, os.path.basename(filepath))
+    wb.save(path)
+    return path
+
+
+def _expected(kpis):
+    """{(row, column): value} the Executive Summary formulas should evaluate to"""
+    expected = {(row, 2): kpis[name] for name, row in KPI_ROWS.items()}
+    expected[(KPI_ROWS['growth'], 3)] = kpis['growth_percent'] / 100
+    expected[(KPI_ROWS['positive_months'], 3)] = kpis['positive_months'] / kpis['total_months']
+    return expected
+
+
+def check_file(filepath, directory):
+    """List of (cell, cached value, expected value) that differ for one report"""
+    source = _type_b_copy(filepath, directory)
+    out_dir = os.path.join(directory, 'out')
+    os.makedirs(out_dir, exist_ok=True)
+    with redirect_stdout(StringIO()):
+        if restructure_type_b_to_type_a(source, out_dir=out_dir, charts=False, formulas=True) is False:
+            raise ValueError("Could not be restructured")
+    output = os.path.join(out_dir, os.path.basename(source))
+
+    title, months, metrics_data = read_account(output)
+    kpis = calculate_kpis(metrics_data, months, title)
+    ws = load_workbook(output, data_only=True)['Executive Summary']
+
+    mismatches = []
+    for (row, column), expected in _expected(kpis).items():
+        cell = ws.cell(row=row, column=column)
+        cached = cell.value
+        if not isinstance(cached, (int, float)) or not math.isclose(cached, float(expected),
+                                                                    rel_tol=1e-9, abs_tol=1e-6):
+            mismatches.append((cell.coordinate, cached, float(expected)))
+    return mismatches
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Compare formula KPI cached values with calculate_kpis")
+    parser.add_argument('files', nargs='*',
+                        help='Reports to check, Type B or restructured Type A (default: the sample workbooks)')
+    args = parser.parse_args()
+
+    files = expand_file_args(args.files) if args.files else \
+        sorted(glob.glob(os.path.join(os.path.dirname(os.path.abspath(__file__)), '*.xlsx')))
+
+    failed = 0
+    for filepath in files:
+        with tempfile.TemporaryDirectory() as directory:
+            try:
+                mismatches = check_file(filepath, directory)
+            except Exception as e:
+                failed += 1
+                print(f"  ✗ {os.path.basename(filepath)}: {str(e) or type(e).__name__}")
+                continue
+        if mismatches:
+            failed += 1
+            print(f"  ✗ {os.path.basename(filepath)}:")
+            for coordinate, cached, expected in mismatches:
+                print(f"      {coordinate}: cached {cached!r}, calculate_kpis {expected!r}")
+        else:
+            print(f"  ✓ {os.path.basename(filepath)}: formula values match calculate_kpis")
+
+    print(f"\n{len(files) - failed} of {len(files)} file(s) match")
+    sys.exit(1 if failed else 0)
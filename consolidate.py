@@ -0,0 +1,254 @@
+"""
+Cross-account consolidated report builder
+Streams the metrics of many account workbooks (Type B files or restructured Type A files),
+aggregates them month by month and writes one household-level Executive Summary and
+Monthly Performance workbook using the restructure_type_b layouts.
+Memory is bounded by metrics x months, however many accounts are added.
+"""
+
+import os
+import sys
+import math
+import time
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+
+from openpyxl import Workbook
+
+from batch import expand_file_args, resolve_jobs
+from output import atomic_save
+from kpi_engine import calculate_kpis, to_float
+from periods import parse_month, month_label
+from restructure_type_b import (read_source_rows, extract_metrics, create_executive_summary,
+                                create_monthly_performance, format_sheets)
+from styles import StyleRegistry
+
+
+# Percentage rows can't be summed; they are averaged, weighted by each account's starting value
+WEIGHT_METRIC = 'At the beginning of the period'
+# ... or, where that is missing, by the portfolio value the month before
+FALLBACK_WEIGHT_METRIC = 'Portfolio value'
+
+
+def read_account(filepath):
+    """(title, months, metrics_data) from a Type B Data sheet or a restructured file's Data Source sheet"""
+    try:
+        source_rows = read_source_rows(filepath, 'Data')
+    except KeyError:
+        # Restructured files keep the original rows below an 'Original Data Structure' banner
+        source_rows = read_source_rows(filepath, 'Data Source')[1:]
+
+    extracted = extract_metrics(source_rows)
+    if extracted is None:
+        raise ValueError("Could not find month headers")
+    return extracted
+
+
+def _read_account_safe(filepath):
+    """Worker entry point: never raises, so one bad file can't stop the consolidation"""
+    try:
+        return filepath, read_account(filepath), None
+    except Exception as e:
+        return filepath, None, str(e) or type(e).__name__
+
+
+def _month_weights(metrics_data, month_count):
+    """
+    Each month's weight for the account's percentages: its starting value, else the portfolio
+    value the month before (for the first month, its own - as calculate_kpis takes the start).
+    None where neither is a positive number.
+    """
+    starts = [to_float(v) for v in metrics_data.get(WEIGHT_METRIC, [])]
+    values = [to_float(v) for v in metrics_data.get(FALLBACK_WEIGHT_METRIC, [])]
+    weights = []
+    for idx in range(month_count):
+        weight = starts[idx] if idx < len(starts) else math.nan
+        if not weight > 0:
+            previous = max(idx - 1, 0)
+            weight = values[previous] if previous < len(values) else math.nan
+        weights.append(weight if weight > 0 else None)
+    return weights
+
+
+class HouseholdAggregate:
+    """Running month-by-month totals across accounts"""
+
+    def __init__(self):
+        self.sums = {}          # metric -> {(year, month): total}
+        self.weighted = {}      # percentage metric -> {(year, month): [weighted sum, total weight]}
+        self.accounts = []      # (title, filepath, month count, ending value)
+        self.skipped_months = 0
+        self.unweighted = set()  # (account title, (year, month)) whose percentages had no weight
+        self.spans = []         # (account title, first (year, month), last (year, month))
+
+    def add(self, filepath, title, months, metrics_data):
+        keys = [parse_month(m) for m in months]
+        self.skipped_months += sum(1 for key in keys if key is None)
+        known = [key for key in keys if key is not None]
+        if known:
+            self.spans.append((str(title).strip(), min(known), max(known)))
+        weights = _month_weights(metrics_data, len(months))
+
+        for metric, values in metrics_data.items():
+            is_percent = metric.endswith('%')
+            target = self.weighted if is_percent else self.sums
+            by_month = target.setdefault(metric, {})
+            for idx, (key, value) in enumerate(zip(keys, values)):
+                value = to_float(value)
+                if key is None or math.isnan(value):
+                    continue
+                if is_percent:
+                    weight = weights[idx]
+                    if weight is None:
+                        # A stand-in weight would all but drop the account from the average unnoticed
+                        self.unweighted.add((str(title).strip(), key))
+                        continue
+                    entry = by_month.setdefault(key, [0.0, 0.0])
+                    entry[0] += value * weight
+                    entry[1] += weight
+                else:
+                    by_month[key] = by_month.get(key, 0.0) + value
+
+        ending = [to_float(v) for v in metrics_data.get('Portfolio value', [])]
+        ending = ending[-1] if ending and not math.isnan(ending[-1]) else 0.0
+        self.accounts.append((str(title).strip(), filepath, len(months), ending))
+
+    def shared_span(self):
+        """(first, last) months every account reports, or None if the accounts don't overlap"""
+        if not self.spans:
+            return None
+        first = max(span[1] for span in self.spans)
+        last = min(span[2] for span in self.spans)
+        return (first, last) if first <= last else None
+
+    def spans_differ(self):
+        return len({span[1:] for span in self.spans}) > 1
+
+    def result(self, span=None):
+        """(months, metrics_data) in the same shape extract_metrics produces, optionally within span"""
+        keys = set()
+        for by_month in list(self.sums.values()) + list(self.weighted.values()):
+            keys.update(by_month)
+        if span is not None:
+            keys = {key for key in keys if span[0] <= key <= span[1]}
+        keys = sorted(keys)
+
+        metrics_data = {}
+        for metric, by_month in self.sums.items():
+            metrics_data[metric] = [by_month.get(key) for key in keys]
+        for metric, by_month in self.weighted.items():
+            metrics_data[metric] = [by_month[key][0] / by_month[key][1] if key in by_month else None
+                                    for key in keys]
+        return [month_label(key) for key in keys], metrics_data
+
+
+def create_accounts_sheet(ws, accounts, styles):
+    """List the accounts that went into the consolidated report"""
+    ws.append(['Account', 'File', 'Months', 'Ending Value'])
+    styles.apply_row(ws, 1, 1, 4, 'column_header_plain')
+    for title, filepath, month_count, ending in accounts:
+        ws.append([title, filepath, month_count, ending])
+        styles.apply(ws.cell(row=ws.max_row, column=1), 'label_plain')
+        ws.cell(row=ws.max_row, column=4).number_format = '#,##0.00'
+    ws.column_dimensions['A'].width = 40
+    ws.column_dimensions['B'].width = 50
+    ws.column_dimensions['C'].width = 10
+    ws.column_dimensions['D'].width = 16
+
+
+def consolidate(files, output, title="HOUSEHOLD PORTFOLIO REPORT", jobs=1):
+    """Aggregate every account file into one consolidated workbook saved to output"""
+
+    aggregate = HouseholdAggregate()
+    workers = resolve_jobs(jobs, len(files))
+
+    if workers == 1:
+        results = map(_read_account_safe, files)
+    else:
+        executor = ProcessPoolExecutor(max_workers=workers)
+        results = executor.map(_read_account_safe, files, chunksize=8)
+
+    try:
+        for filepath, extracted, error in results:
+            if error is not None:
+                print(f"  ✗ Skipped {filepath}: {error}")
+                continue
+            account_title, months, metrics_data = extracted
+            aggregate.add(filepath, account_title, months, metrics_data)
+            print(f"  ✓ Added {str(account_title).strip()} ({len(months)} months)")
+    finally:
+        if workers > 1:
+            executor.shutdown()
+
+    if not aggregate.accounts:
+        print("  ✗ No accounts could be read - nothing to consolidate")
+        return False
+    if aggregate.skipped_months:
+        print(f"  ⚠ {aggregate.skipped_months} month column(s) had unrecognised labels and were left out")
+    if aggregate.unweighted:
+        print(f"  ⚠ {len(aggregate.unweighted)} account-month(s) had no starting or previous portfolio value "
+              f"and were left out of the household percentages:")
+        for account_title, key in sorted(aggregate.unweighted):
+            print(f"      {account_title}: {month_label(key)}")
+
+    months, metrics_data = aggregate.result()
+    kpi_months, kpi_data = months, metrics_data
+    if aggregate.spans_differ():
+        # A start and an end taken over different accounts would show growth that never happened
+        span = aggregate.shared_span()
+        if span is not None:
+            kpi_months, kpi_data = aggregate.result(span)
+            print(f"  ⚠ The accounts cover different months; the summary KPIs use only "
+                  f"{month_label(span[0])} - {month_label(span[1])}, which every account reports:")
+        else:
+            print("  ⚠ No month is reported by every account; the summary KPIs mix different accounts:")
+        for account_title, first, last in aggregate.spans:
+            print(f"      {account_title}: {month_label(first)} - {month_label(last)}")
+    kpis = calculate_kpis(kpi_data, kpi_months, title)
+
+    wb = Workbook()
+    wb.remove(wb.active)
+    create_executive_summary(wb.create_sheet("Executive Summary"), title, kpis)
+    create_monthly_performance(wb.create_sheet("Monthly Performance"), title, months, metrics_data)
+    format_sheets(wb)
+    create_accounts_sheet(wb.create_sheet("Accounts"), aggregate.accounts, StyleRegistry(wb))
+
+    atomic_save(wb, output)
+    print(f"\n✓ Consolidated {len(aggregate.accounts)} account(s) over {len(months)} month(s) into {output}")
+    return True
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2:
+        print("\n" + "=" * 70)
+        print("HOUSEHOLD CONSOLIDATION TOOL")
+        print("Combines many account reports into one Executive Summary + Monthly Performance")
+        print("=" * 70)
+        print("\nUsage: python consolidate.py <file1.xlsx> [file2.xlsx ...] [--output FILE] [--title TEXT] [--jobs N]")
+        print("\nExample:")
+        print('  python consolidate.py "Portfolio report_*.xlsx" --output "Household Report.xlsx"')
+        print("=" * 70 + "\n")
+        sys.exit(0)
+
+    parser = argparse.ArgumentParser(description="Cross-account consolidated report builder")
+    parser.add_argument('files', nargs='+', help='Account workbooks or glob patterns')
+    parser.add_argument('--output', '-o', default='Household Report.xlsx', help='Consolidated workbook to write')
+    parser.add_argument('--title', default='HOUSEHOLD PORTFOLIO REPORT', help='Report title')
+    parser.add_argument('--jobs', '-j', type=int, default=1, metavar='N',
+                        help='Worker processes used to read accounts (0 = one per CPU core)')
+    args = parser.parse_args()
+
+    # Never read the report we are about to overwrite, however its path is spelled
+    output = os.path.normcase(os.path.abspath(args.output))
+    files_to_process = [f for f in expand_file_args(args.files) if os.path.normcase(os.path.abspath(f)) != output]
+
+    print("\n" + "=" * 70)
+    print(f"Consolidating {len(files_to_process)} account file(s)...")
+    print("=" * 70)
+
+    start = time.perf_counter()
+    consolidate(files_to_process, args.output, title=args.title, jobs=args.jobs)
+
+    print("=" * 70)
+    print(f"CONSOLIDATION COMPLETE ({time.perf_counter() - start:.2f}s)")
+    print("=" * 70 + "\n")
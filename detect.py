@@ -0,0 +1,215 @@
+"""
+Fast workbook structure detection
+Classifies an .xlsx file as Type A, Type A extended, Type B or unknown by reading only the
+zip's workbook.xml (sheet names) and the first rows of the sheets that matter, without
+loading the workbook through openpyxl. Type B month header rows are found by pattern
+(any recognisable month label in column B) rather than by looking for a particular month.
+"""
+
+import zipfile
+import hashlib
+import posixpath
+from collections import namedtuple
+from xml.etree.ElementTree import iterparse
+
+from periods import parse_month
+
+
+TYPE_A = 'type_a'
+TYPE_A_EXTENDED = 'type_a_extended'
+TYPE_B = 'type_b'
+UNKNOWN = 'unknown'
+
+DESCRIPTIONS = {
+    TYPE_A: 'Type A (Executive Summary + Monthly Performance)',
+    TYPE_A_EXTENDED: 'Type A extended (+ Trading Activity / Key Insights / Action Items)',
+    TYPE_B: 'Type B (Data sheet structure)',
+    UNKNOWN: 'Unknown structure',
+}
+
+# Month headers sit near the top of a Type B export (row 4 in practice)
+HEADER_SCAN_ROWS = 20
+
+# Extended Executive Summary section headers, as checked by the type_a layout guards
+EXTENDED_SECTIONS = (('A16', 'TRADING'), ('A22', 'KEY INSIGHTS'), ('A30', 'ACTION ITEMS'))
+
+_MAIN = '{http://schemas.openxmlformats.org/spreadsheetml/2006/main}'
+_REL = '{http://schemas.openxmlformats.org/officeDocument/2006/relationships}'
+_PKG_REL = '{http://schemas.openxmlformats.org/package/2006/relationships}'
+
+WorkbookProbe = namedtuple('WorkbookProbe', ['kind', 'sheets', 'header_row', 'months', 'fingerprint'])
+
+
+def find_header_row(rows, max_rows=HEADER_SCAN_ROWS):
+    """1-based row whose column B holds a month label, or None"""
+    for idx, row in enumerate(rows[:max_rows], start=1):
+        if len(row) > 1 and parse_month(row[1]) is not None:
+            return idx
+    return None
+
+
+def probe(filepath):
+    """Classify filepath from its zip directory and the first rows of its sheets"""
+    with zipfile.ZipFile(filepath) as zf:
+        members = sheet_paths(zf)
+        sheets = list(members)
+        fingerprint = _fingerprint(zf)
+        header_row, months = None, ()
+
+        if 'Executive Summary' in sheets and 'Monthly Performance' in sheets:
+            rows = _read_rows(zf, members['Executive Summary'], max_rows=30)
+            kind = TYPE_A_EXTENDED if _has_extended_sections(rows) else TYPE_A
+
+        elif sheets == ['Data']:
+            rows = _read_rows(zf, members['Data'], max_rows=HEADER_SCAN_ROWS)
+            header_row = find_header_row(rows)
+            if header_row is None:
+                kind = UNKNOWN
+            else:
+                kind = TYPE_B
+                months = tuple(str(v) for v in rows[header_row - 1][1:] if v not in (None, ''))
+
+        else:
+            kind = UNKNOWN
+
+    return WorkbookProbe(kind, sheets, header_row, months, fingerprint)
+
+
+def describe(kind):
+    return DESCRIPTIONS.get(kind, kind)
+
+
+def _has_extended_sections(rows):
+    for coordinate, text in EXTENDED_SECTIONS:
+        row = int(coordinate[1:])
+        if row <= len(rows) and rows[row - 1] and text in str(rows[row - 1][0] or ''):
+            return True
+    return False
+
+
+def _fingerprint(zf):
+    """
+    Cheap content fingerprint from the CRCs already stored in the zip directory.
+    docProps is left out because it only carries save timestamps.
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    for info in sorted(zf.infolist(), key=lambda i: i.filename):
+        if not info.filename.startswith('docProps/'):
+            digest.update(f"{info.filename}:{info.CRC}:{info.file_size}\n".encode())
+    return digest.hexdigest()
+
+
+# ========== MINIMAL XLSX READING ==========
+
+def sheet_paths(zf):
+    """{sheet name: zip member} in workbook order"""
+    targets = {}
+    with zf.open('xl/_rels/workbook.xml.rels') as fh:
+        for _, elem in iterparse(fh):
+            if elem.tag == f'{_PKG_REL}Relationship':
+                target = elem.get('Target')
+                if target.startswith('/'):
+                    target = target[1:]
+                else:
+                    target = posixpath.normpath(posixpath.join('xl', target))
+                targets[elem.get('Id')] = target
+
+    paths = {}
+    with zf.open('xl/workbook.xml') as fh:
+        for _, elem in iterparse(fh):
+            if elem.tag == f'{_MAIN}sheet':
+                paths[elem.get('name')] = targets.get(elem.get(f'{_REL}id'))
+    return paths
+
+
+def column_index(reference):
+    """'C12' -> 3"""
+    col = 0
+    for char in reference:
+        if not char.isalpha():
+            break
+        col = col * 26 + ord(char.upper()) - 64
+    return col
+
+
+def _read_rows(zf, member, max_rows):
+    """
+    Values of the first max_rows rows of a sheet, as tuples (row 1 first).
+    Parsing stops as soon as the last wanted row has been read.
+    """
+    cells = []      # (row, col, raw value, type)
+    shared_needed = False
+
+    with zf.open(member) as fh:
+        row_idx = 0
+        for _, elem in iterparse(fh):
+            tag = elem.tag
+            if tag == f'{_MAIN}row':
+                row_idx = int(elem.get('r', row_idx + 1))
+                elem.clear()
+                if row_idx >= max_rows:
+                    break
+            elif tag == f'{_MAIN}c':
+                reference = elem.get('r')
+                if reference:
+                    row = int(''.join(ch for ch in reference if ch.isdigit()))
+                    col = column_index(reference)
+                else:
+                    row, col = row_idx + 1, None
+                if row > max_rows:
+                    break
+                cell_type = elem.get('t', 'n')
+                if cell_type == 'inlineStr':
+                    value = ''.join(t.text or '' for t in elem.iter(f'{_MAIN}t'))
+                else:
+                    node = elem.find(f'{_MAIN}v')
+                    value = node.text if node is not None else None
+                shared_needed = shared_needed or cell_type == 's'
+                cells.append((row, col, value, cell_type))
+
+    shared = shared_strings(zf, {int(v) for _, _, v, t in cells if t == 's' and v}) if shared_needed else {}
+
+    rows = {}
+    for row, col, value, cell_type in cells:
+        values = rows.setdefault(row, [])
+        col = col or len(values) + 1
+        values.extend([None] * (col - len(values)))
+        values[col - 1] = convert_value(value, cell_type, shared)
+
+    last_row = max(rows, default=0)
+    return [tuple(rows.get(row, ())) for row in range(1, last_row + 1)]
+
+
+def convert_value(value, cell_type, shared):
+    if value is None:
+        return None
+    if cell_type == 's':
+        return shared.get(int(value))
+    if cell_type == 'b':
+        return value == '1'
+    if cell_type in ('str', 'inlineStr', 'e'):
+        return value
+    try:
+        number = float(value)
+    except ValueError:
+        return value
+    return int(number) if number.is_integer() and 'E' not in value.upper() and '.' not in value else number
+
+
+def shared_strings(zf, wanted):
+    """Only the shared strings at the indices in wanted; stops after the highest one"""
+    strings = {}
+    if not wanted or 'xl/sharedStrings.xml' not in zf.namelist():
+        return strings
+    highest = max(wanted)
+    idx = 0
+    with zf.open('xl/sharedStrings.xml') as fh:
+        for _, elem in iterparse(fh):
+            if elem.tag == f'{_MAIN}si':
+                if idx in wanted:
+                    strings[idx] = ''.join(t.text or '' for t in elem.iter(f'{_MAIN}t'))
+                elem.clear()
+                if idx >= highest:
+                    break
+                idx += 1
+    return strings
@@ -0,0 +1,200 @@
+"""
+Columnar export of extracted metrics and KPIs
+Each workbook becomes one part file in an export directory, holding one row per
+account-month: the monthly metrics as float columns plus the account's KPIs repeated on
+every row. Parts are written as Parquet or Arrow IPC when pyarrow is installed and as CSV
+otherwise, so analytics can read the whole directory as one dataset without re-parsing
+any xlsx.
+"""
+
+import os
+import re
+import csv
+import sys
+import time
+import hashlib
+import argparse
+from functools import lru_cache
+
+import numpy as np
+
+from kpi_engine import metrics_array
+from periods import parse_month
+from batch import expand_file_args, run_batch, print_timing_summary
+
+
+# Monthly rows exported as columns, in order; rows a file doesn't have are left empty
+EXPORT_METRICS = (
+    'Portfolio value',
+    'At the beginning of the period',
+    'At the end of the period',
+    'Change',
+    'Total profit',
+    'Total profit, %',
+    'Profit from price change',
+    'Net profit from sales',
+    'Dividends',
+    'Taxes',
+    'Commissions',
+    'Total trades',
+    'Buy trades',
+    'Sell trades',
+    'Total purchases',
+    'Total sales',
+    'Deposited',
+    'Withdrawn',
+)
+
+# Scalar KPIs from calculate_kpis, repeated on each of the account's rows
+EXPORT_KPIS = (
+    'start_value', 'end_value', 'growth', 'growth_percent', 'total_profit', 'total_dividends',
+    'best_month', 'worst_month', 'avg_monthly', 'positive_months', 'total_months',
+    'max_drawdown', 'volatility', 'annualized_volatility', 'trailing_3m', 'trailing_6m', 'trailing_12m',
+)
+
+FORMATS = ('auto', 'parquet', 'arrow', 'csv')
+EXTENSIONS = {'parquet': '.parquet', 'arrow': '.arrow', 'csv': '.csv'}
+
+
+@lru_cache(maxsize=None)
+def _pyarrow():
+    """pyarrow (with its ipc and parquet modules), or None if it isn't installed.
+    Imported on first use: it takes longer to load than the rest of the toolkit together."""
+    try:
+        import pyarrow
+        import pyarrow.ipc
+        import pyarrow.parquet
+    except ImportError:
+        return None
+    return pyarrow
+
+
+def column_name(metric):
+    """'Total profit, %' -> 'total_profit_pct'"""
+    name = metric.lower().replace('%', 'pct')
+    return re.sub(r'[^a-z0-9]+', '_', name).strip('_')
+
+
+def resolve_format(export_format):
+    if export_format == 'auto':
+        return 'parquet' if _pyarrow() is not None else 'csv'
+    if export_format in ('parquet', 'arrow') and _pyarrow() is None:
+        raise RuntimeError(f"{export_format} export needs pyarrow (pip install pyarrow)")
+    return export_format
+
+
+def account_columns(filepath, title, months, metrics_data, kpis):
+    """Column name -> list/array of values, one entry per month"""
+    count = len(months)
+    keys = [parse_month(m) for m in months]
+    columns = {
+        'account': [str(title).strip()] * count,
+        'source_file': [os.path.basename(filepath)] * count,
+        'month': [str(m) for m in months],
+        'year': [key[0] if key else None for key in keys],
+        'month_number': [key[1] if key else None for key in keys],
+    }
+
+    values = metrics_array(metrics_data, count, EXPORT_METRICS)
+    for idx, metric in enumerate(EXPORT_METRICS):
+        columns[column_name(metric)] = values[idx]
+
+    for name in EXPORT_KPIS:
+        value = kpis.get(name)
+        columns[f'kpi_{name}'] = np.full(count, np.nan if value is None else float(value))
+    return columns
+
+
+def part_path(export_dir, filepath, file_format):
+    """One part per source workbook; re-exporting the same workbook replaces its part"""
+    stem = os.path.splitext(os.path.basename(filepath))[0]
+    digest = hashlib.blake2b(os.path.abspath(filepath).encode(), digest_size=4).hexdigest()
+    return os.path.join(export_dir, f"{stem}-{digest}{EXTENSIONS[file_format]}")
+
+
+def _write_csv(columns, path):
+    names = list(columns)
+    with open(path, 'w', newline='', encoding='utf-8') as fh:
+        writer = csv.writer(fh)
+        writer.writerow(names)
+        for row in zip(*(columns[name] for name in names)):
+            writer.writerow(['' if v is None or (isinstance(v, float) and np.isnan(v)) else v for v in row])
+
+
+def _write_arrow(columns, path, file_format):
+    pa = _pyarrow()
+    table = pa.table({name: pa.array(values, from_pandas=True) if isinstance(values, np.ndarray)
+                      else pa.array(values) for name, values in columns.items()})
+    if file_format == 'parquet':
+        pa.parquet.write_table(table, path)
+    else:
+        # Arrow IPC file format: readers can memory-map it with pyarrow.memory_map
+        with pa.OSFile(path, 'wb') as sink, pa.ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+
+
+def export_account(export_dir, filepath, title, months, metrics_data, kpis, export_format='auto'):
+    """Write one workbook's metrics and KPIs as a part file; returns its path"""
+    file_format = resolve_format(export_format)
+    os.makedirs(export_dir, exist_ok=True)
+    columns = account_columns(filepath, title, months, metrics_data, kpis)
+
+    path = part_path(export_dir, filepath, file_format)
+    # Hidden while being written, so dataset readers never pick up a partial part
+    temp_path = os.path.join(export_dir, f".{os.path.basename(path)}.tmp")
+    if file_format == 'csv':
+        _write_csv(columns, temp_path)
+    else:
+        _write_arrow(columns, temp_path, file_format)
+    os.replace(temp_path, path)
+    return path
+
+
+def export_workbook(filepath, export_dir, export_format='auto'):
+    """Batch entry point: export a Type B file or a restructured Type A file"""
+    from consolidate import read_account
+    from kpi_engine import calculate_kpis
+
+    print(f"\nExporting: {filepath}")
+    title, months, metrics_data = read_account(filepath)
+    kpis = calculate_kpis(metrics_data, months, title)
+    path = export_account(export_dir, filepath, title, months, metrics_data, kpis, export_format)
+    print(f"  ✓ {len(months)} month row(s) written to {path}")
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2:
+        print("\n" + "=" * 70)
+        print("METRICS EXPORT TOOL")
+        print("Writes monthly metrics and KPIs as a columnar dataset (one row per account-month)")
+        print("=" * 70)
+        print("\nUsage: python export.py <file1.xlsx> [file2.xlsx ...] --export-dir DIR [--format FORMAT] [--jobs N]")
+        print("\nExample:")
+        print('  python export.py "Portfolio report_*.xlsx" --export-dir metrics')
+        print("  python export.py *.xlsx --export-dir metrics --format csv")
+        print("=" * 70 + "\n")
+        sys.exit(0)
+
+    parser = argparse.ArgumentParser(description="Columnar metrics export")
+    parser.add_argument('files', nargs='+', help='Workbooks or glob patterns')
+    parser.add_argument('--jobs', '-j', type=int, default=1, metavar='N',
+                        help='Worker processes (0 = one per CPU core, default: 1)')
+    parser.add_argument('--export-dir', required=True, metavar='DIR', help='Dataset directory for the part files')
+    parser.add_argument('--format', choices=FORMATS, default='auto',
+                        help='parquet / arrow need pyarrow; auto picks parquet when it is installed, else csv')
+    args = parser.parse_args()
+
+    files_to_process = expand_file_args(args.files)
+    print("\n" + "=" * 70)
+    print(f"Exporting {len(files_to_process)} file(s) as {resolve_format(args.format)} to {args.export_dir}...")
+    print("=" * 70)
+
+    start = time.perf_counter()
+    results = run_batch(export_workbook, files_to_process, jobs=args.jobs,
+                        export_dir=args.export_dir, export_format=args.format)
+
+    print("=" * 70)
+    print(f"EXPORT COMPLETE: {sum(1 for r in results if r.ok)} file(s) exported")
+    print("=" * 70)
+    print_timing_summary(results, time.perf_counter() - start)
+    print()
@@ -1,361 +1,181 @@
 import sys
 import os
-from openpyxl import load_workbook
-from openpyxl.styles import Font, PatternFill, Alignment, Border, Side
-from openpyxl.utils import get_column_letter
+import time
+import argparse
+from contextlib import nullcontext
 
-def format_portfolio_universal(filepath):
+# Only light modules are imported up front, so per-file invocations and --detect-only
+# start quickly; openpyxl, the style tables and the layouts load on first use
+from detect import probe, describe, TYPE_A, TYPE_A_EXTENDED, UNKNOWN
+import instrument
+from output import output_path, open_journal
+from batch import SKIPPED, add_batch_arguments, expand_file_args, run_batch, print_timing_summary
+
+def format_portfolio_universal(filepath, incremental=False, out_dir=None, charts=True, conditional=False,
+                               template=False):
     """
     Universal formatter for portfolio files with extended Executive Summary sections.
     Handles all structure types:
     - Type A with extended sections (Exec Summary + Monthly + Trading/Insights/Actions)
     - Type A without extended sections (original structure)
     - Type B (Data only)
-    """
-    
-    print(f"\nProcessing: {filepath}")
-    wb = load_workbook(filepath)
-    
-    # Define color scheme
-    header_fill = PatternFill(start_color="1F4788", end_color="1F4788", fill_type="solid")
-    subheader_fill = PatternFill(start_color="4472C4", end_color="4472C4", fill_type="solid")
-    metric_fill = PatternFill(start_color="D9E1F2", end_color="D9E1F2", fill_type="solid")
-    highlight_fill = PatternFill(start_color="E7E6E6", end_color="E7E6E6", fill_type="solid")
-    
-    # Section fills
-    section_fills = {
-        'trading': PatternFill(start_color="FFF2CC", end_color="FFF2CC", fill_type="solid"),
-        'trading_activity': PatternFill(start_color="E2EFDA", end_color="E2EFDA", fill_type="solid"),
-        'insights': PatternFill(start_color="E2EFDA", end_color="E2EFDA", fill_type="solid"),
-        'actions': PatternFill(start_color="F4B084", end_color="F4B084", fill_type="solid"),
-        'cash': PatternFill(start_color="F4B084", end_color="F4B084", fill_type="solid"),
-        'market': PatternFill(start_color="F1DCDB", end_color="F1DCDB", fill_type="solid"),
-    }
     
-    data_fill = PatternFill(start_color="FFFFFF", end_color="FFFFFF", fill_type="solid")
-    
-    # Define fonts
-    header_font = Font(bold=True, size=12, color="FFFFFF")
-    title_font = Font(bold=True, size=16, color="FFFFFF")
-    subheader_font = Font(bold=True, size=11, color="FFFFFF")
-    bold_font = Font(bold=True, size=10)
-    regular_font = Font(size=10)
-    
-    # Define borders
-    thin_border = Border(
-        left=Side(style='thin', color="000000"),
-        right=Side(style='thin', color="000000"),
-        top=Side(style='thin', color="000000"),
-        bottom=Side(style='thin', color="000000")
-    )
-    thick_border = Border(
-        left=Side(style='medium', color="000000"),
-        right=Side(style='medium', color="000000"),
-        top=Side(style='medium', color="000000"),
-        bottom=Side(style='medium', color="000000")
-    )
+    Returns True once the result is saved, False for files of unknown structure.
+    With incremental=True, files whose content, layout version and output mode (charts,
+    conditional, template) match the manifest from a previous run are skipped (returns
+    batch.SKIPPED) instead of being re-saved.
+    
+    The result replaces filepath atomically, or goes into out_dir under the same name.
+    With charts=False the Monthly Performance charts are not added.
+    With conditional=True the Monthly Performance grid is styled by conditional formatting
+    rules (banding, gain/loss colours, data bars) instead of per-cell styles.
+    With template=True Type A files are formatted from the compiled template at the XML level
+    (see template.py) without loading them through openpyxl; charts are not added.
+    """
     
-    # ========== DETECT FILE STRUCTURE ==========
-    sheets = wb.sheetnames
-    is_type_a = 'Executive Summary' in sheets and 'Monthly Performance' in sheets
-    is_type_b = 'Data' in sheets and len(sheets) == 1
+    target = output_path(filepath, out_dir)
     
-    if is_type_a:
-        print("  → Detected: Type A (Executive Summary + Monthly Performance)")
-        format_type_a_extended(wb, header_fill, subheader_fill, metric_fill, highlight_fill,
-                              header_font, title_font, subheader_font, bold_font, regular_font,
-                              thin_border, thick_border, section_fills)
+    with instrument.phase('total', filepath):
+        manifest = None
+        if incremental:
+            from manifest import open_manifest, output_mode, is_unchanged, record, workbook_hash, file_hash
+            mode = output_mode(charts, conditional, template)
+            with instrument.phase('manifest'):
+                manifest = open_manifest(filepath)
+        
+        try:
+            if manifest is not None:
+                with instrument.phase('manifest'):
+                    unchanged = is_unchanged(manifest, filepath, mode) and os.path.exists(target)
+                if unchanged:
+                    print(f"\nSkipping (unchanged): {filepath}")
+                    return SKIPPED
+            
+            print(f"\nProcessing: {filepath}")
+            
+            # ========== DETECT FILE STRUCTURE ==========
+            # Read from the zip directly, so unknown files are skipped before the expensive load
+            with instrument.phase('detect'):
+                structure = probe(filepath)
+            
+            if structure.kind == UNKNOWN:
+                print(f"  ⚠ Warning: Unknown file structure (sheets: {', '.join(structure.sheets)}). Skipped")
+                return False
+            
+            if template and structure.kind in (TYPE_A, TYPE_A_EXTENDED):
+                print(f"  → Detected: {describe(structure.kind)}")
+                format_from_template(filepath, target)
+                if manifest is not None:
+                    with instrument.phase('manifest'):
+                        record(manifest, filepath, file_hash(target), mode)
+                print(f"✓ File saved successfully!\n")
+                return True
+            
+            with instrument.phase('load'):
+                from openpyxl import load_workbook
+                from output import atomic_save
+                wb = load_workbook(filepath)
+            
+            print(f"  → Detected: {describe(structure.kind)}")
+            format_workbook(wb, structure.kind, charts, conditional)
+            
+            # Formula KPIs (restructure --formulas) keep their computed values through the re-save
+            from formulas import formula_finalizer
+            finalize = formula_finalizer(wb)
+            
+            # Save the workbook
+            with instrument.phase('save') as timing:
+                atomic_save(wb, target, finalize)
+                timing.bytes = instrument.file_size(target)
+            
+            if manifest is not None:
+                with instrument.phase('manifest'):
+                    record(manifest, filepath, workbook_hash(wb), mode)
+        finally:
+            if manifest is not None:
+                manifest.close()
     
-    elif is_type_b:
-        print("  → Detected: Type B (Data sheet structure)")
-        format_type_b(wb, header_fill, subheader_fill, metric_fill, data_fill,
-                     section_fills, header_font, title_font, subheader_font, bold_font,
-                     regular_font, thin_border)
+    print(f"✓ File saved successfully!\n")
+    return True
+
+
+def format_workbook(wb, kind, charts=True, conditional=False):
+    """Style an open workbook of the given structure kind in place (nothing is saved)"""
+    from styles import StyleRegistry
+    
+    # Named styles are shared module-level objects; the registry resolves them per workbook
+    styles = StyleRegistry(wb)
+    
+    if kind in (TYPE_A, TYPE_A_EXTENDED):
+        format_type_a_extended(wb, styles, conditional)
+        if charts:
+            from charts import add_monthly_charts
+            with instrument.phase('charts', sheet='Monthly Performance'):
+                added = add_monthly_charts(wb['Monthly Performance'])
+            if added:
+                print(f"  ✓ {added} chart(s) added to Monthly Performance")
     
     else:
-        print("  ⚠ Warning: Unknown file structure. Attempting basic formatting...")
-    
-    # Save the workbook
-    wb.save(filepath)
-    print(f"✓ File saved successfully!\n")
+        format_type_b(wb, styles)
 
 
-def format_type_a_extended(wb, header_fill, subheader_fill, metric_fill, highlight_fill,
-                           header_font, title_font, subheader_font, bold_font, regular_font,
-                           thin_border, thick_border, section_fills):
+def format_type_a_extended(wb, styles, conditional=False):
     """Format Type A files with extended Executive Summary sections"""
+    from layout import get_layout, apply_layout
     
-    # ========== FORMAT EXECUTIVE SUMMARY ==========
-    ws_exec = wb['Executive Summary']
-    
-    # Title
-    ws_exec['A1'].font = title_font
-    ws_exec['A1'].fill = header_fill
-    ws_exec['A1'].alignment = Alignment(horizontal='left', vertical='center', wrap_text=True)
-    ws_exec.merge_cells('A1:E1')
-    ws_exec.row_dimensions[1].height = 30
-    
-    # Date
-    ws_exec['A2'].font = Font(italic=True, size=10)
-    ws_exec.row_dimensions[2].height = 18
-    ws_exec.row_dimensions[3].height = 8
-    
-    # KPI Section
-    ws_exec['A4'].font = subheader_font
-    ws_exec['A4'].fill = subheader_fill
-    ws_exec['A4'].alignment = Alignment(horizontal='left', vertical='center')
-    ws_exec.merge_cells('A4:E4')
-    ws_exec.row_dimensions[4].height = 22
-    
-    for col_letter in ['A', 'B', 'C']:
-        cell = ws_exec[col_letter + '5']
-        cell.font = header_font
-        cell.fill = header_fill
-        cell.alignment = Alignment(horizontal='center', vertical='center', wrap_text=True)
-        cell.border = thin_border
-    ws_exec.row_dimensions[5].height = 20
-    
-    # Format KPI data rows (6-14)
-    for row in range(6, 15):
-        ws_exec[f'A{row}'].font = bold_font
-        ws_exec[f'A{row}'].fill = metric_fill
-        ws_exec[f'A{row}'].border = thin_border
-        ws_exec[f'A{row}'].alignment = Alignment(horizontal='left', vertical='center', wrap_text=True)
-        
-        ws_exec[f'B{row}'].font = Font(bold=True, size=11)
-        ws_exec[f'B{row}'].fill = PatternFill(start_color="FFFFFF", end_color="FFFFFF", fill_type="solid")
-        ws_exec[f'B{row}'].border = thin_border
-        ws_exec[f'B{row}'].alignment = Alignment(horizontal='right', vertical='center')
-        
-        ws_exec[f'C{row}'].font = regular_font
-        ws_exec[f'C{row}'].fill = PatternFill(start_color="F2F2F2", end_color="F2F2F2", fill_type="solid")
-        ws_exec[f'C{row}'].border = thin_border
-        ws_exec[f'C{row}'].alignment = Alignment(horizontal='left', vertical='center')
-        ws_exec.row_dimensions[row].height = 18
-    
-    ws_exec.row_dimensions[15].height = 8
-    
-    # ========== FORMAT EXTENDED SECTIONS ==========
-    
-    # Trading Activity Summary (rows 16-20)
-    if ws_exec['A16'].value and 'TRADING' in str(ws_exec['A16'].value).upper():
-        ws_exec['A16'].font = subheader_font
-        ws_exec['A16'].fill = subheader_fill
-        ws_exec['A16'].alignment = Alignment(horizontal='left', vertical='center')
-        ws_exec.merge_cells('A16:E16')
-        ws_exec.row_dimensions[16].height = 22
-        
-        for row in range(17, 21):
-            if ws_exec[f'A{row}'].value:
-                ws_exec[f'A{row}'].font = bold_font
-                ws_exec[f'A{row}'].fill = metric_fill
-                ws_exec[f'A{row}'].border = thin_border
-                ws_exec[f'A{row}'].alignment = Alignment(horizontal='left', vertical='center')
-                
-                for col in ['B', 'C', 'D', 'E']:
-                    cell = ws_exec[f'{col}{row}']
-                    cell.fill = section_fills['trading']
-                    cell.border = thin_border
-                    cell.alignment = Alignment(horizontal='left', vertical='center')
-                
-                ws_exec.row_dimensions[row].height = 18
-    
-    ws_exec.row_dimensions[21].height = 8
-    
-    # Key Insights & Recommendations (rows 22-28)
-    if ws_exec['A22'].value and 'KEY INSIGHTS' in str(ws_exec['A22'].value).upper():
-        ws_exec['A22'].font = subheader_font
-        ws_exec['A22'].fill = subheader_fill
-        ws_exec['A22'].alignment = Alignment(horizontal='left', vertical='center')
-        ws_exec.merge_cells('A22:E22')
-        ws_exec.row_dimensions[22].height = 22
-        
-        for row in range(23, 29):
-            if ws_exec[f'A{row}'].value:
-                ws_exec[f'A{row}'].font = regular_font
-                ws_exec[f'A{row}'].fill = section_fills['insights']
-                ws_exec[f'A{row}'].border = thin_border
-                ws_exec[f'A{row}'].alignment = Alignment(horizontal='left', vertical='center', wrap_text=True)
-                
-                for col in ['B', 'C', 'D', 'E']:
-                    cell = ws_exec[f'{col}{row}']
-                    cell.fill = section_fills['insights']
-                    cell.border = thin_border
-                
-                ws_exec.row_dimensions[row].height = 20
-    
-    ws_exec.row_dimensions[29].height = 8
-    
-    # Action Items & Strategy (rows 30-36)
-    if ws_exec['A30'].value and 'ACTION ITEMS' in str(ws_exec['A30'].value).upper():
-        ws_exec['A30'].font = subheader_font
-        ws_exec['A30'].fill = subheader_fill
-        ws_exec['A30'].alignment = Alignment(horizontal='left', vertical='center')
-        ws_exec.merge_cells('A30:E30')
-        ws_exec.row_dimensions[30].height = 22
-        
-        for row in range(31, 37):
-            if ws_exec[f'A{row}'].value:
-                ws_exec[f'A{row}'].font = regular_font
-                ws_exec[f'A{row}'].fill = section_fills['actions']
-                ws_exec[f'A{row}'].border = thin_border
-                ws_exec[f'A{row}'].alignment = Alignment(horizontal='left', vertical='center', wrap_text=True)
-                
-                for col in ['B', 'C', 'D', 'E']:
-                    cell = ws_exec[f'{col}{row}']
-                    cell.fill = section_fills['actions']
-                    cell.border = thin_border
-                
-                ws_exec.row_dimensions[row].height = 20
-    
-    # Set column widths
-    ws_exec.column_dimensions['A'].width = 28
-    ws_exec.column_dimensions['B'].width = 45
-    ws_exec.column_dimensions['C'].width = 20
-    ws_exec.column_dimensions['D'].width = 15
-    ws_exec.column_dimensions['E'].width = 15
+    layout = get_layout('type_a_conditional' if conditional else 'type_a')
     
+    # ========== FORMAT EXECUTIVE SUMMARY ==========
+    # Extended sections (Trading / Key Insights / Action Items) are only styled when present
+    with instrument.phase('style', sheet='Executive Summary') as timing:
+        timing.cells = apply_layout(wb['Executive Summary'], layout['Executive Summary'], styles)
     print("  ✓ Executive Summary formatted (with extended sections)")
     
     # ========== FORMAT MONTHLY PERFORMANCE ==========
-    ws_monthly = wb['Monthly Performance']
-    
-    ws_monthly['A1'].font = Font(bold=True, size=14, color="FFFFFF")
-    ws_monthly['A1'].fill = header_fill
-    ws_monthly['A1'].alignment = Alignment(horizontal='left', vertical='center', wrap_text=True)
-    ws_monthly.merge_cells('A1:M1')
-    ws_monthly.row_dimensions[1].height = 25
-    ws_monthly.row_dimensions[2].height = 8
-    
-    # Headers
-    for col in range(1, 14):
-        cell = ws_monthly.cell(row=3, column=col)
-        cell.font = header_font
-        cell.fill = header_fill
-        cell.alignment = Alignment(horizontal='center', vertical='center', wrap_text=True)
-        cell.border = thin_border
-    ws_monthly.row_dimensions[3].height = 22
-    
-    # Portfolio Values
-    for row in [4, 5]:
-        for col in range(1, 14):
-            cell = ws_monthly.cell(row=row, column=col)
-            if col == 1:
-                cell.font = bold_font
-                cell.fill = metric_fill
-            else:
-                cell.fill = PatternFill(start_color="FFFFFF", end_color="FFFFFF", fill_type="solid")
-            cell.border = thin_border
-            cell.alignment = Alignment(horizontal='right', vertical='center')
-        ws_monthly.row_dimensions[row].height = 18
-    
-    ws_monthly.row_dimensions[6].height = 8
-    
-    # Profit Metrics Section
-    ws_monthly['A7'].font = subheader_font
-    ws_monthly['A7'].fill = subheader_fill
-    ws_monthly.merge_cells('A7:M7')
-    ws_monthly['A7'].alignment = Alignment(horizontal='left', vertical='center')
-    ws_monthly.row_dimensions[7].height = 20
-    
-    for row in range(8, 13):
-        for col in range(1, 14):
-            cell = ws_monthly.cell(row=row, column=col)
-            if col == 1:
-                cell.font = bold_font
-                cell.fill = metric_fill
-            else:
-                cell.fill = section_fills['trading']
-            cell.border = thin_border
-            cell.alignment = Alignment(horizontal='right', vertical='center')
-        ws_monthly.row_dimensions[row].height = 18
-    
-    ws_monthly.row_dimensions[13].height = 8
-    
-    # Trading Activity Section
-    ws_monthly['A14'].font = subheader_font
-    ws_monthly['A14'].fill = subheader_fill
-    ws_monthly.merge_cells('A14:M14')
-    ws_monthly['A14'].alignment = Alignment(horizontal='left', vertical='center')
-    ws_monthly.row_dimensions[14].height = 20
-    
-    for row in range(15, 21):
-        for col in range(1, 14):
-            cell = ws_monthly.cell(row=row, column=col)
-            if col == 1:
-                cell.font = bold_font
-                cell.fill = metric_fill
-            else:
-                cell.fill = section_fills['trading_activity']
-            cell.border = thin_border
-            cell.alignment = Alignment(horizontal='right', vertical='center')
-        ws_monthly.row_dimensions[row].height = 18
-    
-    ws_monthly.row_dimensions[21].height = 8
-    
-    # Cash Position Section
-    ws_monthly['A22'].font = subheader_font
-    ws_monthly['A22'].fill = subheader_fill
-    ws_monthly.merge_cells('A22:M22')
-    ws_monthly['A22'].alignment = Alignment(horizontal='left', vertical='center')
-    ws_monthly.row_dimensions[22].height = 20
-    
-    for row in range(23, 27):
-        for col in range(1, 14):
-            cell = ws_monthly.cell(row=row, column=col)
-            if col == 1:
-                cell.font = bold_font
-                cell.fill = metric_fill
-            else:
-                cell.fill = section_fills['cash']
-            cell.border = thin_border
-            cell.alignment = Alignment(horizontal='right', vertical='center')
-        ws_monthly.row_dimensions[row].height = 18
-    
-    ws_monthly.row_dimensions[27].height = 8
-    
-    # Market Comparison Section
-    ws_monthly['A28'].font = subheader_font
-    ws_monthly['A28'].fill = subheader_fill
-    ws_monthly.merge_cells('A28:M28')
-    ws_monthly['A28'].alignment = Alignment(horizontal='left', vertical='center')
-    ws_monthly.row_dimensions[28].height = 20
-    
-    for row in range(29, 33):
-        for col in range(1, 14):
-            cell = ws_monthly.cell(row=row, column=col)
-            if col == 1:
-                cell.font = bold_font
-                cell.fill = metric_fill
-            else:
-                cell.fill = section_fills['market']
-            cell.border = thin_border
-            cell.alignment = Alignment(horizontal='right', vertical='center')
-        ws_monthly.row_dimensions[row].height = 18
-    
-    # Format remaining rows
-    for row in range(33, ws_monthly.max_row + 1):
-        for col in range(1, 14):
-            cell = ws_monthly.cell(row=row, column=col)
-            cell.border = thin_border
-            cell.alignment = Alignment(horizontal='right', vertical='center')
-            if col == 1:
-                cell.font = bold_font
-                cell.fill = metric_fill
-            else:
-                cell.fill = PatternFill(start_color="FFFFFF", end_color="FFFFFF", fill_type="solid")
-    
-    # Set column widths
-    ws_monthly.column_dimensions['A'].width = 28
-    for col in range(2, 14):
-        ws_monthly.column_dimensions[get_column_letter(col)].width = 14
-    
-    print("  ✓ Monthly Performance formatted")
+    with instrument.phase('style', sheet='Monthly Performance') as timing:
+        timing.cells = apply_layout(wb['Monthly Performance'], layout['Monthly Performance'], styles)
+    print("  ✓ Monthly Performance formatted" + (" (conditional formatting)" if conditional else ""))
+
+
+def format_from_template(filepath, target):
+    """Format a Type A file from the compiled template and save it to target"""
+    from template import render_template
+    from output import atomic_save
+    
+    with instrument.phase('style', sheet='Executive Summary + Monthly Performance') as timing:
+        rendered = render_template(filepath)
+        timing.cells = rendered.cells_styled
+    print("  ✓ Executive Summary and Monthly Performance formatted (template)")
+    if not rendered.has_charts:
+        print("  → Charts are not added in template mode (run without --template to add them)")
+    
+    # Cell values and cached formula results are copied unchanged, so nothing to finalize
+    with instrument.phase('save') as timing:
+        atomic_save(rendered, target)
+        timing.bytes = instrument.file_size(target)
+
+
+def detect_only(files):
+    """Report each file's structure from the zip contents alone; returns True if all are known"""
+    all_known = True
+    for filepath in files:
+        if not os.path.isfile(filepath):
+            print(f"  ✗ {filepath}: file not found")
+            all_known = False
+            continue
+        try:
+            structure = probe(filepath)
+        except Exception as e:
+            print(f"  ✗ {filepath}: {str(e) or type(e).__name__}")
+            all_known = False
+            continue
+        marker = '⚠' if structure.kind == UNKNOWN else '✓'
+        print(f"  {marker} {filepath}: {describe(structure.kind)}")
+        all_known = all_known and structure.kind != UNKNOWN
+    return all_known
 
 
-def format_type_b(wb, header_fill, subheader_fill, metric_fill, data_fill,
-                 section_fills, header_font, title_font, subheader_font, bold_font,
-                 regular_font, thin_border):
+def format_type_b(wb, styles):
     """Format Type B files (Data sheet only)"""
     # Placeholder - Type B files are typically restructured to Type A
     print("  ✓ Data sheet formatting applied")
@@ -367,7 +187,7 @@ if __name__ == '__main__':
         print("UNIVERSAL PORTFOLIO FORMATTER (EXTENDED)")
         print("Professional formatting for all portfolio file types")
         print("="*70)
-        print("\nUsage: python format_all.py <filename.xlsx> [file2.xlsx ...]")
+        print("\nUsage: python format_all.py <filename.xlsx> [file2.xlsx ...] [--jobs N] [--incremental] [--out-dir DIR] [--resume] [--no-charts] [--conditional] [--template] [--detect-only] [--profile [TRACE]]")
         print("\nSupports:")
         print("  • Type A: Executive Summary + Monthly Performance + Data")
         print("  • Type A Extended: + Trading Activity + Key Insights + Action Items")
@@ -375,28 +195,66 @@ if __name__ == '__main__':
         print("\nExample:")
         print("  python format_all.py Portfolio1.xlsx")
         print("  python format_all.py *.xlsx")
+        print("  python format_all.py *.xlsx --jobs 8   (8 worker processes)")
+        print("  python format_all.py *.xlsx --incremental   (skip unchanged files)")
+        print("  python format_all.py *.xlsx --out-dir Formatted   (leave the inputs untouched)")
+        print("  python format_all.py *.xlsx --resume   (continue an interrupted batch)")
+        print("  python format_all.py *.xlsx --conditional   (rule-based Monthly Performance styling, smaller files)")
+        print("  python format_all.py *.xlsx --template   (fast XML-level formatting, no charts)")
+        print("  python format_all.py *.xlsx --profile trace.jsonl   (time each phase)")
+        print("  python format_all.py *.xlsx --detect-only   (report file types, change nothing)")
         print("="*70 + "\n")
         sys.exit(0)
     
+    parser = argparse.ArgumentParser(description="Universal portfolio formatter")
+    add_batch_arguments(parser)
+    parser.add_argument('--incremental', action='store_true',
+                        help='Skip files unchanged since the last run (manifest kept next to the inputs)')
+    parser.add_argument('--no-charts', dest='charts', action='store_false',
+                        help='Do not add charts to Monthly Performance (faster batch runs)')
+    parser.add_argument('--conditional', action='store_true',
+                        help='Style the Monthly Performance grid with conditional formatting rules instead of per-cell styles')
+    parser.add_argument('--template', action='store_true',
+                        help='Format Type A files from the compiled template without loading them (no charts)')
+    parser.add_argument('--detect-only', '--check', dest='detect_only', action='store_true',
+                        help='Only report each file\'s structure (exit status 1 if any is missing or unknown)')
+    args = parser.parse_args()
+    if args.template and args.conditional:
+        parser.error('--template cannot be combined with --conditional')
+    
     # Get all files to process
-    files_to_process = []
-    for arg in sys.argv[1:]:
-        if '*' in arg:
-            import glob
-            files_to_process.extend(glob.glob(arg))
-        else:
-            files_to_process.append(arg)
+    files_to_process = expand_file_args(args.files)
+    
+    if args.detect_only:
+        sys.exit(0 if detect_only(files_to_process) else 1)
     
     print("\n" + "="*70)
     print(f"Processing {len(files_to_process)} file(s)...")
     print("="*70)
     
-    for filename in files_to_process:
-        try:
-            format_portfolio_universal(filename)
-        except Exception as e:
-            print(f"✗ Error: {e}\n")
+    if args.out_dir:
+        os.makedirs(args.out_dir, exist_ok=True)
+    journal = open_journal('format_all', args.out_dir, resume=args.resume)
+    
+    with instrument.profiling(args.profile) if args.profile is not None else nullcontext() as profile:
+        start = time.perf_counter()
+        results = run_batch(format_portfolio_universal, files_to_process, jobs=args.jobs, journal=journal,
+                            incremental=args.incremental, out_dir=args.out_dir, charts=args.charts,
+                            conditional=args.conditional, template=args.template)
+    journal.close(completed=all(r.error is None for r in results))
     
     print("="*70)
     print("FORMATTING COMPLETE")
-    print("="*70 + "\n")
+    if args.incremental:
+        print(f"{sum(1 for r in results if r.skipped)} unchanged file(s) skipped")
+    unknown = sum(1 for r in results if not r.ok and not r.skipped and r.error is None)
+    if unknown:
+        print(f"{unknown} file(s) of unknown structure skipped")
+    print("="*70)
+    print_timing_summary(results, time.perf_counter() - start)
+    if profile is not None:
+        print()
+        profile.print_table()
+        if args.profile:
+            print(f"  Trace written to {args.profile}")
+    print()
@@ -0,0 +1,196 @@
+"""
+Optional per-phase instrumentation
+Code under test wraps each stage in `with phase('load'):`; when nothing is listening the
+call returns a shared no-op object, so the disabled cost is one function call per phase.
+Listeners are plain callables registered with add_hook(); each receives one event dict:
+
+    {'phase': 'save', 'file': 'x.xlsx', 'sheet': None, 'start': 1738.2,
+     'duration_s': 0.41, 'cells': None, 'bytes': 48213}
+
+Phases nest: an inner phase inherits the file (and sheet) of the phase around it; the
+outermost per-file phase is called 'total'.
+Worker processes record events with collect() and the batch engine replays them in the
+parent with emit(), so hooks only ever run in the process that registered them.
+"""
+
+import os
+import json
+import time
+from contextlib import contextmanager
+
+
+_hooks = []
+_collector = None   # list of events while collect() is active, else None
+_stack = []         # open phases, innermost last
+
+
+class _NullPhase:
+    """Returned when instrumentation is off; swallows attribute writes"""
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def __setattr__(self, name, value):
+        pass
+
+
+_NULL_PHASE = _NullPhase()
+
+
+class _Phase:
+    """One timed phase; set .cells / .bytes inside the with block to report them"""
+
+    def __init__(self, name, filepath, sheet):
+        self.name = name
+        self.file = filepath
+        self.sheet = sheet
+        self.cells = None
+        self.bytes = None
+
+    def __enter__(self):
+        if _stack:
+            parent = _stack[-1]
+            self.file = self.file or parent.file
+            self.sheet = self.sheet or parent.sheet
+        _stack.append(self)
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        duration = time.perf_counter() - self.start
+        _stack.pop()
+        emit({
+            'phase': self.name,
+            'file': self.file,
+            'sheet': self.sheet,
+            'start': round(self.start, 6),
+            'duration_s': round(duration, 6),
+            'cells': self.cells,
+            'bytes': self.bytes,
+            'error': exc_type.__name__ if exc_type else None,
+        })
+        return False
+
+
+def enabled():
+    """True when phase events are being recorded"""
+    return _collector is not None or bool(_hooks)
+
+
+def phase(name, filepath=None, sheet=None):
+    """Context manager timing one phase (a no-op unless a hook or collector is active)"""
+    if _collector is None and not _hooks:
+        return _NULL_PHASE
+    return _Phase(name, filepath, sheet)
+
+
+def file_size(filepath):
+    """Bytes on disk, for reporting what a save phase wrote"""
+    try:
+        return os.path.getsize(filepath)
+    except OSError:
+        return None
+
+
+def add_hook(hook):
+    """Register a callable that receives every phase event"""
+    _hooks.append(hook)
+    return hook
+
+
+def remove_hook(hook):
+    if hook in _hooks:
+        _hooks.remove(hook)
+
+
+def emit(event):
+    """Hand an event to the active collector, or else to every registered hook"""
+    if _collector is not None:
+        _collector.append(event)
+        return
+    for hook in _hooks:
+        hook(event)
+
+
+@contextmanager
+def collect():
+    """Record events into a list instead of dispatching them (used inside batch workers)"""
+    global _collector
+    previous, _collector = _collector, []
+    try:
+        yield _collector
+    finally:
+        _collector = previous
+
+
+# ========== BUILT-IN HOOKS ==========
+
+class TraceWriter:
+    """Hook writing one JSON object per line to a trace file"""
+
+    def __init__(self, path):
+        self.path = path
+        self._fh = open(path, 'w', encoding='utf-8')
+
+    def __call__(self, event):
+        self._fh.write(json.dumps(event) + '\n')
+
+    def close(self):
+        self._fh.close()
+
+
+class PhaseSummary:
+    """Hook aggregating events per phase and per file for the end-of-run table"""
+
+    def __init__(self):
+        self.phases = {}    # phase (or 'phase [sheet]') -> [count, seconds, cells, bytes]
+        self.files = {}     # file -> {phase: seconds}
+
+    def __call__(self, event):
+        key = f"{event['phase']} [{event['sheet']}]" if event['sheet'] else event['phase']
+        totals = self.phases.setdefault(key, [0, 0.0, 0, 0])
+        totals[0] += 1
+        totals[1] += event['duration_s']
+        totals[2] += event['cells'] or 0
+        totals[3] += event['bytes'] or 0
+        # Per-sheet phases are rolled up into their file
+        if event['file'] is not None:
+            by_phase = self.files.setdefault(event['file'], {})
+            by_phase[event['phase']] = by_phase.get(event['phase'], 0.0) + event['duration_s']
+
+    def print_table(self):
+        if not self.phases:
+            return
+        print("PROFILE SUMMARY")
+        print("-" * 70)
+        print(f"  {'phase':<32} {'calls':>5} {'total':>9} {'avg':>9} {'cells':>7} {'bytes':>10}")
+        for name, (count, seconds, cells, size) in self.phases.items():
+            print(f"  {name:<32} {count:>5} {seconds:>8.3f}s {seconds / count:>8.4f}s "
+                  f"{cells or '-':>7} {size or '-':>10}")
+
+        if len(self.files) > 1:
+            print("-" * 70)
+            for filepath, by_phase in self.files.items():
+                phases = {name: seconds for name, seconds in by_phase.items() if name != 'total'}
+                if not phases:
+                    continue
+                slowest = max(phases, key=phases.get)
+                print(f"  {os.path.basename(filepath)}: slowest phase {slowest} ({phases[slowest]:.3f}s)")
+
+
+@contextmanager
+def profiling(trace_path=None):
+    """Enable the trace writer and summary hooks for the duration of a CLI run"""
+    summary = add_hook(PhaseSummary())
+    writer = add_hook(TraceWriter(trace_path)) if trace_path else None
+    try:
+        yield summary
+    finally:
+        remove_hook(summary)
+        if writer is not None:
+            remove_hook(writer)
+            writer.close()
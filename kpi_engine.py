@@ -0,0 +1,187 @@
+"""
+NumPy-backed KPI engine
+Metrics are held as a float array of shape (accounts, metrics, months), with NaN for blank
+or non-numeric cells and for months an account doesn't have. Every KPI is computed for
+all accounts at once, including trailing-window returns, drawdown and volatility.
+calculate_kpis() keeps the single-account dictionary interface used by the report builders.
+"""
+
+import numpy as np
+
+
+# Rows of the metrics array, in order
+KPI_METRICS = (
+    'Portfolio value',
+    'At the beginning of the period',
+    'Total profit',
+    'Total profit, %',
+    'Dividends',
+)
+VALUE, START, PROFIT, PROFIT_PCT, DIVIDENDS = range(len(KPI_METRICS))
+
+TRAILING_WINDOWS = (3, 6, 12)
+
+
+def to_float(value):
+    """Cell value -> float, NaN for blanks, '-' placeholders and text"""
+    if isinstance(value, bool):
+        return np.nan
+    if isinstance(value, (int, float)):
+        return float(value)
+    if isinstance(value, str):
+        try:
+            return float(value.replace(',', ''))
+        except ValueError:
+            return np.nan
+    return np.nan
+
+
+def metrics_array(metrics_data, month_count, metrics=KPI_METRICS):
+    """One account's metrics_data dict -> float array of shape (len(metrics), month_count)"""
+    array = np.full((len(metrics), month_count), np.nan)
+    for idx, name in enumerate(metrics):
+        values = metrics_data.get(name)
+        if values:
+            values = values[:month_count]
+            array[idx, :len(values)] = [to_float(v) for v in values]
+    return array
+
+
+def stack_accounts(arrays):
+    """Stack per-account arrays into (accounts, metrics, months), padding shorter histories with NaN"""
+    month_count = max((a.shape[1] for a in arrays), default=0)
+    stacked = np.full((len(arrays), len(KPI_METRICS), month_count), np.nan)
+    for idx, array in enumerate(arrays):
+        stacked[idx, :, :array.shape[1]] = array
+    return stacked
+
+
+def _last_month(series, lengths):
+    """Value in the last month of each account's history"""
+    idx = np.clip(lengths - 1, 0, None)
+    return np.take_along_axis(series, idx[:, None], axis=1)[:, 0]
+
+
+def trailing_returns(returns_pct, window):
+    """
+    Compounded return (in %) over the trailing `window` months, for every month.
+    returns_pct is (accounts, months); months without a full window are NaN.
+    """
+    factors = np.where(np.isnan(returns_pct), 1.0, 1.0 + returns_pct / 100.0)
+    cumulative = np.cumprod(factors, axis=1)
+    trailing = np.full(returns_pct.shape, np.nan)
+    if returns_pct.shape[1] >= window:
+        previous = np.concatenate([np.ones((returns_pct.shape[0], 1)), cumulative[:, :-window]], axis=1)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            trailing[:, window - 1:] = (cumulative[:, window - 1:] / previous - 1.0) * 100.0
+    return trailing
+
+
+def max_drawdown(values):
+    """Largest peak-to-trough fall (in %, <= 0) of each account's portfolio value series"""
+    peaks = np.fmax.accumulate(np.where(np.isnan(values), -np.inf, values), axis=1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        drawdowns = np.where(peaks > 0, values / peaks - 1.0, np.nan) * 100.0
+    drawdowns = np.where(np.isnan(drawdowns), 0.0, drawdowns)
+    return drawdowns.min(axis=1, initial=0.0)
+
+
+def compute_kpis(array, lengths=None):
+    """
+    Compute KPIs for every account in an (accounts, metrics, months) array.
+    lengths gives each account's month count (defaults to the full width).
+    Returns a dict of arrays with one entry per account.
+    """
+    accounts, _, month_count = array.shape
+    if lengths is None:
+        lengths = np.full(accounts, month_count)
+    lengths = np.asarray(lengths)
+
+    values = array[:, VALUE]
+    starts = array[:, START]
+    has_start_row = ~np.all(np.isnan(starts), axis=1)
+
+    # Without an 'At the beginning of the period' row the first portfolio value is the start
+    start_value = np.where(has_start_row, starts[:, 0], values[:, 0]) if month_count else np.zeros(accounts)
+    end_value = _last_month(values, lengths) if month_count else np.zeros(accounts)
+    start_value = np.nan_to_num(start_value)
+    end_value = np.nan_to_num(end_value)
+
+    growth = end_value - start_value
+    with np.errstate(divide='ignore', invalid='ignore'):
+        growth_percent = np.where(start_value != 0, growth / start_value * 100, 0.0)
+
+    profits = np.nan_to_num(array[:, PROFIT])
+    dividends = np.nan_to_num(array[:, DIVIDENDS])
+    total_profit = profits.sum(axis=1)
+    total_dividends = dividends.sum(axis=1)
+
+    # Monthly statistics over months with a non-zero profit
+    active = profits != 0
+    active_count = active.sum(axis=1)
+    has_active = active_count > 0
+    best_month = np.where(has_active, np.where(active, profits, -np.inf).max(axis=1, initial=-np.inf), 0.0)
+    worst_month = np.where(has_active, np.where(active, profits, np.inf).min(axis=1, initial=np.inf), 0.0)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        avg_monthly = np.where(has_active, total_profit / active_count, 0.0)
+    positive_months = (profits > 0).sum(axis=1)
+
+    returns = array[:, PROFIT_PCT]
+    return_count = (~np.isnan(returns)).sum(axis=1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        mean_return = np.where(return_count > 0, np.nansum(returns, axis=1) / return_count, np.nan)
+        deviations = np.where(np.isnan(returns), 0.0, returns - mean_return[:, None])
+        volatility = np.where(return_count > 1,
+                              np.sqrt((deviations ** 2).sum(axis=1) / (return_count - 1)), 0.0)
+
+    kpis = {
+        'start_value': start_value,
+        'end_value': end_value,
+        'growth': growth,
+        'growth_percent': growth_percent,
+        'total_profit': total_profit,
+        'total_dividends': total_dividends,
+        'total_gains': total_profit - total_dividends,
+        'best_month': best_month,
+        'worst_month': worst_month,
+        'avg_monthly': avg_monthly,
+        'positive_months': positive_months,
+        'total_months': lengths,
+        'max_drawdown': max_drawdown(values),
+        'volatility': volatility,
+        'annualized_volatility': volatility * np.sqrt(12),
+    }
+
+    for window in TRAILING_WINDOWS:
+        if month_count:
+            trailing = _last_month(trailing_returns(returns, window), lengths)
+            kpis[f'trailing_{window}m'] = np.where(lengths >= window, trailing, np.nan)
+        else:
+            kpis[f'trailing_{window}m'] = np.full(accounts, np.nan)
+
+    return kpis
+
+
+def calculate_kpis(metrics_data, months, title):
+    """Calculate Key Performance Indicators from metrics data"""
+
+    portfolio_values = metrics_data.get('Portfolio value', [])
+    if not portfolio_values or len(portfolio_values) < 2:
+        return {}
+
+    array = metrics_array(metrics_data, len(months))[None]
+    kpis = {name: values[0].item() for name, values in compute_kpis(array).items()}
+    kpis['positive_months'] = int(kpis['positive_months'])
+    kpis['total_months'] = len(months)
+    kpis['months'] = months
+    return kpis
+
+
+def calculate_kpis_batch(accounts):
+    """
+    KPIs for many accounts in one vectorized pass.
+    accounts is a sequence of (metrics_data, months); returns a dict of per-account arrays.
+    """
+    arrays = [metrics_array(metrics_data, len(months)) for metrics_data, months in accounts]
+    lengths = [len(months) for _, months in accounts]
+    return compute_kpis(stack_accounts(arrays), lengths)
@@ -0,0 +1,339 @@
+"""
+Historical KPI store
+Keeps every account's monthly metrics in a small sqlite file, one row per account and
+month, next to running aggregates (cumulative profit and dividends, best/worst month,
+win rate, return mean/variance, drawdown) for the whole stored history. Reports cover a
+rolling window of months; recording each one adds only the months the store hasn't seen,
+and the aggregates are updated from those months alone. Lifetime KPIs are then a single
+row lookup, and per-year trends one indexed query, however many years are stored.
+
+A month that comes back with different numbers (a restated report) is overwritten and
+that account's aggregates are rebuilt from its stored months.
+"""
+
+import os
+import sys
+import math
+import argparse
+import sqlite3
+from datetime import datetime
+
+import numpy as np
+
+from kpi_engine import TRAILING_WINDOWS, metrics_array, trailing_returns
+from periods import parse_month, month_label
+
+
+# Stored metric columns, in kpi_engine.KPI_METRICS order
+METRIC_COLUMNS = ('portfolio_value', 'start_value', 'profit', 'profit_pct', 'dividends')
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS monthly_metrics (
+    account TEXT NOT NULL,
+    month TEXT NOT NULL,
+    portfolio_value REAL,
+    start_value REAL,
+    profit REAL,
+    profit_pct REAL,
+    dividends REAL,
+    PRIMARY KEY (account, month)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS account_kpis (
+    account TEXT PRIMARY KEY,
+    first_month TEXT NOT NULL,
+    last_month TEXT NOT NULL,
+    months INTEGER NOT NULL,
+    start_value REAL NOT NULL,
+    end_value REAL NOT NULL,
+    total_profit REAL NOT NULL,
+    total_dividends REAL NOT NULL,
+    active_months INTEGER NOT NULL,
+    best_month REAL,
+    worst_month REAL,
+    positive_months INTEGER NOT NULL,
+    return_count INTEGER NOT NULL,
+    return_mean REAL NOT NULL,
+    return_m2 REAL NOT NULL,
+    peak_value REAL,
+    max_drawdown REAL NOT NULL,
+    updated_at TEXT NOT NULL
+);
+"""
+
+_AGGREGATES = ('first_month', 'last_month', 'months', 'start_value', 'end_value', 'total_profit',
+               'total_dividends', 'active_months', 'best_month', 'worst_month', 'positive_months',
+               'return_count', 'return_mean', 'return_m2', 'peak_value', 'max_drawdown')
+
+
+def open_store(path):
+    """Open (creating if needed) the KPI store at path"""
+    conn = sqlite3.connect(path, timeout=30)
+    conn.executescript(_SCHEMA)
+    return conn
+
+
+def month_key(label):
+    """'Mar 25' -> '2025-03' (sorts in date order), or None if the label isn't a month"""
+    key = parse_month(label)
+    return f"{key[0]:04d}-{key[1]:02d}" if key else None
+
+
+def _label(key):
+    return month_label((int(key[:4]), int(key[5:])))
+
+
+def _present(value):
+    return value is not None and not math.isnan(value)
+
+
+class RunningKPIs:
+    """Aggregates over an account's months, updated one month at a time in month order"""
+
+    def __init__(self, row=None):
+        values = dict(zip(_AGGREGATES, row)) if row else {}
+        self.first_month = values.get('first_month')
+        self.last_month = values.get('last_month')
+        self.months = values.get('months', 0)
+        self.start_value = values.get('start_value', 0.0)
+        self.end_value = values.get('end_value', 0.0)
+        self.total_profit = values.get('total_profit', 0.0)
+        self.total_dividends = values.get('total_dividends', 0.0)
+        self.active_months = values.get('active_months', 0)
+        self.best_month = values.get('best_month')
+        self.worst_month = values.get('worst_month')
+        self.positive_months = values.get('positive_months', 0)
+        self.return_count = values.get('return_count', 0)
+        self.return_mean = values.get('return_mean', 0.0)
+        self.return_m2 = values.get('return_m2', 0.0)
+        self.peak_value = values.get('peak_value')
+        self.max_drawdown = values.get('max_drawdown', 0.0)
+
+    def add(self, month, value, start, profit, profit_pct, dividends):
+        """Fold in the next month (NaN or None for blanks)"""
+        if self.months == 0:
+            self.first_month = month
+            # The opening value of the first month, as calculate_kpis uses it
+            first = start if _present(start) else value
+            self.start_value = first if _present(first) else 0.0
+        self.last_month = month
+        self.months += 1
+        self.end_value = value if _present(value) else 0.0
+
+        profit = profit if _present(profit) else 0.0
+        self.total_profit += profit
+        self.total_dividends += dividends if _present(dividends) else 0.0
+        if profit != 0:
+            self.active_months += 1
+            self.best_month = profit if self.best_month is None else max(self.best_month, profit)
+            self.worst_month = profit if self.worst_month is None else min(self.worst_month, profit)
+        if profit > 0:
+            self.positive_months += 1
+
+        # Welford's update keeps the variance of the monthly returns exact without the history
+        if _present(profit_pct):
+            self.return_count += 1
+            delta = profit_pct - self.return_mean
+            self.return_mean += delta / self.return_count
+            self.return_m2 += delta * (profit_pct - self.return_mean)
+
+        if _present(value):
+            self.peak_value = value if self.peak_value is None else max(self.peak_value, value)
+            if self.peak_value > 0:
+                self.max_drawdown = min(self.max_drawdown, (value / self.peak_value - 1.0) * 100.0)
+
+    def row(self):
+        return tuple(getattr(self, name) for name in _AGGREGATES)
+
+
+def _report_rows(months, metrics_data):
+    """{month key: metric values} for the months of one report; non-month columns are left out"""
+    array = metrics_array(metrics_data, len(months))
+    rows = {}
+    for idx, label in enumerate(months):
+        key = month_key(label)
+        if key is not None:
+            rows[key] = tuple(float(v) if not np.isnan(v) else None for v in array[:, idx])
+    return rows
+
+
+def _rebuild(conn, account):
+    running = RunningKPIs()
+    for month, *values in conn.execute(
+            f"SELECT month, {', '.join(METRIC_COLUMNS)} FROM monthly_metrics WHERE account = ? ORDER BY month",
+            (account,)):
+        running.add(month, *values)
+    return running
+
+
+def record_months(conn, account, months, metrics_data):
+    """
+    Add one report's months for account. Months already stored with the same numbers cost
+    nothing; new months after the last stored one are folded into the running aggregates;
+    anything else (restated or back-filled months) rebuilds the account's aggregates.
+    Returns the number of months added or revised.
+    """
+    rows = _report_rows(months, metrics_data)
+    if not rows:
+        return 0
+
+    with conn:
+        stored = {month: tuple(values) for month, *values in conn.execute(
+            f"SELECT month, {', '.join(METRIC_COLUMNS)} FROM monthly_metrics "
+            "WHERE account = ? AND month BETWEEN ? AND ?", (account, min(rows), max(rows)))}
+        changed = sorted(month for month, values in rows.items() if stored.get(month) != values)
+        if not changed:
+            return 0
+
+        conn.executemany(
+            f"INSERT OR REPLACE INTO monthly_metrics VALUES (?, ?, {', '.join('?' * len(METRIC_COLUMNS))})",
+            [(account, month) + rows[month] for month in changed])
+
+        state = conn.execute(f"SELECT {', '.join(_AGGREGATES)} FROM account_kpis WHERE account = ?",
+                             (account,)).fetchone()
+        if state is not None and all(month > state[1] for month in changed):
+            running = RunningKPIs(state)
+            for month in changed:
+                running.add(month, *rows[month])
+        else:
+            running = _rebuild(conn, account)
+
+        conn.execute(f"INSERT OR REPLACE INTO account_kpis VALUES (?, {', '.join('?' * len(_AGGREGATES))}, ?)",
+                     (account,) + running.row() + (datetime.now().isoformat(timespec='seconds'),))
+    return len(changed)
+
+
+def record_report(path, account, months, metrics_data):
+    """Open the store at path, record one report's months; returns (months added or revised, months stored)"""
+    conn = open_store(path)
+    try:
+        changed = record_months(conn, account, months, metrics_data)
+        stored = conn.execute("SELECT months FROM account_kpis WHERE account = ?", (account,)).fetchone()
+        return changed, stored[0] if stored else 0
+    finally:
+        conn.close()
+
+
+def _trailing(conn, account):
+    """Trailing-window returns from the account's last few stored months"""
+    window = max(TRAILING_WINDOWS)
+    recent = [row[0] for row in conn.execute(
+        "SELECT profit_pct FROM monthly_metrics WHERE account = ? ORDER BY month DESC LIMIT ?", (account, window))]
+    returns = np.array([np.nan if value is None else value for value in reversed(recent)], dtype=float)[None]
+    trailing = {}
+    for size in TRAILING_WINDOWS:
+        trailing[f'trailing_{size}m'] = (trailing_returns(returns, size)[0, -1].item()
+                                         if len(recent) >= size else np.nan)
+    return trailing
+
+
+def account_kpis(conn, account):
+    """
+    KPIs over the account's whole stored history, in the shape calculate_kpis returns
+    (plus first_month / last_month); {} if the account isn't in the store.
+    """
+    state = conn.execute(f"SELECT {', '.join(_AGGREGATES)} FROM account_kpis WHERE account = ?",
+                         (account,)).fetchone()
+    if state is None:
+        return {}
+    running = RunningKPIs(state)
+    growth = running.end_value - running.start_value
+    volatility = math.sqrt(running.return_m2 / (running.return_count - 1)) if running.return_count > 1 else 0.0
+    kpis = {
+        'first_month': _label(running.first_month),
+        'last_month': _label(running.last_month),
+        'start_value': running.start_value,
+        'end_value': running.end_value,
+        'growth': growth,
+        'growth_percent': growth / running.start_value * 100 if running.start_value else 0.0,
+        'total_profit': running.total_profit,
+        'total_dividends': running.total_dividends,
+        'total_gains': running.total_profit - running.total_dividends,
+        'best_month': running.best_month if running.active_months else 0.0,
+        'worst_month': running.worst_month if running.active_months else 0.0,
+        'avg_monthly': running.total_profit / running.active_months if running.active_months else 0.0,
+        'positive_months': running.positive_months,
+        'total_months': running.months,
+        'max_drawdown': running.max_drawdown,
+        'volatility': volatility,
+        'annualized_volatility': volatility * math.sqrt(12),
+    }
+    kpis.update(_trailing(conn, account))
+    return kpis
+
+
+def yearly_trend(conn, account):
+    """[(year, months, profit, dividends, positive months, year-end value)] for the account"""
+    year_end = dict(conn.execute(
+        "SELECT substr(month, 1, 4), portfolio_value FROM monthly_metrics WHERE account = ? AND month IN "
+        "(SELECT MAX(month) FROM monthly_metrics WHERE account = ? GROUP BY substr(month, 1, 4))",
+        (account, account)))
+    return [row + (year_end.get(row[0]),) for row in conn.execute(
+        "SELECT substr(month, 1, 4) AS year, COUNT(*), TOTAL(profit), TOTAL(dividends), "
+        "TOTAL(profit > 0) FROM monthly_metrics WHERE account = ? GROUP BY year ORDER BY year", (account,))]
+
+
+def accounts(conn):
+    return [row[0] for row in conn.execute("SELECT account FROM account_kpis ORDER BY account")]
+
+
+def _money(value):
+    return f"${value:,.2f}" if _present(value) else '-'
+
+
+def print_account(conn, account, years=False):
+    kpis = account_kpis(conn, account)
+    if not kpis:
+        print(f"  ✗ {account}: not in the store")
+        return
+    print(f"\n{account}  ({kpis['first_month']} - {kpis['last_month']}, {kpis['total_months']} months)")
+    print(f"  Growth ............. {_money(kpis['growth'])} ({kpis['growth_percent']:.2f}%)")
+    print(f"  Total profit ....... {_money(kpis['total_profit'])}")
+    print(f"  Dividends .......... {_money(kpis['total_dividends'])}")
+    print(f"  Best / worst month . {_money(kpis['best_month'])} / {_money(kpis['worst_month'])}")
+    print(f"  Win rate ........... {kpis['positive_months']} of {kpis['total_months']} months")
+    print(f"  Max drawdown ....... {kpis['max_drawdown']:.2f}%")
+    if years:
+        print(f"  {'Year':<6}{'Months':>7}{'Profit':>16}{'Dividends':>14}{'Up':>4}{'Year-end value':>18}")
+        for year, count, profit, dividends, positive, end_value in yearly_trend(conn, account):
+            print(f"  {year:<6}{count:>7}{_money(profit):>16}{_money(dividends):>14}{int(positive):>4}"
+                  f"{_money(end_value):>18}")
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2:
+        print("\n" + "=" * 70)
+        print("KPI HISTORY STORE")
+        print("Lifetime KPIs and yearly trends from every report recorded so far")
+        print("=" * 70)
+        print("\nUsage: python kpi_store.py <store.sqlite> [file.xlsx ...] [--account NAME] [--years]")
+        print("\nExample:")
+        print("  python kpi_store.py history.sqlite *.xlsx   (record reports, then show every account)")
+        print("  python kpi_store.py history.sqlite --years   (show stored accounts with yearly trends)")
+        print("  python restructure_type_b.py *.xlsx --kpi-store history.sqlite   (record while restructuring)")
+        print("=" * 70 + "\n")
+        sys.exit(0)
+
+    parser = argparse.ArgumentParser(description="Historical KPI store")
+    parser.add_argument('store', help='sqlite file holding the history (created if missing)')
+    parser.add_argument('files', nargs='*', help='Reports to record (Type B or restructured Type A)')
+    parser.add_argument('--account', action='append', help='Only show this account (repeatable)')
+    parser.add_argument('--years', action='store_true', help='Also show per-year totals')
+    args = parser.parse_args()
+
+    from batch import expand_file_args
+    from consolidate import read_account
+
+    conn = open_store(args.store)
+    for filepath in expand_file_args(args.files) if args.files else []:
+        try:
+            title, months, metrics_data = read_account(filepath)
+        except Exception as e:
+            print(f"  ✗ {filepath}: {str(e) or type(e).__name__}")
+            continue
+        changed = record_months(conn, str(title).strip(), months, metrics_data)
+        print(f"  ✓ {os.path.basename(filepath)}: {changed} new or revised month(s)")
+
+    for account in args.account or accounts(conn):
+        print_account(conn, account, args.years)
+    conn.close()
+    print()
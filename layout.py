@@ -0,0 +1,352 @@
+"""
+Declarative sheet layouts for the portfolio formatter
+A layout maps row/column ranges to named cell styles (see styles.CELL_STYLES), row heights,
+merges and column widths. compile_layout() turns a layout into plain tuples once, and
+apply_layout() styles each sheet in a single pass that writes every cell exactly once.
+
+Block keys:
+  rows        row number, (first, last) range, or (first, None) for "through the last used row"
+  cells       {'A': style, 'B:E': style, ...}; later entries and later blocks win on overlap.
+              A '+' on the last column ('B:M+') extends the span to the sheet's last used
+              column when the sheet is wider (long month histories); merges, rules and
+              widths accept the same form
+  height      row height applied to every row of the block
+  merge       'A:E' merges those columns on every row of the block
+  when        (coordinate, text) - block only applies if that cell contains the text
+  skip_blank  column letter - rows whose cell in that column is empty are left alone
+  rules       {'B:M+': (rule, ...)} conditional formatting (see styles.CONDITIONAL_RULES) added
+              once for the block's whole range instead of styling each cell
+
+Sheet keys: blocks, widths {'A': 28, 'B:M+': 14}, freeze (top-left unfrozen cell), and
+clear_rules - the sheet's conditional formats belong to the layout, so a variant without
+rules removes any an earlier (conditional) run left behind.
+"""
+
+from collections import namedtuple
+
+from openpyxl.utils import column_index_from_string, get_column_letter
+from openpyxl.utils.cell import coordinate_to_tuple
+
+from openpyxl.formatting.formatting import ConditionalFormattingList
+
+from styles import CELL_STYLES, CONDITIONAL_RULES
+
+
+# Bump whenever a layout below changes so saved output can be told apart from older runs
+LAYOUT_VERSION = 3
+
+
+def _section(header_row, first_row, last_row, cell_style, rules=None):
+    """
+    Monthly Performance section: merged header row followed by label + value rows.
+    With rules, the value columns get conditional formatting instead of cell_style.
+    """
+    values = dict(rows=(first_row, last_row), cells={'A': 'row_label', 'B:M+': cell_style}, height=18)
+    if rules:
+        values.update(cells={'A': 'row_label'}, rules={'B:M+': rules})
+    return [
+        dict(rows=header_row, cells={'A': 'section_header'}, merge='A:M+', height=20),
+        values,
+    ]
+
+
+def _monthly_performance(conditional=False):
+    """
+    Monthly Performance layout. The conditional variant styles only titles, headers and
+    row labels per cell; the B:M grid is banded, highlighted (gains green, losses red)
+    and given data bars by sheet-level rules.
+    """
+    def section(header_row, first_row, last_row, cell_style, rules):
+        return _section(header_row, first_row, last_row, cell_style, rules if conditional else None)
+
+    values = dict(rows=(4, 5), cells={'A': 'row_label', 'B:M+': 'value_cell'}, height=18)
+    remainder = dict(rows=(33, None), cells={'A': 'row_label', 'B:M+': 'value_cell'})
+    if conditional:
+        values.update(cells={'A': 'row_label'}, rules={'B:M+': ('value_band', 'value_bars')})
+        remainder.update(cells={'A': 'row_label'}, rules={'B:M+': ('value_band',)})
+
+    return {
+        'blocks': [
+            dict(rows=1, cells={'A': 'monthly_title'}, merge='A:M+', height=25),
+            dict(rows=2, height=8),
+            dict(rows=3, cells={'A:M+': 'column_header'}, height=22),
+            # Portfolio Values
+            values,
+            dict(rows=6, height=8),
+            *section(7, 8, 12, 'profit_cell', ('profit_band', 'gain_loss')),
+            dict(rows=13, height=8),
+            *section(14, 15, 20, 'activity_cell', ('activity_band',)),
+            dict(rows=21, height=8),
+            *section(22, 23, 26, 'cash_cell', ('cash_band',)),
+            dict(rows=27, height=8),
+            *section(28, 29, 32, 'market_cell', ('market_band',)),
+            # Anything below the standard sections
+            remainder,
+        ],
+        'widths': {'A': 28, 'B:M+': 14},
+        # Labels and month headers stay in view when scrolling through long histories
+        'freeze': 'B4',
+        # Plain and conditional runs share this sheet; neither keeps the other's rules
+        'clear_rules': True,
+    }
+
+
+TYPE_A_LAYOUT = {
+    'Executive Summary': {
+        'blocks': [
+            dict(rows=1, cells={'A': 'title'}, merge='A:E', height=30),
+            dict(rows=2, cells={'A': 'date'}, height=18),
+            dict(rows=3, height=8),
+            # KPI Section
+            dict(rows=4, cells={'A': 'section_header'}, merge='A:E', height=22),
+            dict(rows=5, cells={'A:C': 'column_header'}, height=20),
+            dict(rows=(6, 14), cells={'A': 'kpi_label', 'B': 'kpi_value', 'C': 'kpi_detail'}, height=18),
+            dict(rows=15, height=8),
+            # Trading Activity Summary
+            dict(rows=16, cells={'A': 'section_header'}, merge='A:E', height=22, when=('A16', 'TRADING')),
+            dict(rows=(17, 20), cells={'A': 'summary_label', 'B:E': 'trading_cell'}, height=18,
+                 when=('A16', 'TRADING'), skip_blank='A'),
+            dict(rows=21, height=8),
+            # Key Insights & Recommendations
+            dict(rows=22, cells={'A': 'section_header'}, merge='A:E', height=22, when=('A22', 'KEY INSIGHTS')),
+            dict(rows=(23, 28), cells={'A': 'insight_label', 'B:E': 'insight_cell'}, height=20,
+                 when=('A22', 'KEY INSIGHTS'), skip_blank='A'),
+            dict(rows=29, height=8),
+            # Action Items & Strategy
+            dict(rows=30, cells={'A': 'section_header'}, merge='A:E', height=22, when=('A30', 'ACTION ITEMS')),
+            dict(rows=(31, 36), cells={'A': 'action_label', 'B:E': 'action_cell'}, height=20,
+                 when=('A30', 'ACTION ITEMS'), skip_blank='A'),
+        ],
+        'widths': {'A': 28, 'B': 45, 'C': 20, 'D': 15, 'E': 15},
+    },
+    'Monthly Performance': _monthly_performance(),
+}
+
+# Same sheets, with the Monthly Performance grid styled by conditional formatting
+TYPE_A_CONDITIONAL_LAYOUT = {
+    'Executive Summary': TYPE_A_LAYOUT['Executive Summary'],
+    'Monthly Performance': _monthly_performance(conditional=True),
+}
+
+LAYOUTS = {
+    'type_a': TYPE_A_LAYOUT,
+    'type_a_conditional': TYPE_A_CONDITIONAL_LAYOUT,
+}
+
+
+Block = namedtuple('Block', ['first_row', 'last_row', 'cells', 'height', 'merge', 'when', 'skip_blank', 'rules'])
+CompiledSheet = namedtuple('CompiledSheet', ['blocks', 'widths', 'freeze', 'clear_rules'])
+
+
+def _column_span(spec):
+    """'B:E' -> (2, 5, False), 'A' -> (1, 1, False), 'B:M+' -> (2, 13, True)"""
+    first, _, last = spec.partition(':')
+    extend = last.endswith('+')
+    last = last.rstrip('+')
+    return column_index_from_string(first), column_index_from_string(last or first), extend
+
+
+def _resolve_span(span, sheet_last_col):
+    """(first, last) columns of a compiled span on a sheet whose last used column is sheet_last_col"""
+    first_col, last_col, extend = span
+    return first_col, max(last_col, sheet_last_col) if extend else last_col
+
+
+def _compile_block(block):
+    rows = block['rows']
+    first_row, last_row = (rows, rows) if isinstance(rows, int) else rows
+
+    cells = []
+    for col_spec, style in block.get('cells', {}).items():
+        if style not in CELL_STYLES:
+            raise ValueError(f"Unknown cell style '{style}' in layout")
+        cells.append((_column_span(col_spec), style))
+
+    merge = _column_span(block['merge']) if block.get('merge') else None
+    when = block.get('when')
+    if when:
+        when = (coordinate_to_tuple(when[0]), when[1].upper())
+    skip_blank = column_index_from_string(block['skip_blank']) if block.get('skip_blank') else None
+
+    rules = []
+    for col_spec, names in block.get('rules', {}).items():
+        for name in names:
+            if name not in CONDITIONAL_RULES:
+                raise ValueError(f"Unknown conditional rule '{name}' in layout")
+        rules.append((_column_span(col_spec), tuple(names)))
+
+    return Block(first_row, last_row, tuple(cells), block.get('height'), merge, when, skip_blank,
+                 tuple(rules))
+
+
+def compile_layout(layout):
+    """Compile a layout spec into {sheet name: CompiledSheet}"""
+    compiled = {}
+    for sheet_name, sheet_spec in layout.items():
+        widths = tuple((_column_span(col_spec), width) for col_spec, width in sheet_spec.get('widths', {}).items())
+        blocks = tuple(_compile_block(block) for block in sheet_spec['blocks'])
+        compiled[sheet_name] = CompiledSheet(blocks, widths, sheet_spec.get('freeze'),
+                                             sheet_spec.get('clear_rules', False))
+    return compiled
+
+
+_compiled_layouts = {}
+
+
+def get_layout(name):
+    """Compiled layout by name, compiled on first use"""
+    if name not in _compiled_layouts:
+        _compiled_layouts[name] = compile_layout(LAYOUTS[name])
+    return _compiled_layouts[name]
+
+
+def _guard_passes(value_at, when):
+    value = value_at(*when[0])
+    return bool(value) and when[1] in str(value).upper()
+
+
+# StyleArray fields painted by conditional rules; a cell's font and number format are kept
+_RULE_FIELDS = ('fillId', 'borderId', 'alignmentId')
+
+
+def _apply_rules(ws, rule_ranges):
+    """
+    Add one conditional format per (range, rules) pair. The sheet's previous conditional
+    formats are replaced, so re-formatting a report never stacks duplicate rules, and
+    per-cell fills/borders left in those ranges by an earlier run are cleared so the
+    rules show through.
+    """
+    ws.conditional_formatting = ConditionalFormattingList()
+    for first_row, last_row, (first_col, last_col), names in rule_ranges:
+        for row in range(first_row, last_row + 1):
+            for col in range(first_col, last_col + 1):
+                cell = ws._cells.get((row, col))
+                if cell is not None and cell.has_style:
+                    for field in _RULE_FIELDS:
+                        setattr(cell._style, field, 0)
+
+        ref = f"{get_column_letter(first_col)}{first_row}:{get_column_letter(last_col)}{last_row}"
+        for name in names:
+            for rule in CONDITIONAL_RULES[name]():
+                ws.conditional_formatting.add(ref, rule)
+
+
+def _runs(row_plan):
+    """{col: style} -> [(first_col, last_col, style)] for runs of adjacent columns sharing a style"""
+    runs = []
+    for col in sorted(row_plan):
+        style = row_plan[col]
+        if runs and runs[-1][2] == style and runs[-1][1] == col - 1:
+            runs[-1] = (runs[-1][0], col, style)
+        else:
+            runs.append((col, col, style))
+    return runs
+
+
+SheetPlan = namedtuple('SheetPlan', ['cells', 'heights', 'merges', 'rule_ranges', 'widths'])
+
+
+def plan_layout(sheet_layout, max_row, max_col, value_at):
+    """
+    Resolve a compiled sheet layout against one sheet's extent and contents.
+    value_at(row, col) returns a cell value (used by 'when' and 'skip_blank').
+    Returns a SheetPlan: {row: {col: style}}, {row: height}, [(row, (first_col, last_col))],
+    [(first_row, last_row, (first_col, last_col), rule names)] and [(col, width)].
+    """
+    guards = {}
+    plan = {}
+    heights = {}
+    merges = []
+    rule_ranges = []
+
+    for block in sheet_layout.blocks:
+        if block.when:
+            if block.when not in guards:
+                guards[block.when] = _guard_passes(value_at, block.when)
+            if not guards[block.when]:
+                continue
+
+        last_row = block.last_row if block.last_row is not None else max_row
+        if last_row >= block.first_row:
+            rule_ranges.extend((block.first_row, last_row, _resolve_span(span, max_col), names)
+                               for span, names in block.rules)
+        cells = {}
+        for span, style in block.cells:
+            first_col, last_col = _resolve_span(span, max_col)
+            cells.update((col, style) for col in range(first_col, last_col + 1))
+        merge = _resolve_span(block.merge, max_col) if block.merge else None
+
+        for row in range(block.first_row, last_row + 1):
+            if block.skip_blank and not value_at(row, block.skip_blank):
+                continue
+            if cells:
+                plan.setdefault(row, {}).update(cells)
+            if block.height is not None:
+                heights[row] = block.height
+            if merge:
+                merges.append((row, merge))
+
+    widths = []
+    for span, width in sheet_layout.widths:
+        first_col, last_col = _resolve_span(span, max_col)
+        widths.extend((col, width) for col in range(first_col, last_col + 1))
+    return SheetPlan(plan, heights, merges, rule_ranges, widths)
+
+
+def value_cells(sheet_layout):
+    """
+    The cells plan_layout can read through value_at: {(row, col)} of the 'when' guards and
+    {col} of the 'skip_blank' columns. Streaming readers only need to keep these values.
+    """
+    coordinates = {block.when[0] for block in sheet_layout.blocks if block.when}
+    columns = {block.skip_blank for block in sheet_layout.blocks if block.skip_blank}
+    return coordinates, columns
+
+
+def replaced_merges(existing, merges):
+    """
+    Existing single-row merges that overlap a planned merge without matching it.
+    A sheet that grew wider keeps its old, narrower row merges; overlapping merges corrupt the file.
+    existing holds (row, first_col, last_col) tuples.
+    """
+    planned = {}
+    for row, span in merges:
+        planned.setdefault(row, []).append(span)
+    return [(row, first_col, last_col) for row, first_col, last_col in existing
+            if any((first_col, last_col) != span and first_col <= span[1] and last_col >= span[0]
+                   for span in planned.get(row, ()))]
+
+
+def apply_layout(ws, sheet_layout, styles):
+    """
+    Apply a compiled sheet layout to ws.
+    The plan for every row is resolved first, then each row is styled in runs of adjacent
+    cells sharing a style, so every styled cell is written once.
+    Returns the number of cells styled.
+    """
+    plan, heights, merges, rule_ranges, widths = plan_layout(
+        sheet_layout, ws.max_row, ws.max_column, lambda row, col: ws.cell(row=row, column=col).value)
+
+    cells_styled = 0
+    for row in sorted(plan):
+        for first_col, last_col, style in _runs(plan[row]):
+            styles.apply_row(ws, row, first_col, last_col, style)
+        cells_styled += len(plan[row])
+
+    if rule_ranges or sheet_layout.clear_rules:
+        _apply_rules(ws, rule_ranges)
+
+    existing = [(merged.min_row, merged.min_col, merged.max_col)
+                for merged in ws.merged_cells.ranges if merged.min_row == merged.max_row]
+    for row, first_col, last_col in replaced_merges(existing, merges):
+        ws.unmerge_cells(start_row=row, start_column=first_col, end_row=row, end_column=last_col)
+    for row, (first_col, last_col) in merges:
+        ws.merge_cells(start_row=row, start_column=first_col, end_row=row, end_column=last_col)
+    for row, height in heights.items():
+        ws.row_dimensions[row].height = height
+    for col, width in widths:
+        ws.column_dimensions[get_column_letter(col)].width = width
+    if sheet_layout.freeze:
+        ws.freeze_panes = sheet_layout.freeze
+
+    return cells_styled
@@ -0,0 +1,117 @@
+"""
+Incremental-run manifest for format_all.py
+Records, per workbook, a content hash of its sheet names and cell values together with the
+layout version and output mode (charts, conditional formatting, template) it was formatted
+with, in a small sqlite file next to the inputs. Files whose
+size and mtime still match the last run are skipped without being opened; files that were
+touched but whose content hash is unchanged are skipped after a cheap read-only scan.
+"""
+
+import os
+import sqlite3
+import hashlib
+from datetime import datetime
+
+from openpyxl import load_workbook
+
+from layout import LAYOUT_VERSION
+
+
+MANIFEST_NAME = '.portfolio_manifest.sqlite'
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS formatted_files (
+    path TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    content_hash TEXT NOT NULL,
+    layout_version INTEGER NOT NULL,
+    formatted_at TEXT NOT NULL,
+    mode TEXT NOT NULL DEFAULT ''
+)
+"""
+
+
+def open_manifest(filepath):
+    """Open (creating if needed) the manifest that sits in the same directory as filepath"""
+    directory = os.path.dirname(os.path.abspath(filepath))
+    conn = sqlite3.connect(os.path.join(directory, MANIFEST_NAME), timeout=30)
+    conn.execute(_SCHEMA)
+    # Manifests written before the output mode was recorded: their files count as changed once
+    columns = [row[1] for row in conn.execute("PRAGMA table_info(formatted_files)")]
+    if 'mode' not in columns:
+        with conn:
+            conn.execute("ALTER TABLE formatted_files ADD COLUMN mode TEXT NOT NULL DEFAULT ''")
+    return conn
+
+
+def output_mode(charts=True, conditional=False, template=False):
+    """The format_all options that change the output, as stored in the manifest"""
+    if template:
+        return 'template'
+    return ','.join(name for name, on in (('charts', charts), ('conditional', conditional)) if on) or 'plain'
+
+
+def workbook_hash(wb):
+    """
+    Hash sheet names and every non-empty cell value of an open workbook.
+    Works on both normal and read-only workbooks and ignores styling, so a file hashes
+    the same before and after it is formatted.
+    """
+    digest = hashlib.blake2b(digest_size=20)
+    digest.update(f"layout:{LAYOUT_VERSION}\n".encode())
+    for ws in wb.worksheets:
+        digest.update(f"sheet:{ws.title}\n".encode())
+        for row_idx, row in enumerate(ws.iter_rows(min_row=1, values_only=True), start=1):
+            for col_idx, value in enumerate(row, start=1):
+                if value is not None:
+                    digest.update(f"{row_idx},{col_idx}:{type(value).__name__}:{value!r}\n".encode())
+    return digest.hexdigest()
+
+
+def file_hash(filepath):
+    """Content hash of a workbook on disk, using a streaming read-only load"""
+    wb = load_workbook(filepath, read_only=True)
+    try:
+        return workbook_hash(wb)
+    finally:
+        wb.close()
+
+
+def is_unchanged(conn, filepath, mode):
+    """
+    True if filepath was formatted with the current layout in the same output mode
+    (see output_mode) and its content hasn't changed since
+    """
+    key = os.path.abspath(filepath)
+    entry = conn.execute(
+        "SELECT size, mtime_ns, content_hash, layout_version, mode FROM formatted_files WHERE path = ?",
+        (key,)).fetchone()
+    if entry is None:
+        return False
+
+    size, mtime_ns, content_hash, layout_version, recorded_mode = entry
+    if layout_version != LAYOUT_VERSION or recorded_mode != mode:
+        return False
+
+    stat = os.stat(filepath)
+    if stat.st_size == size and stat.st_mtime_ns == mtime_ns:
+        return True
+
+    # Touched or copied - compare the actual content before deciding
+    if file_hash(filepath) != content_hash:
+        return False
+    record(conn, filepath, content_hash, mode)
+    return True
+
+
+def record(conn, filepath, content_hash, mode):
+    """Remember filepath's current size/mtime and content hash, formatted in mode"""
+    stat = os.stat(filepath)
+    with conn:
+        conn.execute(
+            "INSERT OR REPLACE INTO formatted_files "
+            "(path, size, mtime_ns, content_hash, layout_version, formatted_at, mode) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (os.path.abspath(filepath), stat.st_size, stat.st_mtime_ns, content_hash,
+             LAYOUT_VERSION, datetime.now().isoformat(timespec='seconds'), mode))
@@ -0,0 +1,435 @@
+"""
+Benchmark comparison against a local market-data cache
+Index return series (S&P 500, a bond index, ...) are dropped into a directory as CSV or
+Parquet files, one file per index: a month column and the monthly return in percent, the
+same unit as the reports' 'Total profit, %' row. The first time a drop is used it is
+converted into a dense float array indexed by month and saved as .npy under .cache/; later
+runs memory-map that file, so looking up an account's months only touches those values
+and batch workers share the pages through the OS cache. A drop that changes is re-read.
+
+Excess return, tracking difference, tracking error and beta are computed for every
+account at once on a (accounts, months) array, next to each account's own drawdown and
+volatility from the batch KPI engine. Everything works offline.
+"""
+
+import os
+import re
+import sys
+import json
+import time
+import argparse
+import csv
+from collections import namedtuple
+
+import numpy as np
+from openpyxl.utils import get_column_letter
+
+from kpi_engine import PROFIT_PCT, KPI_METRICS, metrics_array, to_float, calculate_kpis_batch
+from periods import parse_month, month_label
+
+
+MARKET_DIR = 'market_data'
+CACHE_DIR = '.cache'
+SOURCE_EXTENSIONS = ('.csv', '.parquet')
+
+# Monthly Performance rows of the MARKET COMPARISON section (see layout.py)
+MARKET_HEADER_ROW = 28
+
+# Beta over fewer paired months than this is left blank - it is mostly noise
+MIN_BETA_MONTHS = 3
+
+ISO_MONTH = re.compile(r'^\s*(\d{4})-(\d{1,2})(?:-\d{1,2})?')
+
+
+def month_index(label):
+    """'Mar 25', '2025-03', '2025-03-31' or a date -> months since year 0, or -1 if not a month"""
+    key = parse_month(label)
+    if key is None and label is not None:
+        match = ISO_MONTH.match(str(label))
+        if match and 1 <= int(match.group(2)) <= 12:
+            key = int(match.group(1)), int(match.group(2))
+    return key[0] * 12 + key[1] - 1 if key else -1
+
+
+def _index_label(index):
+    return month_label((index // 12, index % 12 + 1))
+
+
+class Benchmark(namedtuple('Benchmark', ['name', 'first', 'returns'])):
+    """One index: monthly % returns (memory-mapped, NaN for gaps) starting at month index first"""
+
+    def align(self, months):
+        """Returns for an int array of month indices (any shape), NaN outside the series"""
+        pos = months - self.first
+        inside = (months >= 0) & (pos >= 0) & (pos < len(self.returns))
+        aligned = np.full(months.shape, np.nan)
+        aligned[inside] = self.returns[pos[inside]]
+        return aligned
+
+    @property
+    def span(self):
+        return _index_label(self.first), _index_label(self.first + len(self.returns) - 1)
+
+
+# ========== MARKET-DATA CACHE ==========
+
+def _source_path(name, market_dir):
+    for ext in SOURCE_EXTENSIONS:
+        path = os.path.join(market_dir, name + ext)
+        if os.path.exists(path):
+            return path
+    available = ', '.join(benchmark_names(market_dir)) or 'none'
+    raise FileNotFoundError(f"No {name}.csv or {name}.parquet in {market_dir} (available: {available})")
+
+
+def benchmark_names(market_dir=MARKET_DIR):
+    """Index names with a drop in market_dir"""
+    if not os.path.isdir(market_dir):
+        return []
+    return sorted({os.path.splitext(f)[0] for f in os.listdir(market_dir)
+                   if os.path.splitext(f)[1].lower() in SOURCE_EXTENSIONS})
+
+
+def _read_rows(path):
+    """(month, return) pairs from the first two columns of a drop; header rows are skipped"""
+    if path.endswith('.parquet'):
+        # Only Parquet drops pay for loading pyarrow
+        try:
+            import pyarrow.parquet
+        except ImportError:
+            raise RuntimeError(f"Reading {os.path.basename(path)} needs pyarrow (pip install pyarrow)") from None
+        table = pyarrow.parquet.read_table(path)
+        return zip(table.column(0).to_pylist(), table.column(1).to_pylist())
+    with open(path, newline='', encoding='utf-8-sig') as fh:
+        return [tuple(row[:2]) for row in csv.reader(fh) if len(row) >= 2]
+
+
+def _build_series(path):
+    """(first month index, dense float array of % returns) from a drop"""
+    returns = {}
+    for month, value in _read_rows(path):
+        index = month_index(month)
+        if index < 0:
+            continue
+        if isinstance(value, str):
+            value = value.strip().rstrip('%')
+        returns[index] = to_float(value)
+    if not returns:
+        raise ValueError(f"No monthly returns found in {os.path.basename(path)}")
+
+    first = min(returns)
+    series = np.full(max(returns) - first + 1, np.nan)
+    for index, value in returns.items():
+        series[index - first] = value
+    return first, series
+
+
+def _write_cache(array_path, stamp_path, first, series, stat, source):
+    """Array then stamp, each via a temporary file, so a concurrent reader never sees half of one"""
+    tmp = f"{array_path}.{os.getpid()}.tmp"
+    with open(tmp, 'wb') as fh:
+        np.save(fh, series)
+    os.replace(tmp, array_path)
+
+    tmp = f"{stamp_path}.{os.getpid()}.tmp"
+    with open(tmp, 'w') as fh:
+        json.dump({'source': source, 'mtime_ns': stat.st_mtime_ns, 'size': stat.st_size,
+                   'first_month': _index_label(first), 'first': first}, fh)
+    os.replace(tmp, stamp_path)
+
+
+_loaded = {}    # cache array path -> (source mtime_ns, size, Benchmark)
+
+
+def load_benchmark(name, market_dir=MARKET_DIR):
+    """
+    The named index from market_dir, memory-mapped from its .npy cache.
+    The cache is (re)built from the CSV/Parquet drop when missing or older than the drop;
+    within one process the mapped series is reused while the drop is unchanged.
+    """
+    source = _source_path(name, market_dir)
+    stat = os.stat(source)
+    cache_dir = os.path.join(market_dir, CACHE_DIR)
+    array_path = os.path.join(cache_dir, name + '.npy')
+    stamp_path = os.path.join(cache_dir, name + '.json')
+
+    entry = _loaded.get(array_path)
+    if entry is not None and entry[:2] == (stat.st_mtime_ns, stat.st_size):
+        return entry[2]
+
+    stamp = None
+    if os.path.exists(stamp_path) and os.path.exists(array_path):
+        with open(stamp_path) as fh:
+            stamp = json.load(fh)
+    if stamp is None or (stamp['mtime_ns'], stamp['size'], stamp['source']) != \
+            (stat.st_mtime_ns, stat.st_size, os.path.basename(source)):
+        os.makedirs(cache_dir, exist_ok=True)
+        first, series = _build_series(source)
+        _write_cache(array_path, stamp_path, first, series, stat, os.path.basename(source))
+    else:
+        first = stamp['first']
+
+    benchmark = Benchmark(name, first, np.load(array_path, mmap_mode='r'))
+    _loaded[array_path] = (stat.st_mtime_ns, stat.st_size, benchmark)
+    return benchmark
+
+
+# ========== COMPARISON ==========
+
+def month_indices(months, month_count=None):
+    """Month labels -> int array of month indices, padded with -1 to month_count"""
+    indices = np.full(month_count or len(months), -1, dtype=np.int64)
+    indices[:len(months)] = [month_index(m) for m in months]
+    return indices
+
+
+def compare(returns, bench):
+    """
+    Account against benchmark, both (accounts, months) arrays of monthly % returns with NaN
+    where a month is missing. Only months both have are compared. Returns a dict of
+    (accounts, months) arrays, each NaN in months that weren't compared:
+      excess              account return - benchmark return, that month
+      tracking_difference compounded account return - compounded benchmark return, to date
+      beta                covariance with the benchmark / benchmark variance, to date
+    """
+    paired = ~np.isnan(returns) & ~np.isnan(bench)
+    a = np.where(paired, returns, 0.0)
+    b = np.where(paired, bench, 0.0)
+    count = np.cumsum(paired, axis=1)
+
+    growth_a = np.cumprod(1 + a / 100, axis=1)
+    growth_b = np.cumprod(1 + b / 100, axis=1)
+
+    # Running sums give the to-date moments for every month in one pass
+    sum_a = np.cumsum(a, axis=1)
+    sum_b = np.cumsum(b, axis=1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        cov = np.cumsum(a * b, axis=1) - sum_a * sum_b / count
+        var_b = np.cumsum(b * b, axis=1) - sum_b * sum_b / count
+        beta = np.where((count >= MIN_BETA_MONTHS) & (var_b > 1e-12), cov / var_b, np.nan)
+
+    return {
+        'excess': np.where(paired, returns - bench, np.nan),
+        'tracking_difference': np.where(paired, (growth_a - growth_b) * 100, np.nan),
+        'beta': np.where(paired, beta, np.nan),
+        'growth': (growth_a, growth_b),
+        'count': count,
+    }
+
+
+def _last_compared(series):
+    """Each account's value in its last compared month (NaN if none was compared)"""
+    valid = ~np.isnan(series)
+    idx = series.shape[1] - 1 - np.argmax(valid[:, ::-1], axis=1)
+    return np.where(valid.any(axis=1), series[np.arange(len(series)), idx], np.nan)
+
+
+def summarize(comparison):
+    """Whole-window figures per account, each an (accounts,) array"""
+    excess = comparison['excess']
+    growth_a, growth_b = comparison['growth']
+    months = comparison['count'][:, -1]
+    compared = np.where(months > 0, 1.0, np.nan)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean_excess = np.nansum(excess, axis=1) / months
+        excess_sq = np.nansum(np.square(excess - mean_excess[:, None]), axis=1)
+        tracking_error = np.where(months >= 2, np.sqrt(excess_sq / (months - 1)), np.nan)
+    return {
+        'months': months,
+        'account_return': (growth_a[:, -1] - 1) * 100 * compared,
+        'benchmark_return': (growth_b[:, -1] - 1) * 100 * compared,
+        'excess_return': mean_excess * compared,
+        'tracking_difference': _last_compared(comparison['tracking_difference']),
+        'tracking_error': tracking_error,
+        'beta': _last_compared(comparison['beta']),
+    }
+
+
+def compare_accounts(accounts, benchmark):
+    """
+    accounts: list of (months, metrics_data). Every account is compared with the benchmark in
+    one pass over an (accounts, months) array; returns (comparison, summary) as above.
+    """
+    month_count = max([len(months) for months, _ in accounts] + [1])
+    returns = np.full((len(accounts), month_count), np.nan)
+    indices = np.full((len(accounts), month_count), -1, dtype=np.int64)
+    for row, (months, metrics_data) in enumerate(accounts):
+        returns[row, :len(months)] = metrics_array(metrics_data, len(months), (KPI_METRICS[PROFIT_PCT],))[0]
+        indices[row] = month_indices(months, month_count)
+    bench = benchmark.align(indices)
+    comparison = compare(returns, bench)
+    comparison['benchmark'] = bench
+    return comparison, summarize(comparison)
+
+
+# ========== REPORT OUTPUT ==========
+
+def _cell_value(value):
+    return None if np.isnan(value) else round(float(value), 4)
+
+
+def add_market_comparison(ws, months, metrics_data, benchmark):
+    """
+    Fill the MARKET COMPARISON section of a restructured Monthly Performance sheet: the
+    index's monthly return, the account's excess return over it, and the tracking
+    difference and beta to date (the last month holds the whole-window figures).
+    Returns the number of months compared.
+    """
+    comparison, summary = compare_accounts([(months, metrics_data)], benchmark)
+    compared = int(summary['months'][0])
+    if not compared:
+        return 0
+
+    row = max(MARKET_HEADER_ROW, ws.max_row + 2)
+    last_col = max(ws.max_column, 13)
+    ws.cell(row=row, column=1).value = 'MARKET COMPARISON'
+    ws.merge_cells(start_row=row, start_column=1, end_row=row, end_column=last_col)
+    ws.row_dimensions[row].height = 18
+
+    rows = (
+        (f'{benchmark.name} return, %', comparison['benchmark']),
+        ('Excess return, %', comparison['excess']),
+        ('Tracking difference, %', comparison['tracking_difference']),
+        (f'Beta vs {benchmark.name}', comparison['beta']),
+    )
+    for offset, (label, series) in enumerate(rows, start=1):
+        ws.cell(row=row + offset, column=1).value = label
+        for col_idx in range(len(months)):
+            cell = ws.cell(row=row + offset, column=col_idx + 2)
+            cell.value = _cell_value(series[0, col_idx])
+            cell.number_format = '0.00'
+        ws.row_dimensions[row + offset].height = 16
+    return compared
+
+
+SUMMARY_COLUMNS = (
+    ('Account', None, 40),
+    ('File', None, 50),
+    ('Months Compared', 'months', 12),
+    ('Account Return, %', 'account_return', 14),
+    ('Index Return, %', 'benchmark_return', 14),
+    ('Avg Monthly Excess, %', 'excess_return', 14),
+    ('Tracking Difference, %', 'tracking_difference', 14),
+    ('Tracking Error, %', 'tracking_error', 14),
+    ('Beta', 'beta', 10),
+    ('Max Drawdown, %', 'max_drawdown', 14),
+    ('Volatility (ann.), %', 'volatility', 14),
+)
+
+
+def add_account_kpis(summary, accounts):
+    """Add each account's max drawdown and annualized volatility to summary, all accounts in one pass"""
+    kpis = calculate_kpis_batch([(metrics_data, months) for months, metrics_data in accounts])
+    summary['max_drawdown'] = kpis['max_drawdown']
+    summary['volatility'] = kpis['annualized_volatility']
+    return summary
+
+
+def create_comparison_sheet(ws, benchmark, titles, files, summary, styles):
+    """One row per account with its whole-window figures against the benchmark"""
+    first, last = benchmark.span
+    ws.append([f'BENCHMARK COMPARISON vs {benchmark.name} ({first} - {last})'])
+    styles.apply(ws['A1'], 'title_plain')
+    ws.append([name for name, _, _ in SUMMARY_COLUMNS])
+    styles.apply_row(ws, 2, 1, len(SUMMARY_COLUMNS), 'column_header_plain')
+
+    for idx, (title, filepath) in enumerate(zip(titles, files)):
+        values = [title, filepath] + [_cell_value(summary[key][idx]) for _, key, _ in SUMMARY_COLUMNS[2:]]
+        ws.append(values)
+        styles.apply(ws.cell(row=ws.max_row, column=1), 'label_plain')
+        for col in range(4, len(SUMMARY_COLUMNS) + 1):
+            ws.cell(row=ws.max_row, column=col).number_format = '0.00'
+
+    for col, (_, _, width) in enumerate(SUMMARY_COLUMNS, start=1):
+        ws.column_dimensions[get_column_letter(col)].width = width
+    ws.freeze_panes = 'B3'
+
+
+def _fmt(value, suffix=''):
+    return '-' if np.isnan(value) else f"{value:,.2f}{suffix}"
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2:
+        print("\n" + "=" * 70)
+        print("BENCHMARK COMPARISON")
+        print("Excess return, tracking difference and beta of every account against an index")
+        print("=" * 70)
+        print("\nUsage: python market.py <file1.xlsx> [file2.xlsx ...] --index NAME [--market-dir DIR] [--output FILE]")
+        print("\nIndex returns are read from DIR/NAME.csv or DIR/NAME.parquet (default dir: market_data):")
+        print("  month,return_pct")
+        print("  2025-01,2.70")
+        print("\nExample:")
+        print('  python market.py "Portfolio report_*.xlsx" --index SP500 --output "Benchmark Comparison.xlsx"')
+        print("  python restructure_type_b.py *.xlsx --market SP500   (fill each report's MARKET COMPARISON rows)")
+        print("=" * 70 + "\n")
+        sys.exit(0)
+
+    parser = argparse.ArgumentParser(description="Benchmark comparison against a local market-data cache")
+    parser.add_argument('files', nargs='+', help='Account workbooks (Type B or restructured Type A) or glob patterns')
+    parser.add_argument('--index', required=True, help='Index name: the file name of its drop in the market-data dir')
+    parser.add_argument('--market-dir', default=MARKET_DIR, metavar='DIR',
+                        help=f'Directory holding the index drops (default {MARKET_DIR})')
+    parser.add_argument('--output', '-o', metavar='FILE',
+                        help='Also write the comparison as a workbook')
+    args = parser.parse_args()
+
+    from batch import expand_file_args
+    from consolidate import read_account
+
+    start = time.perf_counter()
+    benchmark = load_benchmark(args.index, args.market_dir)
+    first, last = benchmark.span
+    print(f"\n✓ {benchmark.name}: {len(benchmark.returns)} month(s), {first} - {last}")
+
+    titles, files, accounts = [], [], []
+    for filepath in expand_file_args(args.files):
+        if filepath == args.output:
+            continue
+        try:
+            title, months, metrics_data = read_account(filepath)
+        except Exception as e:
+            print(f"  ✗ {filepath}: {str(e) or type(e).__name__}")
+            continue
+        titles.append(str(title).strip())
+        files.append(filepath)
+        accounts.append((months, metrics_data))
+
+    if not accounts:
+        print("  ✗ No accounts could be read")
+        sys.exit(1)
+
+    _, summary = compare_accounts(accounts, benchmark)
+    add_account_kpis(summary, accounts)
+
+    print("\n" + "=" * 70)
+    for idx, title in enumerate(titles):
+        print(f"{title}")
+        if not summary['months'][idx]:
+            print(f"  ⚠ No months in common with {benchmark.name}")
+            continue
+        print(f"  Months compared:      {summary['months'][idx]}")
+        print(f"  Account / index:      {_fmt(summary['account_return'][idx], '%')} / "
+              f"{_fmt(summary['benchmark_return'][idx], '%')}")
+        print(f"  Avg monthly excess:   {_fmt(summary['excess_return'][idx], '%')}")
+        print(f"  Tracking difference:  {_fmt(summary['tracking_difference'][idx], '%')}")
+        print(f"  Tracking error:       {_fmt(summary['tracking_error'][idx], '%')}")
+        print(f"  Beta:                 {_fmt(summary['beta'][idx])}")
+        print(f"  Max drawdown:         {_fmt(summary['max_drawdown'][idx], '%')}")
+        print(f"  Volatility (ann.):    {_fmt(summary['volatility'][idx], '%')}")
+
+    if args.output:
+        from openpyxl import Workbook
+        from output import atomic_save
+        from styles import StyleRegistry
+
+        wb = Workbook()
+        ws = wb.active
+        ws.title = 'Benchmark Comparison'
+        create_comparison_sheet(ws, benchmark, titles, files, summary, StyleRegistry(wb))
+        atomic_save(wb, args.output)
+        print(f"\n✓ Comparison saved to {args.output}")
+
+    print("=" * 70)
+    print(f"Compared {len(accounts)} account(s) in {time.perf_counter() - start:.2f}s")
+    print("=" * 70 + "\n")
@@ -0,0 +1,140 @@
+"""
+Crash-safe output for the batch tools
+Workbooks are saved to a temporary file in the destination directory, flushed to disk and
+then renamed over the target in one step, so an interrupted run leaves either the old file
+or the new one - never a truncated workbook. A batch journal records finished files so a
+restarted run (--resume) only processes what is left.
+"""
+
+import os
+import json
+import shutil
+import tempfile
+from datetime import datetime
+
+
+def output_path(filepath, out_dir=None):
+    """Where the result for filepath goes: in place, or the same name inside out_dir"""
+    if out_dir:
+        return os.path.join(out_dir, os.path.basename(filepath))
+    return filepath
+
+
+def conflicting_targets(files, out_dir=None):
+    """
+    {input: other input} for inputs whose result would land on the same file as another's -
+    with out_dir, files of the same name from different directories. Each would overwrite
+    the one before (or race with it under --jobs).
+    """
+    first_for = {}
+    conflicts = {}
+    for filepath in files:
+        target = os.path.normcase(os.path.abspath(output_path(filepath, out_dir)))
+        if target in first_for:
+            conflicts[filepath] = first_for[target]
+            conflicts.setdefault(first_for[target], filepath)
+        else:
+            first_for[target] = filepath
+    return conflicts
+
+
+def _fsync_directory(directory):
+    # Makes the rename itself durable; not possible (or needed) on Windows
+    if not hasattr(os, 'O_DIRECTORY'):
+        return
+    fd = os.open(directory, os.O_RDONLY | os.O_DIRECTORY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def _default_mode():
+    # mkstemp creates owner-only files; new outputs should get the usual umask permissions
+    umask = os.umask(0)
+    os.umask(umask)
+    return 0o666 & ~umask
+
+
+def atomic_save(wb, target, finalize=None):
+    """
+    Save wb (normal or write-only workbook, or anything with save(path)) to target
+    via temp file + fsync + rename.
+    finalize(path), if given, may rewrite the saved temp file before it is flushed and renamed.
+    """
+    directory = os.path.dirname(os.path.abspath(target))
+    fd, temp_path = tempfile.mkstemp(prefix=f'.{os.path.basename(target)}.', suffix='.tmp', dir=directory)
+    os.close(fd)
+    try:
+        wb.save(temp_path)
+        if finalize is not None:
+            finalize(temp_path)
+        with open(temp_path, 'rb+') as fh:
+            os.fsync(fh.fileno())
+        if os.path.exists(target):
+            shutil.copymode(target, temp_path)
+        else:
+            os.chmod(temp_path, _default_mode())
+        os.replace(temp_path, target)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+    _fsync_directory(directory)
+
+
+class BatchJournal:
+    """
+    Append-only record of the files a batch has finished, one JSON object per line.
+    A file counts as done if it finished without an error and hasn't changed since.
+    The journal is deleted once a batch completes with no errors.
+    """
+
+    def __init__(self, path, resume=False):
+        self.path = path
+        self.done = {}
+        self.interrupted = os.path.exists(path)
+        if resume and self.interrupted:
+            with open(path, encoding='utf-8') as fh:
+                for line in fh:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        continue    # torn final line from a crash
+                    self.done[entry['file']] = (entry['size'], entry['mtime_ns'])
+        self._fh = open(path, 'a' if resume else 'w', encoding='utf-8')
+
+    def is_done(self, filepath):
+        entry = self.done.get(os.path.abspath(filepath))
+        if entry is None:
+            return False
+        try:
+            stat = os.stat(filepath)
+        except OSError:
+            return False
+        return entry == (stat.st_size, stat.st_mtime_ns)
+
+    def record(self, result):
+        """Journal a FileResult; only files that finished without an error are recorded"""
+        if result.error is not None:
+            return
+        stat = os.stat(result.filepath)
+        entry = {'file': os.path.abspath(result.filepath), 'size': stat.st_size,
+                 'mtime_ns': stat.st_mtime_ns, 'at': datetime.now().isoformat(timespec='seconds')}
+        self._fh.write(json.dumps(entry) + '\n')
+        self._fh.flush()
+        os.fsync(self._fh.fileno())
+
+    def close(self, completed):
+        self._fh.close()
+        if completed:
+            os.remove(self.path)
+
+
+def open_journal(tool, out_dir=None, resume=False):
+    """The journal for one tool, kept in the output directory (or the current one)"""
+    path = os.path.join(out_dir or os.getcwd(), f'.{tool}_journal.jsonl')
+    journal = BatchJournal(path, resume=resume)
+    if journal.interrupted and not resume:
+        print("⚠ A previous run did not finish - starting over (use --resume to continue it instead)")
+    return journal
@@ -0,0 +1,60 @@
+"""
+Month label parsing shared by the report builders
+Exports label months like 'Mar 25', 'Mar 2025', 'March 2025' or "Mar '25"; these helpers
+turn them into sortable (year, month) keys and back.
+"""
+
+import re
+from datetime import date, datetime
+
+
+MONTH_NAMES = ('Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun', 'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec')
+_MONTH_NUMBERS = {name.lower(): idx for idx, name in enumerate(MONTH_NAMES, start=1)}
+
+MONTH_LABEL = re.compile(r"^\s*([A-Za-z]{3})[A-Za-z]*\.?[\s\-/']*'?(\d{2}|\d{4})\s*$")
+
+
+def parse_month(label):
+    """'Mar 25' -> (2025, 3); datetimes are accepted too. Returns None for anything else."""
+    if isinstance(label, (datetime, date)):
+        return label.year, label.month
+    if label is None:
+        return None
+    match = MONTH_LABEL.match(str(label))
+    if not match:
+        return None
+    month = _MONTH_NUMBERS.get(match.group(1).lower())
+    if month is None:
+        return None
+    year = int(match.group(2))
+    if year < 100:
+        year += 2000
+    return year, month
+
+
+def month_label(key):
+    """(2025, 3) -> 'Mar 25', the format the exports use"""
+    year, month = key
+    return f"{MONTH_NAMES[month - 1]} {year % 100:02d}"
+
+
+YEAR_TOTAL = re.compile(r'^\d{4} Total$')
+
+
+def year_total_label(year):
+    """Header of a per-year subtotal column: 2025 -> '2025 Total'"""
+    return f"{year} Total"
+
+
+def is_year_total(label):
+    return isinstance(label, str) and YEAR_TOTAL.match(label) is not None
+
+
+def year_groups(months):
+    """['Nov 24', 'Dec 24', 'Jan 25'] -> [(2024, [0, 1]), (2025, [2])]; unparseable labels are left out"""
+    groups = {}
+    for idx, label in enumerate(months):
+        key = parse_month(label)
+        if key is not None:
+            groups.setdefault(key[0], []).append(idx)
+    return sorted(groups.items())
@@ -0,0 +1,199 @@
+"""
+Restructure-then-format pipeline
+Runs both stages of the standard flow on one in-memory workbook: a Type B file is
+restructured (restructure_type_b.py) and the resulting Workbook goes straight into the
+format stage (format_all.py), so each file is parsed once and saved once instead of
+saved, re-loaded and saved again. Type A files go through the format stage only.
+
+Long-lived callers (a worker that stays up, repeated API calls) can keep parsed workbooks
+in a small per-process LRU cache keyed by path and checked against the file's mtime and
+size, so a later run over a file the same process has already written skips the load too.
+A command-line run visits each file once, so the CLI leaves the cache off by default.
+"""
+
+import os
+import sys
+import time
+import argparse
+from collections import OrderedDict
+from contextlib import nullcontext
+
+from detect import probe, describe, TYPE_A, TYPE_B, UNKNOWN
+import instrument
+from output import output_path, open_journal
+from batch import add_batch_arguments, expand_file_args, run_batch, print_timing_summary
+
+
+# Parsed workbooks kept per process by process_file(); each holds every cell of its file in memory
+DEFAULT_CACHE_SIZE = 4
+
+
+class WorkbookCache:
+    """Bounded LRU of loaded workbooks, each valid while its file's mtime and size are unchanged"""
+
+    def __init__(self, maxsize=DEFAULT_CACHE_SIZE):
+        self.maxsize = maxsize
+        self.entries = OrderedDict()    # absolute path -> (mtime_ns, size, workbook)
+        self.hits = 0
+        self.misses = 0
+
+    def take(self, filepath):
+        """
+        The workbook for filepath, loaded only if the cache has no current copy.
+        The entry is removed: the caller is about to modify the workbook, and put()s it
+        back once the result has been saved.
+        """
+        key = os.path.abspath(filepath)
+        entry = self.entries.pop(key, None)
+        stat = os.stat(filepath)
+        if entry is not None and entry[:2] == (stat.st_mtime_ns, stat.st_size):
+            self.hits += 1
+            return entry[2]
+
+        self.misses += 1
+        from openpyxl import load_workbook
+        return load_workbook(filepath)
+
+    def put(self, filepath, wb):
+        """Remember wb as the parsed content of filepath as it is on disk now"""
+        if self.maxsize <= 0:
+            return
+        key = os.path.abspath(filepath)
+        stat = os.stat(filepath)
+        self.entries.pop(key, None)
+        self.entries[key] = (stat.st_mtime_ns, stat.st_size, wb)
+        while len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+
+
+_caches = {}
+
+
+def get_cache(maxsize=DEFAULT_CACHE_SIZE):
+    """This process's workbook cache (one per size, so batch workers each build their own)"""
+    if maxsize not in _caches:
+        _caches[maxsize] = WorkbookCache(maxsize)
+    return _caches[maxsize]
+
+
+def process_file(filepath, out_dir=None, charts=True, conditional=False, formulas=False,
+                 kpi_store=None, market=None, market_dir=None, cache_size=DEFAULT_CACHE_SIZE):
+    """
+    Restructure (Type B) and format one file, saving the result once.
+    The result replaces filepath atomically, or goes into out_dir under the same name.
+    charts, conditional, formulas, kpi_store and market mean the same as for the two separate tools.
+    The saved workbook stays in this process's cache (up to cache_size of them); that only
+    pays off when the same process comes back to the same path - pass 0 otherwise.
+    Returns False if the file was skipped or could not be restructured.
+    """
+    from format_all import format_workbook
+    from formulas import formula_finalizer
+    from output import atomic_save
+
+    target = output_path(filepath, out_dir)
+    cache = get_cache(cache_size)
+
+    with instrument.phase('total', filepath):
+        print(f"\nProcessing: {filepath}")
+        with instrument.phase('detect'):
+            structure = probe(filepath)
+
+        if structure.kind == UNKNOWN:
+            print(f"  ⚠ Warning: Unknown file structure (sheets: {', '.join(structure.sheets)}). Skipped")
+            return False
+
+        if structure.kind == TYPE_B:
+            from restructure_type_b import restructure_type_b_to_type_a
+            # Charts are added once, by the format stage
+            wb = restructure_type_b_to_type_a(filepath, charts=False, formulas=formulas, save=False,
+                                              kpi_store=kpi_store, market=market, market_dir=market_dir)
+            if wb is False:
+                return False
+            kind = TYPE_A
+        else:
+            with instrument.phase('load'):
+                hits = cache.hits
+                wb = cache.take(filepath)
+            if cache.hits > hits:
+                print("  → Reusing the workbook already loaded for this file")
+            kind = structure.kind
+
+        print(f"  → Formatting: {describe(kind)}")
+        format_workbook(wb, kind, charts, conditional)
+
+        # Formula KPIs (--formulas, or already in the file) are saved with their computed values
+        finalize = formula_finalizer(wb)
+        with instrument.phase('save') as timing:
+            atomic_save(wb, target, finalize)
+            timing.bytes = instrument.file_size(target)
+        cache.put(target, wb)
+
+    print(f"✓ File saved successfully!\n")
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2:
+        print("\n" + "=" * 70)
+        print("PORTFOLIO PIPELINE (RESTRUCTURE + FORMAT)")
+        print("Type B files are restructured and formatted in one pass; Type A files are formatted")
+        print("=" * 70)
+        print("\nUsage: python pipeline.py <filename.xlsx> [file2.xlsx ...] [--jobs N] [--out-dir DIR] [--resume] [--no-charts] [--conditional] [--formulas] [--kpi-store FILE] [--market NAME] [--cache-size N] [--profile [TRACE]]")
+        print("\nExample:")
+        print("  python pipeline.py *.xlsx   (same result as restructure_type_b.py then format_all.py)")
+        print("  python pipeline.py *.xlsx --jobs 4 --out-dir Reports")
+        print("  python pipeline.py *.xlsx --formulas   (KPIs as live Excel formulas)")
+        print("=" * 70 + "\n")
+        sys.exit(0)
+
+    parser = argparse.ArgumentParser(description="Restructure and format portfolio reports in one pass")
+    add_batch_arguments(parser)
+    parser.add_argument('--no-charts', dest='charts', action='store_false',
+                        help='Do not add charts to Monthly Performance (faster batch runs)')
+    parser.add_argument('--conditional', action='store_true',
+                        help='Style the Monthly Performance grid with conditional formatting rules instead of per-cell styles')
+    parser.add_argument('--formulas', action='store_true',
+                        help='Write Executive Summary KPIs of restructured files as live Excel formulas')
+    parser.add_argument('--kpi-store', metavar='FILE',
+                        help='Add restructured files\' months to the KPI history in this sqlite file')
+    parser.add_argument('--market', metavar='NAME',
+                        help='Fill restructured files\' MARKET COMPARISON rows against this index (see market.py)')
+    parser.add_argument('--market-dir', metavar='DIR',
+                        help='Directory holding the index return files (default market_data)')
+    parser.add_argument('--cache-size', type=int, default=0, metavar='N',
+                        help='Parsed workbooks kept in memory per process (default 0 = off); only helps when '
+                             'the same process revisits a path, which a single run never does')
+    args = parser.parse_args()
+
+    files_to_process = expand_file_args(args.files)
+
+    print("\n" + "=" * 70)
+    print(f"Processing {len(files_to_process)} file(s)...")
+    print("=" * 70)
+
+    if args.out_dir:
+        os.makedirs(args.out_dir, exist_ok=True)
+    journal = open_journal('pipeline', args.out_dir, resume=args.resume)
+
+    with instrument.profiling(args.profile) if args.profile is not None else nullcontext() as profile:
+        start = time.perf_counter()
+        results = run_batch(process_file, files_to_process, jobs=args.jobs, journal=journal,
+                            out_dir=args.out_dir, charts=args.charts, conditional=args.conditional,
+                            formulas=args.formulas, kpi_store=args.kpi_store, market=args.market,
+                            market_dir=args.market_dir, cache_size=args.cache_size)
+    journal.close(completed=all(r.error is None for r in results))
+
+    success_count = sum(1 for r in results if r.ok)
+    error_count = sum(1 for r in results if r.error is not None)
+
+    print("=" * 70)
+    print(f"COMPLETE: {success_count} file(s) processed successfully")
+    if error_count > 0:
+        print(f"ERRORS: {error_count} file(s) failed")
+    print("=" * 70)
+    print_timing_summary(results, time.perf_counter() - start)
+    if profile is not None:
+        print()
+        profile.print_table()
+        if args.profile:
+            print(f"  Trace written to {args.profile}")
+    print()
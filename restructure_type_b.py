@@ -1,138 +1,256 @@
+import os
 import sys
-from openpyxl import Workbook, load_workbook
-from openpyxl.styles import Font, PatternFill, Alignment, Border, Side
-from openpyxl.utils import get_column_letter
+import math
+import time
+import argparse
 from datetime import datetime
+from contextlib import nullcontext
+from itertools import chain, islice
 
-def restructure_type_b_to_type_a(filepath):
+# openpyxl, the style tables, charts, formulas and the streaming writer load on first use,
+# so consolidate.py, pipeline.py and watcher.py don't pay for them just to import this module
+import instrument
+from detect import probe, describe, find_header_row, TYPE_B, HEADER_SCAN_ROWS
+from aliases import canonical_metric
+from kpi_engine import calculate_kpis, to_float
+from periods import year_groups, year_total_label
+from output import output_path, atomic_save, open_journal
+from batch import add_batch_arguments, expand_file_args, run_batch, print_timing_summary
+
+
+# Monthly Performance always spans at least A:M (a year of months); wider histories extend it
+STANDARD_LAST_COLUMN = 13
+# Histories longer than this many months get per-year subtotal columns
+YEAR_TOTALS_AFTER = 12
+# --export-format choices (export.FORMATS); export.py is only imported when exporting
+EXPORT_FORMATS = ('auto', 'parquet', 'arrow', 'csv')
+
+def restructure_type_b_to_type_a(filepath, write_only=False, out_dir=None, charts=True,
+                                 export_dir=None, export_format='auto', formulas=False, save=True,
+                                 kpi_store=None, market=None, market_dir=None):
     """
     Convert Type B (single Data sheet) to Type A (Executive Summary + Monthly Performance)
     Automatically extracts data, calculates KPIs, creates structured sheets, applies formatting
+    
+    With write_only=True the output is streamed through an openpyxl write-only workbook,
+    and the Data sheet is read twice, streaming, instead of once into memory: the first pass
+    keeps only the recognised metric rows, the second is copied straight into Data Source.
+    Memory then stays flat however large the Data sheet is.
+    
+    The result replaces filepath atomically, or goes into out_dir under the same name.
+    With charts=False the Monthly Performance charts are not added.
+    With export_dir, the extracted metrics and KPIs are also written there as a columnar
+    part file (see export.py).
+    With formulas=True the Executive Summary KPIs are live formulas over Monthly Performance,
+    saved together with their computed values (see formulas.py).
+    With kpi_store (path of a sqlite file), the months are also added to that KPI history
+    (see kpi_store.py). The history is only written here; the Executive Summary still
+    covers this report's months.
+    With market (an index name), the Monthly Performance MARKET COMPARISON rows are filled
+    from that index's returns in market_dir (see market.py).
+    With save=False nothing is written: the restructured, styled Workbook is returned
+    instead of True, for the caller to keep working on in memory (see pipeline.py).
+    write_only does not apply then.
     """
     
     print(f"\nRestructuring: {filepath}")
+    target = output_path(filepath, out_dir)
+    
+    # Inside a pipeline this is one stage of the file's 'total' rather than the whole of it
+    with instrument.phase('total' if save else 'restructure', filepath):
+        # Route on the zip contents before paying for a full read
+        with instrument.phase('detect'):
+            structure = probe(filepath)
+        if structure.kind != TYPE_B:
+            print(f"  ✗ Not a Type B file - detected {describe(structure.kind)}, skipped")
+            return False
+        
+        streamed = write_only and save
+        unmapped = []
+        if streamed:
+            # Nothing but the metric rows is kept; Data Source is streamed from a second pass
+            source_rows = None
+            with instrument.phase('extract'):
+                extracted = extract_metrics(iter_source_rows(filepath), unmapped, unmapped_values=False)
+        else:
+            # Load the Type B file once - every later stage works from these value rows
+            with instrument.phase('load') as timing:
+                source_rows = read_source_rows(filepath)
+                timing.cells = sum(len(row) for row in source_rows)
+            
+            with instrument.phase('extract'):
+                extracted = extract_metrics(source_rows, unmapped)
+        if extracted is None:
+            print("  ✗ Could not find month headers")
+            return False
+        title, months, metrics_data = extracted
+        if unmapped:
+            print(f"  ⚠ {len(unmapped)} row label(s) not recognised, kept as-is: {', '.join(unmapped)}")
+        
+        # Calculate KPIs from extracted data
+        with instrument.phase('kpis'):
+            kpis = calculate_kpis(metrics_data, months, title)
+        
+        if kpi_store:
+            from kpi_store import record_report
+            with instrument.phase('kpi_store'):
+                changed, stored = record_report(kpi_store, str(title).strip(), months, metrics_data)
+            print(f"  ✓ KPI history: {changed} new or revised month(s), {stored} stored for this account")
+        
+        if export_dir:
+            from export import export_account
+            with instrument.phase('export') as timing:
+                part = export_account(export_dir, filepath, title, months, metrics_data, kpis, export_format)
+                timing.bytes = instrument.file_size(part)
+        
+        with instrument.phase('build'):
+            from openpyxl import Workbook
+            
+            # Create new Type A workbook
+            wb_new = Workbook()
+            wb_new.remove(wb_new.active)  # Remove default sheet
+            
+            # Create sheets
+            ws_exec = wb_new.create_sheet("Executive Summary")
+            ws_monthly = wb_new.create_sheet("Monthly Performance")
+            
+            # Create Executive Summary
+            create_executive_summary(ws_exec, title, kpis)
+            
+            # Create Monthly Performance
+            create_monthly_performance(ws_monthly, title, months, metrics_data)
+            
+            if formulas:
+                from formulas import apply_kpi_formulas
+                apply_kpi_formulas(ws_exec, ws_monthly, months, metrics_data)
+        
+        compared = 0
+        if market:
+            from market import MARKET_DIR, load_benchmark, add_market_comparison
+            with instrument.phase('market', sheet='Monthly Performance'):
+                benchmark = load_benchmark(market, market_dir or MARKET_DIR)
+                compared = add_market_comparison(ws_monthly, months, metrics_data, benchmark)
+            if not compared:
+                print(f"  ⚠ {market} has no returns for this report's months - MARKET COMPARISON left empty")
+        
+        # Computed formula results are written into the saved file at save time
+        finalize = None
+        if formulas and save:
+            from formulas import formula_finalizer
+            with instrument.phase('formulas', sheet='Executive Summary'):
+                finalize = formula_finalizer(wb_new)
+        
+        # Charts reference the rows just written - no data is copied
+        if charts:
+            from charts import add_monthly_charts
+            with instrument.phase('charts', sheet='Monthly Performance'):
+                add_monthly_charts(ws_monthly)
+        
+        if streamed:
+            # Apply professional formatting to the small sheets, then stream everything out
+            with instrument.phase('style') as timing:
+                timing.cells = format_sheets(wb_new)
+            with instrument.phase('save') as timing:
+                save_streamed(wb_new, iter_source_rows(filepath), target, finalize)
+                timing.bytes = instrument.file_size(target)
+        else:
+            # Copy original data to Data Source
+            with instrument.phase('build', sheet='Data Source'):
+                copy_data_source(wb_new.create_sheet("Data Source"), source_rows)
+            
+            # Apply professional formatting
+            with instrument.phase('style') as timing:
+                timing.cells = format_sheets(wb_new)
+            
+            # Save the restructured file
+            if save:
+                with instrument.phase('save') as timing:
+                    atomic_save(wb_new, target, finalize)
+                    timing.bytes = instrument.file_size(target)
     
-    # Load the Type B file
-    wb_source = load_workbook(filepath, data_only=True)
-    ws_source = wb_source['Data']
+    print(f"  ✓ Restructured to Type A format")
+    print(f"  ✓ Created Executive Summary sheet" + (" (live KPI formulas)" if formulas else ""))
+    print(f"  ✓ Created Monthly Performance sheet")
+    if compared:
+        print(f"  ✓ Compared {compared} month(s) against {market}")
+    if charts:
+        print(f"  ✓ Added Monthly Performance charts")
+    print(f"  ✓ Created Data Source sheet")
+    print(f"  ✓ Applied professional formatting")
+    if not save:
+        return wb_new
+    print(f"✓ File saved successfully!\n")
+    
+    return True
+
+
+def iter_source_rows(filepath, sheet_name='Data'):
+    """The Type B Data sheet's value tuples one at a time, from a streaming read-only load"""
+    from openpyxl import load_workbook
+    
+    wb_source = load_workbook(filepath, read_only=True, data_only=True)
+    try:
+        for row in wb_source[sheet_name].iter_rows(values_only=True):
+            yield tuple(row)
+    finally:
+        wb_source.close()
+
+
+def read_source_rows(filepath, sheet_name='Data'):
+    """Read the Type B Data sheet once, as a list of value tuples, using a streaming read-only load"""
+    return list(iter_source_rows(filepath, sheet_name))
+
+
+def extract_metrics(source_rows, unmapped=None, unmapped_values=True):
+    """
+    Pull (title, months, metrics_data) out of Type B value rows (a list, or any iterable -
+    rows are consumed once, in order, and only the metric rows are kept).
+    Row labels are mapped to canonical metric names (see aliases.py); labels that aren't
+    recognised are kept as they are and, if unmapped is a list, appended to it.
+    With unmapped_values=False the rows of unrecognised labels are not kept at all.
+    Returns None when no month header row can be found.
+    """
+    
+    rows = iter(source_rows)
+    head = list(islice(rows, HEADER_SCAN_ROWS))
     
     # Extract data from Type B sheet
-    title = ws_source['A1'].value or "Portfolio Report"
+    title = _source_value(head, 1, 1) or "Portfolio Report"
     
-    # Find month headers (typically row 4)
-    month_row = None
-    for row in range(1, 10):
-        if ws_source[f'B{row}'].value and 'Mar' in str(ws_source[f'B{row}'].value):
-            month_row = row
-            break
+    # Find month headers (typically row 4) - the first row with a month label in column B
+    month_row = find_header_row(head)
     
     if not month_row:
-        print("  ✗ Could not find month headers")
-        return False
+        return None
     
-    # Extract months and data
-    months = []
-    for col in range(2, 15):
-        cell_val = ws_source.cell(row=month_row, column=col).value
-        if cell_val:
-            months.append(str(cell_val))
+    # Extract months and data - every labelled column, however long the history
+    months = [str(cell_val) for cell_val in head[month_row - 1][1:] if cell_val]
     
     # Extract metrics data
     metrics_data = {}
-    for row in range(month_row + 1, ws_source.max_row + 1):
-        metric_name = ws_source[f'A{row}'].value
+    for values in chain(head[month_row:], rows):
+        metric_name = values[0] if values else None
         if metric_name and str(metric_name).strip() and str(metric_name).strip() != '-':
-            values = []
-            for col in range(2, 2 + len(months)):
-                val = ws_source.cell(row=row, column=col).value
-                values.append(val)
-            metrics_data[str(metric_name).strip()] = values
-    
-    wb_source.close()
-    
-    # Calculate KPIs from extracted data
-    kpis = calculate_kpis(metrics_data, months, title)
-    
-    # Create new Type A workbook
-    wb_new = Workbook()
-    wb_new.remove(wb_new.active)  # Remove default sheet
-    
-    # Create sheets
-    ws_exec = wb_new.create_sheet("Executive Summary")
-    ws_monthly = wb_new.create_sheet("Monthly Performance")
-    ws_data = wb_new.create_sheet("Data Source")
-    
-    # Create Executive Summary
-    create_executive_summary(ws_exec, title, kpis)
-    
-    # Create Monthly Performance
-    create_monthly_performance(ws_monthly, title, months, metrics_data)
-    
-    # Copy original data to Data Source
-    copy_data_source(ws_data, filepath)
-    
-    # Apply professional formatting
-    format_sheets(wb_new)
-    
-    # Save the restructured file
-    wb_new.save(filepath)
-    print(f"  ✓ Restructured to Type A format")
-    print(f"  ✓ Created Executive Summary sheet")
-    print(f"  ✓ Created Monthly Performance sheet")
-    print(f"  ✓ Created Data Source sheet")
-    print(f"  ✓ Applied professional formatting")
-    print(f"✓ File saved successfully!\n")
-    
-    return True
+            label = str(metric_name).strip()
+            metric = canonical_metric(label)
+            if metric is None:
+                metric = label
+                if unmapped is not None:
+                    unmapped.append(label)
+                if not unmapped_values:
+                    continue
+            metrics_data[metric] = [values[col] if col < len(values) else None
+                                    for col in range(1, 1 + len(months))]
+    
+    return title, months, metrics_data
 
 
-def calculate_kpis(metrics_data, months, title):
-    """Calculate Key Performance Indicators from metrics data"""
-    
-    kpis = {}
-    
-    # Extract relevant metrics
-    portfolio_values = metrics_data.get('Portfolio value', [])
-    starting_values = metrics_data.get('At the beginning of the period', portfolio_values[:-1] if portfolio_values else [])
-    total_profits = metrics_data.get('Total profit', [])
-    profit_percents = metrics_data.get('Total profit, %', [])
-    dividends = metrics_data.get('Dividends', [0]*len(months))
-    
-    if not portfolio_values or len(portfolio_values) < 2:
-        return kpis
-    
-    # Starting and ending values
-    kpis['start_value'] = float(starting_values[0]) if starting_values else 0
-    kpis['end_value'] = float(portfolio_values[-1]) if portfolio_values else 0
-    kpis['growth'] = kpis['end_value'] - kpis['start_value']
-    kpis['growth_percent'] = (kpis['growth'] / kpis['start_value'] * 100) if kpis['start_value'] else 0
-    
-    # Total metrics
-    total_profit = sum(float(p) if isinstance(p, (int, float)) else 0 for p in total_profits)
-    total_dividends = sum(float(d) if isinstance(d, (int, float)) else 0 for d in dividends)
-    kpis['total_profit'] = total_profit
-    kpis['total_dividends'] = total_dividends
-    kpis['total_gains'] = total_profit - total_dividends
-    
-    # Monthly statistics
-    profit_values = [float(p) if isinstance(p, (int, float)) else 0 for p in total_profits]
-    valid_profits = [p for p in profit_values if p is not None and p != 0]
-    
-    if valid_profits:
-        kpis['best_month'] = max(valid_profits)
-        kpis['worst_month'] = min(valid_profits)
-        kpis['avg_monthly'] = sum(valid_profits) / len(valid_profits)
-        kpis['positive_months'] = len([p for p in valid_profits if p > 0])
-    else:
-        kpis['best_month'] = 0
-        kpis['worst_month'] = 0
-        kpis['avg_monthly'] = 0
-        kpis['positive_months'] = 0
-    
-    kpis['total_months'] = len(months)
-    kpis['months'] = months
-    
-    return kpis
+def _source_value(source_rows, row, col):
+    """1-based cell lookup into rows from read_source_rows (None outside the used range)"""
+    if row > len(source_rows):
+        return None
+    values = source_rows[row - 1]
+    return values[col - 1] if col <= len(values) else None
 
 
 def create_executive_summary(ws, title, kpis):
@@ -160,14 +278,16 @@ def create_executive_summary(ws, title, kpis):
     ws.row_dimensions[5].height = 18
     
     # KPI data
+    months = kpis['months']
+    win_rate = kpis.get('positive_months', 0) / len(months) * 100 if months else 0
     kpi_rows = [
         ('Portfolio Growth', f"${kpis.get('growth', 0):,.2f}", f"{kpis.get('growth_percent', 0):.2f}% increase"),
-        ('Starting Value', f"${kpis.get('start_value', 0):,.2f}", f"{kpis.get('months', [])[0] if kpis.get('months') else 'Mar 2025'}"),
-        ('Ending Value', f"${kpis.get('end_value', 0):,.2f}", "February 2026"),
-        ('Total Profit', f"${kpis.get('total_profit', 0):,.2f}", 'Last 12 months'),
+        ('Starting Value', f"${kpis.get('start_value', 0):,.2f}", months[0]),
+        ('Ending Value', f"${kpis.get('end_value', 0):,.2f}", months[-1]),
+        ('Total Profit', f"${kpis.get('total_profit', 0):,.2f}", f'Last {len(months)} months'),
         ('Total Dividends', f"${kpis.get('total_dividends', 0):,.2f}", 'Cumulative'),
         ('Average Monthly Return', f"${kpis.get('avg_monthly', 0):,.2f}", 'Per month average'),
-        ('Positive Months', f"{kpis.get('positive_months', 0)} of {kpis.get('total_months', 12)}", f"{(kpis.get('positive_months', 0)/kpis.get('total_months', 12)*100):.0f}% win rate"),
+        ('Positive Months', f"{kpis.get('positive_months', 0)} of {len(months)}", f"{win_rate:.0f}% win rate"),
         ('Best Month', f"${kpis.get('best_month', 0):,.2f}", 'Highest profit'),
         ('Worst Month', f"${kpis.get('worst_month', 0):,.2f}", 'Lowest profit'),
     ]
@@ -186,45 +306,58 @@ def create_executive_summary(ws, title, kpis):
 
 
 def create_monthly_performance(ws, title, months, metrics_data):
-    """Create Monthly Performance sheet with organized monthly data"""
+    """
+    Create Monthly Performance sheet with organized monthly data
+    Any number of months is supported; histories longer than a year also get one
+    subtotal column per calendar year to the right of the months.
+    """
+    from openpyxl.utils import get_column_letter
     
     # Title
     ws['A1'].value = 'MONTHLY PERFORMANCE ANALYSIS'
-    ws.merge_cells('A1:M1')
     ws.row_dimensions[1].height = 22
     
     ws.row_dimensions[2].height = 8
     
-    # Month headers
+    # Month headers, then the per-year subtotal headers
     ws['A3'].value = 'Period'
     for idx, month in enumerate(months, start=2):
         ws.cell(row=3, column=idx).value = month
+    groups = year_groups(months) if len(months) > YEAR_TOTALS_AFTER else []
+    totals_col = 2 + len(months)
+    for offset, (year, _) in enumerate(groups):
+        ws.cell(row=3, column=totals_col + offset).value = year_total_label(year)
     ws.row_dimensions[3].height = 18
     
+    # Merged title/section rows span the whole table, and never less than the usual A:M
+    last_col = max(STANDARD_LAST_COLUMN, totals_col + len(groups) - 1)
+    last = get_column_letter(last_col)
+    ws.merge_cells(f'A1:{last}1')
+    
+    # Labels and month headers stay in view when scrolling through long histories
+    ws.freeze_panes = 'B4'
+    
+    def write_metric_row(row, values, total):
+        for col_idx, month in enumerate(months, start=2):
+            if col_idx - 2 < len(values):
+                ws.cell(row=row, column=col_idx).value = values[col_idx - 2]
+        _write_year_totals(ws, row, values, groups, totals_col, total)
+    
     # Extract and organize metrics into sections
     row_num = 4
-    current_section = None
     
     # Portfolio Values section
     ws[f'A{row_num}'].value = 'Portfolio Value (Start)'
-    for col_idx, month in enumerate(months, start=2):
-        starting_values = metrics_data.get('At the beginning of the period', [])
-        if col_idx - 2 < len(starting_values):
-            val = starting_values[col_idx - 2]
-            ws.cell(row=row_num, column=col_idx).value = val
+    write_metric_row(row_num, metrics_data.get('At the beginning of the period', []), 'first')
     row_num += 1
     
     ws[f'A{row_num}'].value = 'Portfolio Value (End)'
-    for col_idx, month in enumerate(months, start=2):
-        port_values = metrics_data.get('Portfolio value', [])
-        if col_idx - 2 < len(port_values):
-            val = port_values[col_idx - 2]
-            ws.cell(row=row_num, column=col_idx).value = val
+    write_metric_row(row_num, metrics_data.get('Portfolio value', []), 'last')
     row_num += 2
     
     # PROFIT METRICS section
     ws[f'A{row_num}'].value = 'PROFIT METRICS'
-    ws.merge_cells(f'A{row_num}:M{row_num}')
+    ws.merge_cells(f'A{row_num}:{last}{row_num}')
     ws.row_dimensions[row_num].height = 18
     row_num += 1
     
@@ -234,11 +367,8 @@ def create_monthly_performance(ws, title, months, metrics_data):
     for metric in profit_metrics:
         if metric in metrics_data:
             ws[f'A{row_num}'].value = metric
-            for col_idx, month in enumerate(months, start=2):
-                values = metrics_data[metric]
-                if col_idx - 2 < len(values):
-                    val = values[col_idx - 2]
-                    ws.cell(row=row_num, column=col_idx).value = val
+            # Monthly percentages don't add up to a yearly figure
+            write_metric_row(row_num, metrics_data[metric], None if '%' in metric else 'sum')
             ws.row_dimensions[row_num].height = 16
             row_num += 1
     
@@ -246,7 +376,7 @@ def create_monthly_performance(ws, title, months, metrics_data):
     
     # TRADING ACTIVITY section
     ws[f'A{row_num}'].value = 'TRADING ACTIVITY'
-    ws.merge_cells(f'A{row_num}:M{row_num}')
+    ws.merge_cells(f'A{row_num}:{last}{row_num}')
     ws.row_dimensions[row_num].height = 18
     row_num += 1
     
@@ -256,97 +386,84 @@ def create_monthly_performance(ws, title, months, metrics_data):
     for metric in trading_metrics:
         if metric in metrics_data:
             ws[f'A{row_num}'].value = metric
-            for col_idx, month in enumerate(months, start=2):
-                values = metrics_data[metric]
-                if col_idx - 2 < len(values):
-                    val = values[col_idx - 2]
-                    ws.cell(row=row_num, column=col_idx).value = val
+            write_metric_row(row_num, metrics_data[metric], 'sum')
             ws.row_dimensions[row_num].height = 16
             row_num += 1
     
     ws.column_dimensions['A'].width = 25
-    for col in range(2, 2 + len(months)):
+    for col in range(2, totals_col + len(groups)):
         ws.column_dimensions[get_column_letter(col)].width = 14
 
 
-def copy_data_source(ws, filepath):
+def _write_year_totals(ws, row, values, groups, first_col, total):
+    """
+    Fill the per-year subtotal columns of one metric row.
+    total: 'sum' adds the year's months, 'first' / 'last' take its first / last month,
+    None leaves the columns empty.
+    """
+    if total is None:
+        return
+    for offset, (year, indices) in enumerate(groups):
+        numbers = [to_float(values[idx]) for idx in indices if idx < len(values)]
+        numbers = [n for n in numbers if not math.isnan(n)]
+        if not numbers:
+            continue
+        if total == 'sum':
+            value = sum(numbers)
+        else:
+            value = numbers[0] if total == 'first' else numbers[-1]
+        ws.cell(row=row, column=first_col + offset).value = value
+
+
+def copy_data_source(ws, source_rows):
     """Copy original data to Data Source sheet for reference"""
     
-    wb_source = load_workbook(filepath, data_only=True)
-    ws_source = wb_source['Data']
-    
     ws['A1'].value = 'Original Data Structure'
     ws.row_dimensions[1].height = 20
     
-    row_offset = 2
-    for row in ws_source.iter_rows(min_row=1, max_row=ws_source.max_row, 
-                                     min_col=1, max_col=ws_source.max_column, 
-                                     values_only=True):
-        for col_idx, value in enumerate(row, start=1):
-            ws.cell(row=row_offset, column=col_idx).value = value
-        row_offset += 1
+    # Rows land from row 2 down, one append per source row
+    for row in source_rows:
+        ws.append(row)
+
+
+def save_streamed(wb, source_rows, filepath, finalize=None):
+    """
+    Save formatted summary sheets plus a streamed Data Source sheet via a write-only workbook.
+    source_rows may be a generator (see iter_source_rows); each row is written as it comes.
+    """
+    
+    from openpyxl import Workbook
+    from streaming import copy_sheet_streamed, stream_data_source
     
-    wb_source.close()
+    wb_out = Workbook(write_only=True)
+    for ws in wb.worksheets:
+        copy_sheet_streamed(ws, wb_out.create_sheet(ws.title))
+    stream_data_source(wb_out.create_sheet("Data Source"), source_rows)
+    atomic_save(wb_out, filepath, finalize)
 
 
 def format_sheets(wb):
-    """Apply professional formatting to all sheets"""
-    
-    # Color scheme
-    header_fill = PatternFill(start_color="1F4788", end_color="1F4788", fill_type="solid")
-    subheader_fill = PatternFill(start_color="4472C4", end_color="4472C4", fill_type="solid")
-    metric_fill = PatternFill(start_color="D9E1F2", end_color="D9E1F2", fill_type="solid")
-    highlight_fill = PatternFill(start_color="E7E6E6", end_color="E7E6E6", fill_type="solid")
-    
-    header_font = Font(bold=True, size=12, color="FFFFFF")
-    title_font = Font(bold=True, size=16, color="FFFFFF")
-    subheader_font = Font(bold=True, size=11, color="FFFFFF")
-    bold_font = Font(bold=True, size=10)
-    
-    thin_border = Border(
-        left=Side(style='thin', color="000000"),
-        right=Side(style='thin', color="000000"),
-        top=Side(style='thin', color="000000"),
-        bottom=Side(style='thin', color="000000")
-    )
+    """Apply professional formatting to all sheets; returns the number of cells styled"""
+    from styles import StyleRegistry
+    
+    styles = StyleRegistry(wb)
     
     # Format Executive Summary
     ws_exec = wb['Executive Summary']
-    ws_exec['A1'].font = title_font
-    ws_exec['A1'].fill = header_fill
-    ws_exec['A1'].alignment = Alignment(horizontal='left', vertical='center')
-    
-    ws_exec['A4'].font = subheader_font
-    ws_exec['A4'].fill = subheader_fill
-    
-    for col in ['A', 'B', 'C']:
-        ws_exec[col + '5'].font = header_font
-        ws_exec[col + '5'].fill = header_fill
-        ws_exec[col + '5'].border = thin_border
-        ws_exec[col + '5'].alignment = Alignment(horizontal='center', vertical='center')
+    styles.apply(ws_exec['A1'], 'title_plain')
+    styles.apply(ws_exec['A4'], 'section_header_plain')
+    styles.apply_row(ws_exec, 5, 1, 3, 'column_header_plain')
     
     for row in range(6, 15):
-        ws_exec[f'A{row}'].font = bold_font
-        ws_exec[f'A{row}'].fill = metric_fill
-        ws_exec[f'A{row}'].border = thin_border
-        
-        ws_exec[f'B{row}'].fill = PatternFill(start_color="FFFFFF", end_color="FFFFFF", fill_type="solid")
-        ws_exec[f'B{row}'].border = thin_border
-        ws_exec[f'B{row}'].alignment = Alignment(horizontal='right', vertical='center')
-        
-        ws_exec[f'C{row}'].fill = PatternFill(start_color="F2F2F2", end_color="F2F2F2", fill_type="solid")
-        ws_exec[f'C{row}'].border = thin_border
+        styles.apply(ws_exec[f'A{row}'], 'label_plain')
+        styles.apply(ws_exec[f'B{row}'], 'value_cell')
+        styles.apply(ws_exec[f'C{row}'], 'detail_plain')
     
     # Format Monthly Performance
     ws_monthly = wb['Monthly Performance']
-    ws_monthly['A1'].font = Font(bold=True, size=14, color="FFFFFF")
-    ws_monthly['A1'].fill = header_fill
-    
-    for col in range(1, 14):
-        ws_monthly.cell(row=3, column=col).font = header_font
-        ws_monthly.cell(row=3, column=col).fill = header_fill
-        ws_monthly.cell(row=3, column=col).border = thin_border
-        ws_monthly.cell(row=3, column=col).alignment = Alignment(horizontal='center', vertical='center')
+    last_col = max(STANDARD_LAST_COLUMN, ws_monthly.max_column)
+    styles.apply(ws_monthly['A1'], 'monthly_title_plain')
+    styles.apply_row(ws_monthly, 3, 1, last_col, 'column_header_plain')
     
     # Format data rows with color coding
     current_section = None
@@ -356,31 +473,28 @@ def format_sheets(wb):
             metric_str = str(metric_name).upper()
             
             if 'PROFIT' in metric_str:
-                section_fill = PatternFill(start_color="FFF2CC", end_color="FFF2CC", fill_type="solid")
+                cell_style = 'profit_cell'
                 current_section = 'profit'
             elif 'TRADING' in metric_str:
-                section_fill = PatternFill(start_color="E2EFDA", end_color="E2EFDA", fill_type="solid")
+                cell_style = 'activity_cell'
                 current_section = 'trading'
+            elif 'MARKET COMPARISON' in metric_str:
+                cell_style = 'value_cell'
+                current_section = 'market'
             elif 'SECTION' not in metric_str:
                 if current_section == 'profit':
-                    section_fill = PatternFill(start_color="FFF2CC", end_color="FFF2CC", fill_type="solid")
+                    cell_style = 'profit_cell'
                 elif current_section == 'trading':
-                    section_fill = PatternFill(start_color="E2EFDA", end_color="E2EFDA", fill_type="solid")
+                    cell_style = 'activity_cell'
                 else:
-                    section_fill = PatternFill(start_color="FFFFFF", end_color="FFFFFF", fill_type="solid")
+                    cell_style = 'value_cell'
             else:
-                section_fill = None
-            
-            ws_monthly[f'A{row}'].font = bold_font
-            ws_monthly[f'A{row}'].fill = metric_fill
-            ws_monthly[f'A{row}'].border = thin_border
+                cell_style = 'grid_cell'
             
-            for col in range(2, 14):
-                cell = ws_monthly.cell(row=row, column=col)
-                if section_fill:
-                    cell.fill = section_fill
-                cell.border = thin_border
-                cell.alignment = Alignment(horizontal='right', vertical='center')
+            styles.apply(ws_monthly[f'A{row}'], 'label_plain')
+            styles.apply_row(ws_monthly, row, 2, last_col, cell_style)
+    
+    return styles.cells_styled
 
 
 if __name__ == '__main__':
@@ -389,39 +503,72 @@ if __name__ == '__main__':
         print("TYPE B TO TYPE A RESTRUCTURING TOOL")
         print("Converts single Data sheet to Executive Summary + Monthly Performance")
         print("=" * 70)
-        print("\nUsage: python restructure_type_b.py <filename.xlsx> [file2.xlsx ...]")
+        print("\nUsage: python restructure_type_b.py <filename.xlsx> [file2.xlsx ...] [--jobs N] [--write-only] [--out-dir DIR] [--resume] [--no-charts] [--formulas] [--export-dir DIR] [--kpi-store FILE] [--market NAME] [--profile [TRACE]]")
         print("\nExample:")
         print("  python restructure_type_b.py Portfolio1.xlsx")
         print("  python restructure_type_b.py *.xlsx  (all Type B files)")
+        print("  python restructure_type_b.py *.xlsx --jobs 0  (one worker per CPU core)")
+        print("  python restructure_type_b.py *.xlsx --out-dir Restructured  (leave the inputs untouched)")
+        print("  python restructure_type_b.py *.xlsx --formulas  (KPIs as live Excel formulas)")
+        print("  python restructure_type_b.py *.xlsx --export-dir metrics  (also write a Parquet/CSV dataset)")
+        print("  python restructure_type_b.py *.xlsx --kpi-store history.sqlite  (keep a KPI history across runs)")
+        print("  python restructure_type_b.py *.xlsx --market SP500  (compare with market_data/SP500.csv)")
         print("=" * 70 + "\n")
         sys.exit(0)
     
+    parser = argparse.ArgumentParser(description="Type B to Type A restructuring tool")
+    add_batch_arguments(parser)
+    parser.add_argument('--write-only', action='store_true',
+                        help='Stream output through a write-only workbook (flat memory on very large Data sheets)')
+    parser.add_argument('--no-charts', dest='charts', action='store_false',
+                        help='Do not add charts to Monthly Performance (faster batch runs)')
+    parser.add_argument('--formulas', action='store_true',
+                        help='Write Executive Summary KPIs as live Excel formulas (with computed values cached)')
+    parser.add_argument('--export-dir', metavar='DIR',
+                        help='Also write each file\'s metrics and KPIs to a columnar dataset in DIR')
+    parser.add_argument('--export-format', choices=EXPORT_FORMATS, default='auto',
+                        help='Dataset format (auto = parquet when pyarrow is installed, else csv)')
+    parser.add_argument('--kpi-store', metavar='FILE',
+                        help='Also add each file\'s months to the KPI history in this sqlite file; '
+                             'read it back with kpi_store.py')
+    parser.add_argument('--market', metavar='NAME',
+                        help='Fill the MARKET COMPARISON rows against this index (see market.py)')
+    parser.add_argument('--market-dir', metavar='DIR',
+                        help='Directory holding the index return files (default market_data)')
+    args = parser.parse_args()
+    
     # Get all files to process
-    files_to_process = []
-    for arg in sys.argv[1:]:
-        if '*' in arg:
-            import glob
-            files_to_process.extend(glob.glob(arg))
-        else:
-            files_to_process.append(arg)
+    files_to_process = expand_file_args(args.files)
     
     print("\n" + "=" * 70)
     print(f"Restructuring {len(files_to_process)} file(s) from Type B to Type A...")
     print("=" * 70)
     
-    success_count = 0
-    error_count = 0
+    if args.out_dir:
+        os.makedirs(args.out_dir, exist_ok=True)
+    journal = open_journal('restructure_type_b', args.out_dir, resume=args.resume)
     
-    for filename in files_to_process:
-        try:
-            if restructure_type_b_to_type_a(filename):
-                success_count += 1
-        except Exception as e:
-            print(f"✗ Error processing {filename}: {e}\n")
-            error_count += 1
+    with instrument.profiling(args.profile) if args.profile is not None else nullcontext() as profile:
+        start = time.perf_counter()
+        results = run_batch(restructure_type_b_to_type_a, files_to_process, jobs=args.jobs, journal=journal,
+                            write_only=args.write_only, out_dir=args.out_dir, charts=args.charts,
+                            export_dir=args.export_dir, export_format=args.export_format,
+                            formulas=args.formulas, kpi_store=args.kpi_store,
+                            market=args.market, market_dir=args.market_dir)
+    journal.close(completed=all(r.error is None for r in results))
+    
+    success_count = sum(1 for r in results if r.ok)
+    error_count = sum(1 for r in results if r.error is not None)
     
     print("=" * 70)
     print(f"COMPLETE: {success_count} file(s) restructured successfully")
     if error_count > 0:
         print(f"ERRORS: {error_count} file(s) failed")
-    print("=" * 70 + "\n")
+    print("=" * 70)
+    print_timing_summary(results, time.perf_counter() - start)
+    if profile is not None:
+        print()
+        profile.print_table()
+        if args.profile:
+            print(f"  Trace written to {args.profile}")
+    print()
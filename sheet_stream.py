@@ -0,0 +1,440 @@
+"""
+Streaming worksheet XML rewriter
+A worksheet part is rewritten in one pass that holds a single <row> in memory at a time:
+style ids (s=) of planned cells are replaced, missing cells and rows are inserted, and row
+heights set; the small parts around sheetData (<dimension>, <sheetViews>, <cols>,
+<mergeCells>) are patched as text. Everything not being changed - untouched rows, formulas,
+values, drawings, extension lists - is copied through character for character.
+
+scan_sheet() is the matching read pass: the sheet's extent and merges, plus the few cell
+values a layout looks at, again one row at a time.
+"""
+
+import io
+import re
+from functools import lru_cache
+from collections import namedtuple
+from xml.etree.ElementTree import iterparse
+
+from openpyxl.utils import get_column_letter
+from openpyxl.utils.cell import coordinate_to_tuple, range_boundaries
+
+from detect import column_index, convert_value
+
+
+_MAIN = '{http://schemas.openxmlformats.org/spreadsheetml/2006/main}'
+
+# Characters read from the source part at a time
+CHUNK_SIZE = 1 << 16
+
+# Worksheet child elements in schema order, for inserting ones a sheet doesn't have yet
+SHEET_ORDER = (
+    'sheetPr', 'dimension', 'sheetViews', 'sheetFormatPr', 'cols', 'sheetData', 'sheetCalcPr',
+    'sheetProtection', 'protectedRanges', 'scenarios', 'autoFilter', 'sortState', 'dataConsolidate',
+    'customSheetViews', 'mergeCells', 'phoneticPr', 'conditionalFormatting', 'dataValidations',
+    'hyperlinks', 'printOptions', 'pageMargins', 'pageSetup', 'headerFooter', 'rowBreaks', 'colBreaks',
+    'customProperties', 'cellWatches', 'ignoredErrors', 'smartTags', 'drawing', 'legacyDrawing',
+    'legacyDrawingHF', 'drawingHF', 'picture', 'oleObjects', 'controls', 'webPublishItems',
+    'tableParts', 'extLst',
+)
+
+SheetScan = namedtuple('SheetScan', ['max_row', 'max_col', 'merges', 'values', 'has_drawing'])
+
+# cells {row: {col: style}}, heights {row: height}, merges [(min_row, min_col, max_row, max_col)]
+# or None to leave them, widths [(col, width)], freeze (top-left cell or None), dimension ('A1:M30')
+SheetEdits = namedtuple('SheetEdits', ['cells', 'heights', 'merges', 'widths', 'freeze', 'dimension',
+                                       'clear_rules'])
+
+_ROOT = re.compile(r'<(?:([\w.-]+):)?worksheet\b[^>]*>')
+_ATTR = re.compile(r'([\w:.-]+)\s*=\s*("[^"]*"|\'[^\']*\')')
+
+
+# ========== READ PASS ==========
+
+def scan_sheet(fh, coordinates=(), columns=()):
+    """
+    Extent, merges and drawing of a worksheet part, as openpyxl would count them (every cell
+    element and merged area), plus the raw (type, text) values of the cells at coordinates
+    and in columns. Rows are discarded as soon as they have been read.
+    """
+    max_row = max_col = 1
+    values = {}
+    merges = []
+    has_drawing = False
+    sheet_data = None
+    row_idx = col_idx = 0
+
+    for event, elem in iterparse(fh, events=('start', 'end')):
+        tag = elem.tag
+        if event == 'start':
+            if tag == f'{_MAIN}row':
+                row_idx = int(elem.get('r', row_idx + 1))
+                col_idx = 0
+            elif tag == f'{_MAIN}sheetData':
+                sheet_data = elem
+            elif tag == f'{_MAIN}drawing':
+                has_drawing = True
+        elif tag == f'{_MAIN}c':
+            reference = elem.get('r')
+            col_idx = column_index(reference) if reference else col_idx + 1
+            max_row, max_col = max(max_row, row_idx), max(max_col, col_idx)
+            if col_idx in columns or (row_idx, col_idx) in coordinates:
+                values[(row_idx, col_idx)] = _raw_value(elem)
+        elif tag == f'{_MAIN}row':
+            sheet_data.clear()
+        elif tag == f'{_MAIN}mergeCell':
+            min_col, min_row, last_col, last_row = range_boundaries(elem.get('ref'))
+            merges.append((min_row, min_col, last_row, last_col))
+            max_row, max_col = max(max_row, last_row), max(max_col, last_col)
+
+    return SheetScan(max_row, max_col, merges, values, has_drawing)
+
+
+def _raw_value(cell):
+    cell_type = cell.get('t', 'n')
+    if cell_type == 'inlineStr':
+        return cell_type, ''.join(t.text or '' for t in cell.iter(f'{_MAIN}t'))
+    return cell_type, cell.findtext(f'{_MAIN}v')
+
+
+def scanned_value(scan, row, col, shared):
+    """Value of a cell read by scan_sheet (shared: {index: text} for the 's' cells)"""
+    if (row, col) not in scan.values:
+        return None
+    cell_type, text = scan.values[(row, col)]
+    return convert_value(text, cell_type, shared)
+
+
+def shared_indices(scan):
+    return {int(text) for cell_type, text in scan.values.values() if cell_type == 's' and text}
+
+
+# ========== WRITE PASS ==========
+
+class _Reader:
+    """Text of a part, read on demand; the part already consumed is dropped"""
+
+    def __init__(self, fh):
+        self.fh = io.TextIOWrapper(fh, encoding='utf-8', newline='')
+        self.buffer = ''
+        self.pos = 0
+        self.eof = False
+
+    def search(self, pattern):
+        """Next match at or after the current position (None at the end of the part)"""
+        while True:
+            match = pattern.search(self.buffer, self.pos)
+            # A match touching the end of the buffer may continue in the next chunk
+            if self.eof or (match is not None and match.end() < len(self.buffer)):
+                return match
+            chunk = self.fh.read(CHUNK_SIZE)
+            if self.pos > CHUNK_SIZE:
+                self.buffer, self.pos = self.buffer[self.pos:], 0
+            self.buffer += chunk
+            self.eof = not chunk
+
+    def take(self, end):
+        text = self.buffer[self.pos:end]
+        self.pos = end
+        return text
+
+    def rest(self):
+        text = self.buffer[self.pos:] + self.fh.read()
+        self.buffer, self.pos = '', 0
+        return text
+
+    def close(self):
+        self.fh.detach()
+
+
+@lru_cache(maxsize=8)
+def _patterns(prefix):
+    p = re.escape(prefix)
+    return dict(
+        sheet_data=re.compile(rf'<{p}sheetData\b([^>]*?)(/?)>'),
+        row_or_end=re.compile(rf'<{p}row\b([^>]*?)(/?)>|</{p}sheetData>'),
+        row_end=re.compile(rf'</{p}row>'),
+        cell=re.compile(rf'<{p}c\b([^>]*?)(?:/>|>(.*?)</{p}c>)', re.S),
+        sheet_view=re.compile(rf'<{p}sheetView\b([^>]*?)(/?)>'),
+        pane=re.compile(rf'<{p}(pane|selection)\b[^>]*?(?:/>|>.*?</{p}\1>)', re.S),
+        col=re.compile(rf'<{p}col\b([^>]*?)/?>'),
+        root_end=re.compile(rf'</{p}worksheet>'),
+    )
+
+
+def _element(prefix, name):
+    p = re.escape(prefix)
+    return re.compile(rf'<{p}{name}\b[^>]*?(?:/>|>.*?</{p}{name}>)', re.S)
+
+
+def _attrs(text):
+    """Attributes of a start tag as [(name, quoted value)], in document order"""
+    return [(match.group(1), match.group(2)) for match in _ATTR.finditer(text)]
+
+
+def _get(attrs, name):
+    for key, quoted in attrs:
+        if key == name:
+            return quoted[1:-1]
+    return None
+
+
+def _set(attrs, name, value):
+    for idx, (key, _) in enumerate(attrs):
+        if key == name:
+            attrs[idx] = (name, f'"{value}"')
+            return
+    attrs.append((name, f'"{value}"'))
+
+
+def _start_tag(prefix, name, attrs, empty=False):
+    body = ''.join(f' {key}={quoted}' for key, quoted in attrs)
+    return f'<{prefix}{name}{body}{"/>" if empty else ">"}'
+
+
+def _number(value):
+    return f'{value:g}'
+
+
+def rewrite_sheet(src, dst, edits, restyle):
+    """
+    Copy a worksheet part from src to dst (binary file objects) applying edits.
+    restyle(existing style id, style name) returns the style id a planned cell gets.
+    """
+    reader = _Reader(src)
+    writer = io.TextIOWrapper(dst, encoding='utf-8', newline='')
+    try:
+        root = reader.search(_ROOT)
+        if root is None:
+            raise ValueError("Not a worksheet part")
+        prefix = f'{root.group(1)}:' if root.group(1) else ''
+        patterns = _patterns(prefix)
+
+        sheet_data = reader.search(patterns['sheet_data'])
+        if sheet_data is None:
+            raise ValueError("Worksheet has no sheetData")
+        head = reader.take(sheet_data.start())
+        writer.write(_edit_head(head, prefix, edits))
+        reader.take(sheet_data.end())
+        writer.write(f'<{prefix}sheetData{sheet_data.group(1)}>')
+
+        pending = sorted(set(edits.cells) | set(edits.heights))
+        next_new = 0
+        row_idx = 0
+        while not sheet_data.group(2):
+            match = reader.search(patterns['row_or_end'])
+            if match is None:
+                raise ValueError("Unterminated sheetData")
+            writer.write(reader.take(match.start()))
+            if not match.group(0).startswith(f'<{prefix}row'):
+                reader.take(match.end())
+                break
+            if match.group(2):
+                row_text = reader.take(match.end())
+            else:
+                end = reader.search(patterns['row_end'])
+                if end is None:
+                    raise ValueError("Unterminated row")
+                row_text = reader.take(end.end())
+
+            attrs = _attrs(match.group(1))
+            row_idx = int(_get(attrs, 'r') or row_idx + 1)
+            while next_new < len(pending) and pending[next_new] < row_idx:
+                writer.write(_new_row(prefix, pending[next_new], edits, restyle))
+                next_new += 1
+            if next_new < len(pending) and pending[next_new] == row_idx:
+                next_new += 1
+            writer.write(_edit_row(prefix, patterns, row_text, match, attrs, row_idx, edits, restyle))
+
+        for row in pending[next_new:]:
+            writer.write(_new_row(prefix, row, edits, restyle))
+        writer.write(f'</{prefix}sheetData>')
+        writer.write(_edit_tail(reader.rest(), prefix, edits))
+    finally:
+        writer.flush()
+        writer.detach()
+        reader.close()
+
+
+# ========== ROWS ==========
+
+def _cell_xml(prefix, row, col, style_id):
+    return f'<{prefix}c r="{get_column_letter(col)}{row}" s="{style_id}"/>'
+
+
+def _row_attrs(attrs, row, height):
+    _set(attrs, 'r', row)
+    if height is not None:
+        _set(attrs, 'ht', _number(height))
+        _set(attrs, 'customHeight', '1')
+    return attrs
+
+
+def _new_row(prefix, row, edits, restyle):
+    row_plan = edits.cells.get(row, {})
+    attrs = _row_attrs([], row, edits.heights.get(row))
+    if not row_plan:
+        return _start_tag(prefix, 'row', attrs, empty=True)
+    cells = ''.join(_cell_xml(prefix, row, col, restyle(0, row_plan[col])) for col in sorted(row_plan))
+    return f'{_start_tag(prefix, "row", attrs)}{cells}</{prefix}row>'
+
+
+def _edit_row(prefix, patterns, row_text, start, attrs, row, edits, restyle):
+    row_plan = edits.cells.get(row)
+    height = edits.heights.get(row)
+    if not row_plan and height is None and _get(attrs, 'r') is not None:
+        return row_text
+
+    body = row_text[len(start.group(0)):len(row_text) - (0 if start.group(2) else len(f'</{prefix}row>'))]
+    parts = []
+    missing = sorted(row_plan or ())
+    inserted = False
+    pos = col_idx = 0
+    for cell in patterns['cell'].finditer(body):
+        cell_attrs = _attrs(cell.group(1))
+        reference = _get(cell_attrs, 'r')
+        col_idx = column_index(reference) if reference else col_idx + 1
+
+        parts.append(body[pos:cell.start()])
+        while missing and missing[0] < col_idx:
+            col = missing.pop(0)
+            parts.append(_cell_xml(prefix, row, col, restyle(0, row_plan[col])))
+            inserted = True
+        if missing and missing[0] == col_idx:
+            missing.pop(0)
+
+        if row_plan and col_idx in row_plan:
+            _set(cell_attrs, 'r', f'{get_column_letter(col_idx)}{row}')
+            _set(cell_attrs, 's', restyle(int(_get(cell_attrs, 's') or 0), row_plan[col_idx]))
+            rest = cell.group(0)[len(f'<{prefix}c{cell.group(1)}'):]
+            parts.append(_start_tag(prefix, 'c', cell_attrs)[:-1] + rest)
+        else:
+            parts.append(cell.group(0))
+        pos = cell.end()
+    parts.append(body[pos:])
+    for col in missing:
+        parts.append(_cell_xml(prefix, row, col, restyle(0, row_plan[col])))
+        inserted = True
+
+    attrs = _row_attrs(attrs, row, height)
+    if inserted:
+        # The recorded column span may no longer cover the row's cells
+        attrs = [(key, quoted) for key, quoted in attrs if key != 'spans']
+    content = ''.join(parts)
+    if not content:
+        return _start_tag(prefix, 'row', attrs, empty=True)
+    return f'{_start_tag(prefix, "row", attrs)}{content}</{prefix}row>'
+
+
+# ========== AROUND SHEETDATA ==========
+
+def _put(text, prefix, name, xml, default):
+    """Replace element name in text with xml (None removes it), or insert it at its schema position"""
+    existing = _element(prefix, name).search(text)
+    if existing:
+        return text[:existing.start()] + (xml or '') + text[existing.end():]
+    if xml is None:
+        return text
+    later = SHEET_ORDER[SHEET_ORDER.index(name) + 1:]
+    match = re.search(rf'<{re.escape(prefix)}(?:{"|".join(later)})\b', text)
+    at = match.start() if match else default
+    return text[:at] + xml + text[at:]
+
+
+def _edit_head(head, prefix, edits):
+    head = _put(head, prefix, 'dimension', f'<{prefix}dimension ref="{edits.dimension}"/>', len(head))
+    if edits.freeze:
+        head = _freeze(head, prefix, edits.freeze)
+    if edits.widths:
+        head = _put(head, prefix, 'cols', _cols(head, prefix, edits.widths), len(head))
+    return head
+
+
+def _edit_tail(tail, prefix, edits):
+    if edits.clear_rules:
+        tail = _element(prefix, 'conditionalFormatting').sub('', tail)
+    if edits.merges is None:
+        return tail
+    xml = None
+    if edits.merges:
+        refs = ''.join(f'<{prefix}mergeCell ref="{get_column_letter(min_col)}{min_row}:'
+                       f'{get_column_letter(max_col)}{max_row}"/>'
+                       for min_row, min_col, max_row, max_col in edits.merges)
+        xml = f'<{prefix}mergeCells count="{len(edits.merges)}">{refs}</{prefix}mergeCells>'
+    root_end = _patterns(prefix)['root_end'].search(tail)
+    return _put(tail, prefix, 'mergeCells', xml, root_end.start() if root_end else len(tail))
+
+
+def _pane_xml(prefix, top_left):
+    """Frozen panes above and left of top_left, as openpyxl's freeze_panes writes them"""
+    row, col = coordinate_to_tuple(top_left)
+    attrs = []
+    if col > 1:
+        attrs.append(('xSplit', f'"{col - 1}"'))
+    if row > 1:
+        attrs.append(('ySplit', f'"{row - 1}"'))
+    if col > 1 and row > 1:
+        active, selections = 'bottomRight', ('topRight', 'bottomLeft', 'bottomRight')
+    else:
+        active = 'topRight' if col > 1 else 'bottomLeft'
+        selections = (active,)
+    attrs += [('topLeftCell', f'"{top_left}"'), ('activePane', f'"{active}"'), ('state', '"frozen"')]
+    xml = _start_tag(prefix, 'pane', attrs, empty=True)
+    for name in selections:
+        selection = [('pane', f'"{name}"')]
+        if name == active:
+            selection += [('activeCell', f'"{top_left}"'), ('sqref', f'"{top_left}"')]
+        xml += _start_tag(prefix, 'selection', selection, empty=True)
+    return xml
+
+
+def _freeze(head, prefix, top_left):
+    panes = _pane_xml(prefix, top_left)
+    patterns = _patterns(prefix)
+    view = patterns['sheet_view'].search(head)
+    if view is None:
+        xml = (f'<{prefix}sheetViews><{prefix}sheetView workbookViewId="0">{panes}'
+               f'</{prefix}sheetView></{prefix}sheetViews>')
+        return _put(head, prefix, 'sheetViews', xml, len(head))
+    if view.group(2):
+        return (head[:view.start()] + f'<{prefix}sheetView{view.group(1)}>{panes}</{prefix}sheetView>'
+                + head[view.end():])
+    close = head.index(f'</{prefix}sheetView>', view.end())
+    inner = patterns['pane'].sub('', head[view.end():close])
+    return head[:view.end()] + panes + inner + head[close:]
+
+
+def _cols(head, prefix, widths):
+    """<cols> with the existing column ranges, split where a planned width overrides part of one"""
+    spans = []
+    existing = _element(prefix, 'cols').search(head)
+    if existing:
+        for col in _patterns(prefix)['col'].finditer(existing.group(0)):
+            attrs = _attrs(col.group(1))
+            other = [(key, quoted) for key, quoted in attrs if key not in ('min', 'max')]
+            spans.append((int(_get(attrs, 'min')), int(_get(attrs, 'max')), other))
+
+    for col, width in widths:
+        attrs = [(key, quoted) for key, quoted in _covering(spans, col) if key not in ('width', 'customWidth')]
+        attrs += [('width', f'"{_number(width)}"'), ('customWidth', '"1"')]
+        split = []
+        for first, last, other in spans:
+            if first <= col <= last:
+                if first < col:
+                    split.append((first, col - 1, other))
+                if col < last:
+                    split.append((col + 1, last, other))
+            else:
+                split.append((first, last, other))
+        spans = split + [(col, col, attrs)]
+    spans.sort(key=lambda span: span[0])
+    cols = ''.join(_start_tag(prefix, 'col', [('min', f'"{first}"'), ('max', f'"{last}"')] + attrs, empty=True)
+                   for first, last, attrs in spans)
+    return f'<{prefix}cols>{cols}</{prefix}cols>'
+
+
+def _covering(spans, col):
+    for first, last, attrs in spans:
+        if first <= col <= last:
+            return attrs
+    return []
@@ -0,0 +1,71 @@
+"""
+Write-only output helpers for restructured workbooks
+Small, fully styled sheets are built in memory and then streamed into an openpyxl
+write-only workbook; large value-only sheets are streamed row by row without ever
+creating a Cell object per source cell. Column widths, row heights and merged ranges
+are emitted before the first row, as write-only sheets require.
+"""
+
+from copy import copy
+
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.styles.cell_style import StyleArray
+
+
+class StyleCopier:
+    """Translate cell styles from a source workbook into a write-only workbook, once per distinct style"""
+
+    def __init__(self, ws_out):
+        self.ws_out = ws_out
+        self._translated = {}
+
+    def styled_cell(self, source_cell):
+        """WriteOnlyCell carrying source_cell's value and style"""
+        cell = WriteOnlyCell(self.ws_out, value=source_cell.value)
+        if not source_cell.has_style:
+            return cell
+
+        key = tuple(source_cell._style)
+        style = self._translated.get(key)
+        if style is None:
+            cell.font = copy(source_cell.font)
+            cell.fill = copy(source_cell.fill)
+            cell.border = copy(source_cell.border)
+            cell.alignment = copy(source_cell.alignment)
+            cell.number_format = source_cell.number_format
+            cell.protection = copy(source_cell.protection)
+            style = self._translated[key] = StyleArray(cell._style)
+        else:
+            cell._style = StyleArray(style)
+        return cell
+
+
+def copy_sheet_streamed(ws_source, ws_out):
+    """Stream a (small, in-memory) formatted worksheet into a write-only worksheet"""
+
+    # Everything that lives in the sheet header or tail has to be set before rows are written
+    for letter, dimension in ws_source.column_dimensions.items():
+        if dimension.width:
+            ws_out.column_dimensions[letter].width = dimension.width
+    for row, dimension in ws_source.row_dimensions.items():
+        if dimension.height:
+            ws_out.row_dimensions[row].height = dimension.height
+    for merged in ws_source.merged_cells.ranges:
+        ws_out.merged_cells.add(str(merged))
+    ws_out.freeze_panes = ws_source.freeze_panes
+    # Charts refer to their data by sheet title, which is the same in the output
+    for chart in ws_source._charts:
+        ws_out.add_chart(chart)
+
+    copier = StyleCopier(ws_out)
+    for row in ws_source.iter_rows():
+        ws_out.append([copier.styled_cell(cell) if cell.value is not None or cell.has_style else None
+                       for cell in row])
+
+
+def stream_data_source(ws_out, source_rows):
+    """Write the Data Source sheet straight from the source value rows (a list or a generator)"""
+    ws_out.row_dimensions[1].height = 20
+    ws_out.append(['Original Data Structure'])
+    for row in source_rows:
+        ws_out.append(row)
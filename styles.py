@@ -0,0 +1,177 @@
+"""
+Shared style registry for the portfolio formatting scripts
+Every Font/PatternFill/Border/Alignment is built once here, named cell styles combine them,
+and StyleRegistry resolves each named style to workbook style ids once so cells are
+styled by reference instead of constructing (and de-duplicating) new objects per cell.
+"""
+
+from openpyxl.styles import Font, PatternFill, Alignment, Border, Side
+from openpyxl.styles.cell_style import StyleArray
+from openpyxl.formatting.rule import FormulaRule, CellIsRule, DataBarRule
+
+
+def _solid(color):
+    return PatternFill(start_color=color, end_color=color, fill_type="solid")
+
+
+def _box(style):
+    side = Side(style=style, color="000000")
+    return Border(left=side, right=side, top=side, bottom=side)
+
+
+# Define color scheme
+HEADER_FILL = _solid("1F4788")
+SUBHEADER_FILL = _solid("4472C4")
+METRIC_FILL = _solid("D9E1F2")
+HIGHLIGHT_FILL = _solid("E7E6E6")
+DATA_FILL = _solid("FFFFFF")
+DETAIL_FILL = _solid("F2F2F2")
+
+# Section fills
+SECTION_FILLS = {
+    'trading': _solid("FFF2CC"),
+    'trading_activity': _solid("E2EFDA"),
+    'insights': _solid("E2EFDA"),
+    'actions': _solid("F4B084"),
+    'cash': _solid("F4B084"),
+    'market': _solid("F1DCDB"),
+}
+
+# Define fonts
+HEADER_FONT = Font(bold=True, size=12, color="FFFFFF")
+TITLE_FONT = Font(bold=True, size=16, color="FFFFFF")
+MONTHLY_TITLE_FONT = Font(bold=True, size=14, color="FFFFFF")
+SUBHEADER_FONT = Font(bold=True, size=11, color="FFFFFF")
+VALUE_FONT = Font(bold=True, size=11)
+BOLD_FONT = Font(bold=True, size=10)
+REGULAR_FONT = Font(size=10)
+DATE_FONT = Font(italic=True, size=10)
+
+# Define borders
+THIN_BORDER = _box('thin')
+THICK_BORDER = _box('medium')
+
+# Define alignments
+LEFT = Alignment(horizontal='left', vertical='center')
+LEFT_WRAP = Alignment(horizontal='left', vertical='center', wrap_text=True)
+CENTER = Alignment(horizontal='center', vertical='center')
+CENTER_WRAP = Alignment(horizontal='center', vertical='center', wrap_text=True)
+RIGHT = Alignment(horizontal='right', vertical='center')
+
+
+# Named cell styles. Only the attributes listed are applied; anything left out
+# (usually the font or number format) is kept from the cell as it was.
+CELL_STYLES = {
+    # Executive Summary
+    'title': dict(font=TITLE_FONT, fill=HEADER_FILL, alignment=LEFT_WRAP),
+    'date': dict(font=DATE_FONT),
+    'section_header': dict(font=SUBHEADER_FONT, fill=SUBHEADER_FILL, alignment=LEFT),
+    'column_header': dict(font=HEADER_FONT, fill=HEADER_FILL, border=THIN_BORDER, alignment=CENTER_WRAP),
+    'kpi_label': dict(font=BOLD_FONT, fill=METRIC_FILL, border=THIN_BORDER, alignment=LEFT_WRAP),
+    'kpi_value': dict(font=VALUE_FONT, fill=DATA_FILL, border=THIN_BORDER, alignment=RIGHT),
+    'kpi_detail': dict(font=REGULAR_FONT, fill=DETAIL_FILL, border=THIN_BORDER, alignment=LEFT),
+    'summary_label': dict(font=BOLD_FONT, fill=METRIC_FILL, border=THIN_BORDER, alignment=LEFT),
+    'trading_cell': dict(fill=SECTION_FILLS['trading'], border=THIN_BORDER, alignment=LEFT),
+    'insight_label': dict(font=REGULAR_FONT, fill=SECTION_FILLS['insights'], border=THIN_BORDER, alignment=LEFT_WRAP),
+    'insight_cell': dict(fill=SECTION_FILLS['insights'], border=THIN_BORDER),
+    'action_label': dict(font=REGULAR_FONT, fill=SECTION_FILLS['actions'], border=THIN_BORDER, alignment=LEFT_WRAP),
+    'action_cell': dict(fill=SECTION_FILLS['actions'], border=THIN_BORDER),
+
+    # Monthly Performance
+    'monthly_title': dict(font=MONTHLY_TITLE_FONT, fill=HEADER_FILL, alignment=LEFT_WRAP),
+    'row_label': dict(font=BOLD_FONT, fill=METRIC_FILL, border=THIN_BORDER, alignment=RIGHT),
+    'value_cell': dict(fill=DATA_FILL, border=THIN_BORDER, alignment=RIGHT),
+    'profit_cell': dict(fill=SECTION_FILLS['trading'], border=THIN_BORDER, alignment=RIGHT),
+    'activity_cell': dict(fill=SECTION_FILLS['trading_activity'], border=THIN_BORDER, alignment=RIGHT),
+    'cash_cell': dict(fill=SECTION_FILLS['cash'], border=THIN_BORDER, alignment=RIGHT),
+    'market_cell': dict(fill=SECTION_FILLS['market'], border=THIN_BORDER, alignment=RIGHT),
+    'grid_cell': dict(border=THIN_BORDER, alignment=RIGHT),
+
+    # Lighter variants used on freshly restructured workbooks (no wrapping, fonts left alone)
+    'title_plain': dict(font=TITLE_FONT, fill=HEADER_FILL, alignment=LEFT),
+    'section_header_plain': dict(font=SUBHEADER_FONT, fill=SUBHEADER_FILL),
+    'column_header_plain': dict(font=HEADER_FONT, fill=HEADER_FILL, border=THIN_BORDER, alignment=CENTER),
+    'label_plain': dict(font=BOLD_FONT, fill=METRIC_FILL, border=THIN_BORDER),
+    'detail_plain': dict(fill=DETAIL_FILL, border=THIN_BORDER),
+    'monthly_title_plain': dict(font=MONTHLY_TITLE_FONT, fill=HEADER_FILL),
+}
+
+# Conditional formatting (format_all.py --conditional): sheet-level rules over whole ranges,
+# so the Monthly Performance grid needs no per-cell style records however large it grows.
+# Each entry builds fresh rule objects - openpyxl numbers rules per sheet as they are added.
+GAIN_FONT = Font(color="006100")
+LOSS_FONT = Font(color="9C0006")
+VALUE_BAR_COLOR = "5B9BD5"
+
+
+def _band(fill):
+    # Always-true rule: paints the section fill and grid on every cell of the range
+    return lambda: [FormulaRule(formula=['TRUE'], fill=fill, border=THIN_BORDER)]
+
+
+CONDITIONAL_RULES = {
+    'value_band': _band(DATA_FILL),
+    'profit_band': _band(SECTION_FILLS['trading']),
+    'activity_band': _band(SECTION_FILLS['trading_activity']),
+    'cash_band': _band(SECTION_FILLS['cash']),
+    'market_band': _band(SECTION_FILLS['market']),
+    'gain_loss': lambda: [
+        CellIsRule(operator='greaterThan', formula=['0'], font=GAIN_FONT),
+        CellIsRule(operator='lessThan', formula=['0'], font=LOSS_FONT),
+    ],
+    'value_bars': lambda: [DataBarRule(start_type='min', end_type='max', color=VALUE_BAR_COLOR)],
+}
+
+
+# (cell style attribute, StyleArray field, workbook collection)
+_STYLE_FIELDS = (
+    ('font', 'fontId', '_fonts'),
+    ('fill', 'fillId', '_fills'),
+    ('border', 'borderId', '_borders'),
+    ('alignment', 'alignmentId', '_alignments'),
+)
+
+
+class StyleRegistry:
+    """
+    Per-workbook view of CELL_STYLES.
+    Each named style is added to the workbook's style tables the first time it is used;
+    after that, applying it only writes the cached ids into the cell's style array.
+    cells_styled counts every cell styled through the registry.
+    """
+
+    def __init__(self, wb):
+        self.wb = wb
+        self._resolved = {}
+        self.cells_styled = 0
+
+    def resolve(self, name):
+        """Return ((StyleArray field, id), ...) for a named style in this workbook"""
+        ids = self._resolved.get(name)
+        if ids is None:
+            spec = CELL_STYLES[name]
+            ids = tuple((field, getattr(self.wb, collection).add(spec[attr]))
+                        for attr, field, collection in _STYLE_FIELDS if attr in spec)
+            self._resolved[name] = ids
+        return ids
+
+    def apply(self, cell, name):
+        """Style a single cell with a named style"""
+        style = cell._style
+        if style is None:
+            style = cell._style = StyleArray()
+        for field, idx in self.resolve(name):
+            setattr(style, field, idx)
+        self.cells_styled += 1
+
+    def apply_row(self, ws, row, min_col, max_col, name):
+        """Style columns min_col..max_col of one row with the same named style"""
+        ids = self.resolve(name)
+        for col in range(min_col, max_col + 1):
+            cell = ws.cell(row=row, column=col)
+            style = cell._style
+            if style is None:
+                style = cell._style = StyleArray()
+            for field, idx in ids:
+                setattr(style, field, idx)
+        self.cells_styled += max(0, max_col - min_col + 1)
@@ -0,0 +1,268 @@
+"""
+Template-clone formatting for Type A reports
+The type_a layout and the named cell styles it uses are compiled once per process into a
+template: fonts, fills, borders and alignments as ready-made styles.xml fragments, plus
+the layout blocks. A report is then formatted at the zip/XML level instead of through the
+openpyxl object model - the template's style records are merged into the file's
+styles.xml, and the Executive Summary and Monthly Performance sheet XML get their style
+ids, row heights, merges, column widths and frozen panes rewritten by the streaming
+rewriter in sheet_stream.py, one row at a time. Every other part (Data Source, charts,
+cached formula results) is copied through unchanged without being parsed.
+"""
+
+import shutil
+import zipfile
+import xml.etree.ElementTree as ET
+from copy import deepcopy
+from functools import lru_cache
+from collections import namedtuple
+
+from openpyxl.utils import get_column_letter
+from openpyxl.xml.functions import tostring as openpyxl_tostring
+
+from detect import sheet_paths, shared_strings
+from layout import get_layout, plan_layout, replaced_merges, value_cells
+from sheet_stream import SheetEdits, scan_sheet, scanned_value, shared_indices, rewrite_sheet
+from styles import CELL_STYLES
+
+
+MAIN_NS = 'http://schemas.openxmlformats.org/spreadsheetml/2006/main'
+_MAIN = '{%s}' % MAIN_NS
+_MC_IGNORABLE = '{http://schemas.openxmlformats.org/markup-compatibility/2006}Ignorable'
+
+TEMPLATE_SHEETS = ('Executive Summary', 'Monthly Performance')
+
+# (cell style attribute, styles.xml list, xf id attribute, xf apply flag)
+_STYLE_PARTS = (
+    ('font', 'fonts', 'fontId', 'applyFont'),
+    ('fill', 'fills', 'fillId', 'applyFill'),
+    ('border', 'borders', 'borderId', 'applyBorder'),
+)
+
+Template = namedtuple('Template', ['layout', 'styles'])
+
+ET.register_namespace('', MAIN_NS)
+
+
+# ========== COMPILING THE TEMPLATE ==========
+
+def _qualify(elem):
+    """Put un-namespaced elements (as openpyxl's to_tree() builds them) into the main namespace"""
+    for node in elem.iter():
+        if not node.tag.startswith('{'):
+            node.tag = _MAIN + node.tag
+    return elem
+
+
+def _fragment(style_object):
+    return ET.tostring(_qualify(ET.fromstring(openpyxl_tostring(style_object.to_tree()))))
+
+
+@lru_cache(maxsize=None)
+def get_template(name='type_a'):
+    """The compiled template for a layout: (compiled layout, {style: {attribute: XML fragment}})"""
+    styles = {}
+    for style_name, spec in CELL_STYLES.items():
+        styles[style_name] = {attr: _fragment(spec[attr])
+                              for attr in ('font', 'fill', 'border', 'alignment') if attr in spec}
+    return Template(get_layout(name), styles)
+
+
+# ========== XML HELPERS ==========
+
+def _parse(data):
+    """(root element, {prefix: uri}) - prefixes are registered so they survive re-serialising"""
+    namespaces = {}
+    for _, (prefix, uri) in ET.iterparse(_BytesReader(data), events=('start-ns',)):
+        namespaces.setdefault(prefix, uri)
+        try:
+            ET.register_namespace(prefix, uri)
+        except ValueError:
+            pass    # reserved 'ns0'-style prefixes; ElementTree picks its own
+    return ET.fromstring(data), namespaces
+
+
+class _BytesReader:
+    """Minimal file object over bytes for iterparse"""
+
+    def __init__(self, data):
+        self.data = data
+        self.pos = 0
+
+    def read(self, size=-1):
+        end = len(self.data) if size < 0 else self.pos + size
+        chunk = self.data[self.pos:end]
+        self.pos = end
+        return chunk
+
+
+def _serialize(root, namespaces):
+    data = ET.tostring(root, encoding='UTF-8', xml_declaration=True)
+    # Prefixes only named in mc:Ignorable aren't used by any element, so ElementTree drops their
+    # declarations - Excel then reports the file as damaged. Put them back on the root element.
+    ignorable = root.get(_MC_IGNORABLE)
+    if ignorable:
+        head_end = data.index(b'>', data.index(b'<', data.index(b'?>') + 2))
+        head = data[:head_end]
+        missing = [p for p in ignorable.split() if f'xmlns:{p}='.encode() not in head and p in namespaces]
+        extra = ''.join(f' xmlns:{p}="{namespaces[p]}"' for p in missing).encode()
+        data = data[:head_end] + extra + data[head_end:]
+    return data
+
+
+# ========== STYLES.XML ==========
+
+class StyleSheetMerge:
+    """
+    A file's styles.xml with template styles added on demand.
+    Each (existing xf, named style) pair becomes one new cell format that keeps the
+    existing number format and protection and takes the named style's font, fill, border
+    and alignment - the same result as StyleRegistry.apply. Records the file already has
+    (from an earlier run) are reused, so re-formatting a report doesn't grow it.
+    """
+
+    def __init__(self, data, template):
+        self.root, self.namespaces = _parse(data)
+        self.template = template
+        self.cell_xfs = self.root.find(_MAIN + 'cellXfs')
+        self._known = {}
+        for list_name in ('fonts', 'fills', 'borders'):
+            parent = self.root.find(_MAIN + list_name)
+            self._known[list_name] = {ET.tostring(child): idx for idx, child in enumerate(parent)}
+        self._known_xfs = {ET.tostring(xf): idx for idx, xf in enumerate(self.cell_xfs)}
+        self._xfs = {}
+
+    def _part_id(self, list_name, fragment):
+        known = self._known[list_name]
+        if fragment not in known:
+            parent = self.root.find(_MAIN + list_name)
+            parent.append(ET.fromstring(fragment))
+            parent.set('count', str(len(parent)))
+            known[fragment] = len(parent) - 1
+        return known[fragment]
+
+    def xf_for(self, base, style):
+        """Cell format id for a cell that had format base, styled with a named style"""
+        key = (base, style)
+        if key in self._xfs:
+            return self._xfs[key]
+
+        if base < len(self.cell_xfs):
+            xf = deepcopy(self.cell_xfs[base])
+        else:
+            xf = ET.Element(_MAIN + 'xf', numFmtId='0', fontId='0', fillId='0', borderId='0', xfId='0')
+        parts = self.template.styles[style]
+        for attr, list_name, id_attr, apply_attr in _STYLE_PARTS:
+            if attr in parts:
+                xf.set(id_attr, str(self._part_id(list_name, parts[attr])))
+                xf.set(apply_attr, '1')
+        if 'alignment' in parts:
+            previous = xf.find(_MAIN + 'alignment')
+            if previous is not None:
+                xf.remove(previous)
+            xf.insert(0, ET.fromstring(parts['alignment']))
+            xf.set('applyAlignment', '1')
+
+        serialized = ET.tostring(xf)
+        idx = self._known_xfs.get(serialized)
+        if idx is None:
+            self.cell_xfs.append(xf)
+            self.cell_xfs.set('count', str(len(self.cell_xfs)))
+            idx = self._known_xfs[serialized] = len(self.cell_xfs) - 1
+        self._xfs[key] = idx
+        return idx
+
+    def to_bytes(self):
+        return _serialize(self.root, self.namespaces)
+
+
+# ========== RENDERING A REPORT ==========
+
+def _merges(scan, planned):
+    """The sheet's merges after the layout: overlapping single-row merges replaced by the planned ones"""
+    if not scan.merges and not planned:
+        return None
+    existing = [(min_row, min_col, max_col) for min_row, min_col, max_row, max_col in scan.merges
+                if min_row == max_row]
+    dropped = set(replaced_merges(existing, planned))
+    merges = [m for m in scan.merges if not (m[0] == m[2] and (m[0], m[1], m[3]) in dropped)]
+    for row, (first_col, last_col) in planned:
+        if (row, first_col, row, last_col) not in merges:
+            merges.append((row, first_col, row, last_col))
+    return merges
+
+
+def _dimension(scan, plan, merges):
+    max_row = max([scan.max_row] + list(plan.cells) + list(plan.heights) + [m[2] for m in merges or ()])
+    max_col = max([scan.max_col] + [col for row_plan in plan.cells.values() for col in row_plan]
+                  + [m[3] for m in merges or ()])
+    return f'A1:{get_column_letter(max_col)}{max_row}'
+
+
+def _entry(info):
+    """Fresh zip entry with the name, date, compression and attributes of info"""
+    entry = zipfile.ZipInfo(info.filename, info.date_time)
+    entry.compress_type = info.compress_type
+    entry.external_attr = info.external_attr
+    return entry
+
+
+class TemplateOutput:
+    """
+    A report formatted from the template; save(path) writes it (usable with output.atomic_save).
+    The sheets are rewritten and every other part copied while saving, so only one row of a
+    sheet and one chunk of any other part is in memory at a time. styles.xml is written last,
+    once the rewritten sheets have added the cell formats they use.
+    """
+
+    def __init__(self, filepath, edits, stylesheet, cells_styled, has_charts):
+        self.filepath = filepath
+        self.edits = edits
+        self.stylesheet = stylesheet
+        self.cells_styled = cells_styled
+        self.has_charts = has_charts
+
+    def save(self, path):
+        with zipfile.ZipFile(self.filepath) as zin, zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED) as zout:
+            styles_info = None
+            for info in zin.infolist():
+                if info.filename == 'xl/styles.xml':
+                    styles_info = info
+                    continue
+                with zin.open(info) as src, zout.open(_entry(info), 'w') as dst:
+                    if info.filename in self.edits:
+                        rewrite_sheet(src, dst, self.edits[info.filename], self.stylesheet.xf_for)
+                    else:
+                        shutil.copyfileobj(src, dst)
+            zout.writestr(_entry(styles_info), self.stylesheet.to_bytes())
+
+
+def render_template(filepath, name='type_a'):
+    """
+    Plan the formatting of a Type A report from the compiled template; returns a TemplateOutput.
+    The sheets are only scanned here (extent, merges and the values the layout's guards read).
+    """
+    template = get_template(name)
+    with zipfile.ZipFile(filepath) as zf:
+        members = sheet_paths(zf)
+        scans = {}
+        for title in TEMPLATE_SHEETS:
+            coordinates, columns = value_cells(template.layout[title])
+            with zf.open(members[title]) as fh:
+                scans[title] = scan_sheet(fh, coordinates, columns)
+        stylesheet = StyleSheetMerge(zf.read('xl/styles.xml'), template)
+        shared = shared_strings(zf, set().union(*(shared_indices(scan) for scan in scans.values())))
+
+    edits = {}
+    cells_styled = 0
+    for title, scan in scans.items():
+        sheet_layout = template.layout[title]
+        plan = plan_layout(sheet_layout, scan.max_row, scan.max_col,
+                           lambda row, col, scan=scan: scanned_value(scan, row, col, shared))
+        merges = _merges(scan, plan.merges)
+        edits[members[title]] = SheetEdits(plan.cells, plan.heights, merges, plan.widths,
+                                           sheet_layout.freeze, _dimension(scan, plan, merges),
+                                           sheet_layout.clear_rules)
+        cells_styled += sum(len(row_plan) for row_plan in plan.cells.values())
+
+    return TemplateOutput(filepath, edits, stylesheet, cells_styled, scans['Monthly Performance'].has_drawing)
@@ -0,0 +1,310 @@
+"""
+Ingestion daemon: watch an inbox directory and publish formatted reports to an outbox
+New workbooks are picked up once their size and mtime have stopped changing (so partially
+written uploads are never read), queued on a bounded queue and processed by a pool of
+worker processes: Type B files are restructured and then formatted, Type A files are
+formatted. Finished reports appear in the outbox in one rename; failures go to
+<outbox>/failed with the log of what went wrong.
+"""
+
+import io
+import os
+import sys
+import time
+import json
+import shutil
+import asyncio
+import argparse
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from contextlib import redirect_stdout
+
+from batch import resolve_jobs
+from detect import probe, describe, TYPE_B, UNKNOWN
+
+
+WORKBOOK_SUFFIXES = ('.xlsx', '.xlsm')
+
+
+class Counters:
+    """Throughput and latency counters for the running daemon"""
+
+    def __init__(self, window=500):
+        self.started = time.monotonic()
+        self.received = 0
+        self.processed = 0
+        self.failed = 0
+        self.in_flight = 0
+        self.cleanup_errors = 0     # uploads that couldn't be removed from the inbox or moved to failed
+        self.pool_restarts = 0
+        self.latencies = deque(maxlen=window)   # seconds from upload first seen to report ready
+        self.durations = deque(maxlen=window)   # seconds spent processing
+
+    def snapshot(self, queued=0):
+        uptime = time.monotonic() - self.started
+        done = self.processed + self.failed
+        return {
+            'uptime_s': round(uptime, 1),
+            'received': self.received,
+            'processed': self.processed,
+            'failed': self.failed,
+            'queued': queued,
+            'in_flight': self.in_flight,
+            'cleanup_errors': self.cleanup_errors,
+            'pool_restarts': self.pool_restarts,
+            'files_per_min': round(done / uptime * 60, 2) if uptime else 0.0,
+            'latency_p50_s': _percentile(self.latencies, 50),
+            'latency_p95_s': _percentile(self.latencies, 95),
+            'processing_p50_s': _percentile(self.durations, 50),
+        }
+
+
+def _percentile(values, pct):
+    if not values:
+        return None
+    ordered = sorted(values)
+    idx = min(len(ordered) - 1, round(pct / 100 * (len(ordered) - 1)))
+    return round(ordered[idx], 3)
+
+
+def _is_candidate(name):
+    # Skip Excel lock files (~$...), hidden/temporary names and anything that isn't a workbook
+    return name.lower().endswith(WORKBOOK_SUFFIXES) and not name.startswith(('~$', '.'))
+
+
+def scan_inbox(inbox, pending, settle):
+    """
+    Update pending {path: (size, mtime_ns, last changed, first seen)} from a directory listing
+    and return the paths whose size and mtime have been stable for at least settle seconds.
+    """
+    now = time.monotonic()
+    ready = []
+    present = set()
+    with os.scandir(inbox) as entries:
+        for entry in entries:
+            if not entry.is_file() or not _is_candidate(entry.name):
+                continue
+            stat = entry.stat()
+            present.add(entry.path)
+            signature = (stat.st_size, stat.st_mtime_ns)
+            previous = pending.get(entry.path)
+            if previous is None:
+                pending[entry.path] = signature + (now, now)
+            elif previous[:2] != signature:
+                pending[entry.path] = signature + (now, previous[3])
+            elif now - previous[2] >= settle and stat.st_size > 0:
+                ready.append(entry.path)
+
+    for path in list(pending):
+        if path not in present:
+            del pending[path]
+    return sorted(ready)
+
+
+def ingest(filepath, outbox):
+    """
+    Worker entry point: restructure (Type B) and format one upload, then publish it to outbox.
+    Works on a hidden copy in the outbox so readers never see a half-written report.
+    Returns (ok, message, log).
+    """
+    from pipeline import process_file
+
+    name = os.path.basename(filepath)
+    working = os.path.join(outbox, f'.partial-{name}')
+    log = io.StringIO()
+    try:
+        with redirect_stdout(log):
+            structure = probe(filepath)
+            print(f"  → Detected: {describe(structure.kind)}")
+            if structure.kind == UNKNOWN:
+                return False, 'unknown workbook structure', log.getvalue()
+
+            shutil.copyfile(filepath, working)
+            # One load and one save per upload; the working copy is never seen again, so nothing is cached
+            if process_file(working, cache_size=0) is False:
+                return False, 'restructure failed' if structure.kind == TYPE_B else 'format failed', log.getvalue()
+            os.replace(working, os.path.join(outbox, name))
+        return True, None, log.getvalue()
+    except Exception as e:
+        return False, str(e) or type(e).__name__, log.getvalue()
+    finally:
+        if os.path.exists(working):
+            os.remove(working)
+
+
+class IngestionDaemon:
+    """Poll the inbox, queue settled uploads (bounded) and run them on a process pool"""
+
+    def __init__(self, inbox, outbox, jobs=1, queue_size=32, settle=2.0, poll=0.5,
+                 stats_interval=30.0, status_file=None):
+        self.inbox = inbox
+        self.outbox = outbox
+        self.failed_dir = os.path.join(outbox, 'failed')
+        self.jobs = resolve_jobs(jobs, sys.maxsize)
+        self.queue_size = queue_size
+        self.settle = settle
+        self.poll = poll
+        self.stats_interval = stats_interval
+        self.status_file = status_file
+        self.counters = Counters()
+        self._pending = {}
+        self._claimed = set()   # queued or being processed
+
+    async def run(self, once=False):
+        """Run until cancelled (or, with once=True, until the inbox has been drained)"""
+        os.makedirs(self.outbox, exist_ok=True)
+        os.makedirs(self.failed_dir, exist_ok=True)
+        self.queue = asyncio.Queue(maxsize=self.queue_size)
+
+        self.pool = ProcessPoolExecutor(max_workers=self.jobs)
+        workers = [asyncio.create_task(self._worker()) for _ in range(self.jobs)]
+        reporter = asyncio.create_task(self._report_loop())
+        try:
+            await self._watch(once)
+            await self.queue.join()
+        finally:
+            for task in workers + [reporter]:
+                task.cancel()
+            await asyncio.gather(*workers, reporter, return_exceptions=True)
+            self.pool.shutdown()
+            self._write_status()
+
+    async def _watch(self, once):
+        while True:
+            ready = [p for p in scan_inbox(self.inbox, self._pending, self.settle) if p not in self._claimed]
+            for path in ready:
+                self._claimed.add(path)
+                self.counters.received += 1
+                # Blocks while the queue is full, so a flood of uploads can't outrun the workers
+                await self.queue.put((path, self._pending[path][3]))
+            if once and not self._pending.keys() - self._claimed:
+                return
+            await asyncio.sleep(self.poll)
+
+    async def _worker(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            path, arrived_at = await self.queue.get()
+            self.counters.in_flight += 1
+            start = time.monotonic()
+            pool = self.pool
+            try:
+                ok, message, log = await loop.run_in_executor(pool, ingest, path, self.outbox)
+            except BrokenProcessPool:
+                ok, message, log = False, 'worker process died', ''
+                self._restart_pool(pool)
+            except Exception as e:
+                ok, message, log = False, str(e) or type(e).__name__, ''
+            finally:
+                self.counters.in_flight -= 1
+            try:
+                self._finish(path, ok, message, log, start, arrived_at)
+            except Exception as e:
+                # One upload's cleanup failing must not stop this worker
+                self.counters.cleanup_errors += 1
+                print(f"✗ {os.path.basename(path)}: could not clean up after processing: {str(e) or type(e).__name__}")
+                if not os.path.exists(path):
+                    self._claimed.discard(path)
+                    self._pending.pop(path, None)
+                # Otherwise it stays claimed, so the same upload isn't picked up again and again
+            finally:
+                self.queue.task_done()
+
+    def _restart_pool(self, broken):
+        """Replace a pool whose worker process died; every later upload would fail on it"""
+        if self.pool is not broken:
+            return  # another worker already replaced it
+        broken.shutdown(wait=False, cancel_futures=True)
+        self.pool = ProcessPoolExecutor(max_workers=self.jobs)
+        self.counters.pool_restarts += 1
+        print("⚠ A worker process died - worker pool restarted")
+
+    def _finish(self, path, ok, message, log, start, arrived_at):
+        name = os.path.basename(path)
+        now = time.monotonic()
+        self.counters.durations.append(now - start)
+        if ok:
+            self.counters.processed += 1
+            self.counters.latencies.append(now - arrived_at)
+            os.remove(path)
+            print(f"✓ {name} ready {now - arrived_at:.2f}s after arriving")
+        else:
+            self.counters.failed += 1
+            shutil.move(path, os.path.join(self.failed_dir, name))
+            with open(os.path.join(self.failed_dir, name + '.log'), 'w', encoding='utf-8') as fh:
+                fh.write(log)
+                fh.write(f"\nError: {message}\n")
+            print(f"✗ {name} failed: {message}")
+        self._claimed.discard(path)
+        self._pending.pop(path, None)
+
+    async def _report_loop(self):
+        while True:
+            await asyncio.sleep(self.stats_interval)
+            stats = self.counters.snapshot(self.queue.qsize())
+            line = (f"  → {stats['processed']} processed, {stats['failed']} failed, {stats['queued']} queued, "
+                    f"{stats['files_per_min']} files/min")
+            if stats['latency_p50_s'] is not None:
+                line += f", latency p50 {stats['latency_p50_s']}s p95 {stats['latency_p95_s']}s"
+            print(line)
+            self._write_status()
+
+    def _write_status(self):
+        if not self.status_file:
+            return
+        stats = self.counters.snapshot(self.queue.qsize())
+        temp = self.status_file + '.tmp'
+        with open(temp, 'w') as fh:
+            json.dump(stats, fh, indent=2)
+        os.replace(temp, self.status_file)
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2:
+        print("\n" + "=" * 70)
+        print("PORTFOLIO INGESTION SERVICE")
+        print("Watches an inbox folder and publishes formatted reports to an outbox")
+        print("=" * 70)
+        print("\nUsage: python watcher.py <inbox> <outbox> [--jobs N] [--queue-size N] [--settle SECONDS] [--once]")
+        print("\nExample:")
+        print("  python watcher.py Inbox Reports --jobs 4")
+        print("  python watcher.py Inbox Reports --once   (process what is there, then exit)")
+        print("=" * 70 + "\n")
+        sys.exit(0)
+
+    parser = argparse.ArgumentParser(description="Portfolio ingestion service")
+    parser.add_argument('inbox', help='Directory new workbooks are dropped into')
+    parser.add_argument('outbox', help='Directory finished reports are published to')
+    parser.add_argument('--jobs', '-j', type=int, default=1, metavar='N',
+                        help='Worker processes (0 = one per CPU core, default: 1)')
+    parser.add_argument('--queue-size', type=int, default=32, metavar='N',
+                        help='Uploads waiting for a worker before the watcher stops taking more')
+    parser.add_argument('--settle', type=float, default=2.0, metavar='SECONDS',
+                        help='How long a file must stay unchanged before it is picked up')
+    parser.add_argument('--poll', type=float, default=0.5, metavar='SECONDS', help='Inbox polling interval')
+    parser.add_argument('--stats-interval', type=float, default=30.0, metavar='SECONDS',
+                        help='How often counters are printed (and written to --status)')
+    parser.add_argument('--status', metavar='FILE', help='JSON file kept up to date with the counters')
+    parser.add_argument('--once', action='store_true', help='Exit once the inbox is empty')
+    args = parser.parse_args()
+
+    daemon = IngestionDaemon(args.inbox, args.outbox, jobs=args.jobs, queue_size=args.queue_size,
+                             settle=args.settle, poll=args.poll, stats_interval=args.stats_interval,
+                             status_file=args.status)
+
+    print("\n" + "=" * 70)
+    print(f"Watching {args.inbox} → {args.outbox} with {daemon.jobs} worker(s) (Ctrl+C to stop)")
+    print("=" * 70)
+
+    try:
+        asyncio.run(daemon.run(once=args.once))
+    except KeyboardInterrupt:
+        pass
+
+    stats = daemon.counters.snapshot()
+    print("=" * 70)
+    print(f"STOPPED: {stats['processed']} report(s) published, {stats['failed']} failed")
+    if stats['latency_p50_s'] is not None:
+        print(f"Latency: p50 {stats['latency_p50_s']}s, p95 {stats['latency_p95_s']}s")
+    print("=" * 70 + "\n")